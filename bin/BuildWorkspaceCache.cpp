@@ -0,0 +1,77 @@
+#include <string>
+#include <vector>
+#include <iostream>
+#include "boost/program_options.hpp"
+#include "boost/algorithm/string.hpp"
+#include "TSystem.h"
+#include "CombineHarvester/MSSMvsSMRun2Legacy/interface/WorkspaceCache.h"
+
+namespace po = boost::program_options;
+
+using namespace std;
+
+int main(int argc, char* argv[]) {
+  // Need this to read combine workspaces
+  gSystem->Load("libHiggsAnalysisCombinedLimit");
+
+  string workspace  = "";
+  string cache_dir  = "";
+  vector<string> categories;
+  string data       = "data_obs";
+
+  po::options_description help_config("Help");
+  help_config.add_options()
+    ("help,h", "produce help message");
+
+  po::options_description config("Configuration");
+  config.add_options()
+    ("workspace,w",
+      po::value<string>(&workspace)->required(),
+      "The input workspace-containing file [REQUIRED]")
+    ("cache-dir",
+      po::value<string>(&cache_dir)->required(),
+      "Directory of the workspace snapshots [REQUIRED]")
+    ("category,c",
+      po::value<vector<string>>(&categories),
+      "Categories of one snapshot, separated by commas. Can be given several times for several snapshots. "
+      "By default, one snapshot is written for each category of the workspace")
+    ("data",
+      po::value<string>(&data)->default_value(data),
+      "The name of the dataset in the workspace");
+
+  po::variables_map vm;
+
+  po::store(po::command_line_parser(argc, argv)
+    .options(help_config).allow_unregistered().run(), vm);
+  po::notify(vm);
+  if (vm.count("help")) {
+    std::cout << config << std::endl;
+    std::cout << "Example usage:" << std::endl << std::endl;
+    std::cout << "BuildWorkspaceCache -w ws_htt_tt_2018.root --cache-dir workspace_cache \\" << std::endl;
+    std::cout << "                    -c htt_tt_32_2018,htt_tt_35_2018 -c htt_tt_32_2018 -c htt_tt_35_2018" << std::endl;
+    return 1;
+  }
+  po::store(po::command_line_parser(argc, argv).options(config).run(), vm);
+  po::notify(vm);
+
+  // The full workspace is read at most once for all snapshots
+  ch::WorkspaceCache cache(workspace, cache_dir, "w", "ModelConfig", data);
+  vector<vector<string>> snapshots;
+  for (auto const& item : categories) {
+    vector<string> snapshot;
+    boost::split(snapshot, item, boost::is_any_of(","));
+    snapshots.push_back(snapshot);
+  }
+  if (snapshots.empty()) {
+    for (auto const& category : cache.Categories()) snapshots.push_back({category});
+  }
+
+  unsigned built = 0;
+  for (auto const& snapshot : snapshots) {
+    if (cache.UpToDate(snapshot)) continue;
+    cache.Build(snapshot);
+    ++built;
+  }
+  std::cout << ">> " << built << " of " << snapshots.size() << " workspace snapshots built, the others were up to date" << std::endl;
+  return 0;
+}
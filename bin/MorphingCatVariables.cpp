@@ -11,6 +11,7 @@
 #include "CombineHarvester/CombineTools/interface/Utilities.h"
 #include "CombineHarvester/MSSMvsSMRun2Legacy/interface/HttSystematics_MSSMvsSMRun2.h"
 #include "CombineHarvester/MSSMvsSMRun2Legacy/interface/BinomialBinByBin.h"
+#include "CombineHarvester/MSSMvsSMRun2Legacy/interface/ShapeFileIndex.h"
 #include "CombineHarvester/MSSMvsSMRun2Legacy/interface/dout_tools.h"
 #include "RooRealVar.h"
 #include "RooWorkspace.h"
@@ -271,16 +272,17 @@ int main(int argc, char **argv) {
     if (mode == "categorisation-plots") {
         input_file_base = input_dir[chn] + "htt_" + category + ".inputs-mssm-vs-sm-Run" + era_tag + "-" + variable + ".root";
     }
+    ch::ShapeFileIndex shapes(input_file_base);
 
-    cb.cp().channel({chn}).backgrounds().ExtractShapes(
-      input_file_base, "$BIN/$PROCESS", "$BIN/$PROCESS_$SYSTEMATIC");
+    shapes.ExtractShapes(cb.cp().channel({chn}).backgrounds(),
+      "$BIN/$PROCESS", "$BIN/$PROCESS_$SYSTEMATIC");
     if (mode == "categorisation-plots") {
-        cb.cp().channel({chn}).process(mssm_bbH_signals).ExtractShapes(
-          input_file_base, "$BIN/$PROCESS$MASS", "$BIN/$PROCESS$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_bbH_signals),
+          "$BIN/$PROCESS$MASS", "$BIN/$PROCESS$MASS_$SYSTEMATIC");
     }
     else {
-        cb.cp().channel({chn}).process(main_sm_signals).ExtractShapes(
-          input_file_base, "$BIN/$PROCESS$MASS", "$BIN/$PROCESS$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process(main_sm_signals),
+          "$BIN/$PROCESS$MASS", "$BIN/$PROCESS$MASS_$SYSTEMATIC");
     }
   }
 
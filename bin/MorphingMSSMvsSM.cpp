@@ -11,6 +11,7 @@
 #include "CombineHarvester/CombineTools/interface/Utilities.h"
 #include "CombineHarvester/MSSMvsSMRun2Legacy/interface/HttSystematics_MSSMvsSMRun2.h"
 #include "CombineHarvester/MSSMvsSMRun2Legacy/interface/BinomialBinByBin.h"
+#include "CombineHarvester/MSSMvsSMRun2Legacy/interface/ShapeFileIndex.h"
 #include "CombineHarvester/MSSMvsSMRun2Legacy/interface/dout_tools.h"
 #include "RooRealVar.h"
 #include "RooWorkspace.h"
@@ -23,6 +24,7 @@
 #include "boost/program_options.hpp"
 #include "boost/regex.hpp"
 #include <cstdlib>
+#include <fstream>
 #include <iostream>
 #include <map>
 #include <set>
@@ -105,6 +107,21 @@ void ZeroOppSignBins(TH1 *h) {
   }
 }
 
+bool IsSMCategory(string const& category) {
+  // categories of the SM analysis, for which the SM Higgs boson templates are added to the backgrounds
+  static const std::set<string> sm_categories = {
+    "et_xxh", "et_tt", "et_zll", "et_misc", "et_emb", "et_ff",
+    "et_xxh_bin_1", "et_xxh_bin_2", "et_xxh_bin_3", "et_xxh_bin_4", "et_xxh_bin_5", "et_xxh_bin_6",
+    "mt_xxh", "mt_tt", "mt_zll", "mt_misc", "mt_emb", "mt_ff",
+    "mt_xxh_bin_1", "mt_xxh_bin_2", "mt_xxh_bin_3", "mt_xxh_bin_4", "mt_xxh_bin_5", "mt_xxh_bin_6",
+    "tt_xxh", "tt_misc", "tt_emb", "tt_ff",
+    "tt_xxh_bin_1", "tt_xxh_bin_2", "tt_xxh_bin_3", "tt_xxh_bin_4", "tt_xxh_bin_5", "tt_xxh_bin_6",
+    "em_xxh", "em_tt", "em_ss", "em_misc", "em_db", "em_emb",
+    "em_xxh_bin_1", "em_xxh_bin_2", "em_xxh_bin_3", "em_xxh_bin_4", "em_xxh_bin_5", "em_xxh_bin_6"
+  };
+  return sm_categories.count(category) > 0;
+}
+
 int main(int argc, char **argv) {
   typedef vector<string> VString;
   typedef vector<pair<int, string>> Categories;
@@ -123,6 +140,8 @@ int main(int argc, char **argv) {
   string category = "mt_nobtag_lowmsv_0jet_tightmt";
   string variable = "m_sv_puppi";
   string non_morphed_mass = "700";
+  string list_templates = "";
+  string list_categories = "";
 
   bool do_morph = true;
   bool auto_rebin = false;
@@ -163,7 +182,7 @@ int main(int argc, char **argv) {
       ("sm_gg_fractions", po::value<string>(&sm_gg_fractions)->default_value(sm_gg_fractions))
       ("sm_predictions", po::value<string>(&sm_predictions)->default_value(sm_predictions))
       ("channel", po::value<string>(&chan)->default_value(chan), "single channel to process")
-      ("category", po::value<string>(&category)->default_value(category))
+      ("category", po::value<string>(&category)->default_value(category), "single category, comma separated list of categories of one channel, <channel>_all or all")
       ("variable", po::value<string>(&variable)->default_value(variable))
       ("non-morphed-mass", po::value<string>(&non_morphed_mass)->default_value(non_morphed_mass))
       ("do-morph", po::value<bool>(&do_morph)->default_value(do_morph))
@@ -194,6 +213,8 @@ int main(int argc, char **argv) {
       ("enable_bsm_lowmass", po::value<bool>(&enable_bsm_lowmass)->default_value(enable_bsm_lowmass))
       ("prop_plot", po::value<bool>(&prop_plot)->default_value(false))
       ("cbyear_plot", po::value<bool>(&cbyear_plot)->default_value(false))
+      ("list-templates", po::value<string>(&list_templates)->default_value(list_templates), "write the templates required from the input files to this file and exit, without reading the input files")
+      ("list-categories", po::value<string>(&list_categories)->default_value(list_categories), "write the categories of the channels and the categorization to this file and exit, one line per comma separated group of categories which can be processed by a single run")
       ("help", "produce help message");
   po::store(po::command_line_parser(argc, argv).options(config).run(), vm);
   po::notify(vm);
@@ -316,11 +337,23 @@ int main(int argc, char **argv) {
   if (chan.find("em") != std::string::npos)
     chns.push_back("em");
 
-  // Define restriction to the channel defined by '--category' option
+  // Define restriction to the channel defined by '--category' option. Several categories of the same channel
+  // can be processed at once, given as comma separated list or as '<channel>_all' for all categories of the
+  // channel. The shapes, systematics and ggH fractions are then loaded only once for all of them.
+  VString categories;
+  bool all_channel_categories = false;
   if(category != "all"){
+    boost::split(categories, category, boost::is_any_of(","));
     std::vector<std::string> category_split;
-    boost::split(category_split, category, boost::is_any_of("_"));
+    boost::split(category_split, categories.at(0), boost::is_any_of("_"));
     chns = {category_split.at(0)};
+    for(auto cat : categories){
+      if(!starts_with(cat, chns.at(0) + "_")){
+        std::cout << "ERROR: all categories of the 'category' option have to belong to the same channel, found " << cat << " and " << categories.at(0) << std::endl;
+        exit(1);
+      }
+    }
+    all_channel_categories = (categories.size() == 1 && categories.at(0) == chns.at(0) + "_all");
   }
   doutnonl("Channels:\n\t");
   dprintVector(chns);
@@ -681,41 +714,9 @@ int main(int argc, char **argv) {
     bkg_procs["mt"] = JoinStr({bkg_procs["mt"],main_sm_signals,sm_signals});
     bkg_procs["et"] = JoinStr({bkg_procs["et"],main_sm_signals,sm_signals});
     bkg_procs["em"] = JoinStr({bkg_procs["em"],main_sm_signals,sm_signals,bkgs_HWW});
-    if(category == "et_xxh" || category == "et_tt" || category == "et_zll" || category == "et_misc" || category == "et_emb" || category == "et_ff" ||
-       category == "et_xxh_bin_1" || category == "et_xxh_bin_2" || category == "et_xxh_bin_3" || category == "et_xxh_bin_4" || category == "et_xxh_bin_5" || category == "et_xxh_bin_6"){
-      bkg_procs["et"] = JoinStr({bkg_procs["et"],sm_signals,main_sm_signals,bkgs_HWW});
-    }
-    else if(category == "mt_xxh" || category == "mt_tt" || category == "mt_zll" || category == "mt_misc" || category == "mt_emb" || category == "mt_ff" ||
-            category == "mt_xxh_bin_1" || category == "mt_xxh_bin_2" || category == "mt_xxh_bin_3" || category == "mt_xxh_bin_4" || category == "mt_xxh_bin_5" || category == "mt_xxh_bin_6"){
-      bkg_procs["mt"] = JoinStr({bkg_procs["mt"],sm_signals,main_sm_signals,bkgs_HWW});
-    }
-    else if(category == "tt_xxh" || category == "tt_misc" || category == "tt_emb" || category == "tt_ff" ||
-            category == "tt_xxh_bin_1" || category == "tt_xxh_bin_2" || category == "tt_xxh_bin_3" || category == "tt_xxh_bin_4" || category == "tt_xxh_bin_5" || category == "tt_xxh_bin_6"){
-      bkg_procs["tt"] = JoinStr({bkg_procs["tt"],sm_signals,main_sm_signals,bkgs_HWW});
-    }
-    else if(category == "em_xxh" || category == "em_tt" || category == "em_ss" || category == "em_misc" || category == "em_db" || category == "em_emb" ||
-            category == "em_xxh_bin_1" || category == "em_xxh_bin_2" || category == "em_xxh_bin_3" || category == "em_xxh_bin_4" || category == "em_xxh_bin_5" || category == "em_xxh_bin_6"){
-      bkg_procs["em"] = JoinStr({bkg_procs["em"], sm_signals, main_sm_signals,bkgs_HWW});
-    }
   }
   else if(analysis == "bsm-model-dep-full"){
     bkg_procs["em"] = JoinStr({bkg_procs["em"],bkgs_HWW});
-    if(category == "et_xxh" || category == "et_tt" || category == "et_zll" || category == "et_misc" || category == "et_emb" || category == "et_ff" ||
-       category == "et_xxh_bin_1" || category == "et_xxh_bin_2" || category == "et_xxh_bin_3" || category == "et_xxh_bin_4" || category == "et_xxh_bin_5" || category == "et_xxh_bin_6"){
-      bkg_procs["et"] = JoinStr({bkg_procs["et"],bkgs_HWW});
-    }
-    else if(category == "mt_xxh" || category == "mt_tt" || category == "mt_zll" || category == "mt_misc" || category == "mt_emb" || category == "mt_ff" ||
-            category == "mt_xxh_bin_1" || category == "mt_xxh_bin_2" || category == "mt_xxh_bin_3" || category == "mt_xxh_bin_4" || category == "mt_xxh_bin_5" || category == "mt_xxh_bin_6"){
-      bkg_procs["mt"] = JoinStr({bkg_procs["mt"],bkgs_HWW});
-    }
-    else if(category == "tt_xxh" || category == "tt_misc" || category == "tt_emb" || category == "tt_ff" ||
-            category == "tt_xxh_bin_1" || category == "tt_xxh_bin_2" || category == "tt_xxh_bin_3" || category == "tt_xxh_bin_4" || category == "tt_xxh_bin_5" || category == "tt_xxh_bin_6"){
-      bkg_procs["tt"] = JoinStr({bkg_procs["tt"],bkgs_HWW});
-    }
-    else if(category == "em_xxh" || category == "em_tt" || category == "em_ss" || category == "em_misc" || category == "em_db" || category == "em_emb" ||
-            category == "em_xxh_bin_1" || category == "em_xxh_bin_2" || category == "em_xxh_bin_3" || category == "em_xxh_bin_4" || category == "em_xxh_bin_5" || category == "em_xxh_bin_6"){
-      bkg_procs["em"] = JoinStr({bkg_procs["em"],bkgs_HWW});
-    }
   }
 
   // Define MSSM model-dependent mass parameters mA, mH, mh
@@ -1085,6 +1086,44 @@ int main(int argc, char **argv) {
   }
   else throw std::runtime_error("Given categorization is not known.");
 
+  // Groups of categories which can be processed by a single run: each SM category on its own, all other categories of a channel together
+  if(!list_categories.empty()){
+    std::ofstream categories_file(list_categories);
+    for(auto chn : chns){
+      VString other_categories;
+      for(auto cat : cats[chn]){
+        if(IsSMCategory(cat.second)) categories_file << cat.second << std::endl;
+        else other_categories.push_back(cat.second);
+      }
+      if(!other_categories.empty()) categories_file << boost::join(other_categories, ",") << std::endl;
+    }
+    std::cout << "[INFO] Written the categories to " << list_categories << std::endl;
+    return 0;
+  }
+
+  // '<channel>_all' stands for the categories of the channel in the chosen categorization
+  if(all_channel_categories){
+    categories.clear();
+    for(auto cat : cats[chns.at(0)]) categories.push_back(cat.second);
+  }
+  // SM categories modify the backgrounds of the whole channel and can't be processed together with other categories
+  unsigned n_sm_categories = std::count_if(categories.begin(), categories.end(), IsSMCategory);
+  if(n_sm_categories > 0 && n_sm_categories < categories.size()){
+    std::cout << "ERROR: SM categories can't be processed together with other categories. Please split the 'category' option: " << category;
+    if(all_channel_categories) std::cout << " (" << boost::join(categories, ",") << ")";
+    std::cout << ", the groups of categories which can be processed together are written by the 'list-categories' option" << std::endl;
+    exit(1);
+  }
+  bool sm_category = n_sm_categories > 0;
+  if(sm_category){
+    if((analysis == "bsm-model-indep" && hSM_treatment == "hSM-in-bg") || analysis == "bsm-model-dep-additional"){
+      bkg_procs[chns.at(0)] = JoinStr({bkg_procs[chns.at(0)],sm_signals,main_sm_signals,bkgs_HWW});
+    }
+    else if(analysis == "bsm-model-dep-full"){
+      bkg_procs[chns.at(0)] = JoinStr({bkg_procs[chns.at(0)],bkgs_HWW});
+    }
+  }
+
   // Create combine harverster object
   ch::CombineHarvester cb;
   cb.SetFlag("workspaces-use-clone", true);
@@ -1405,8 +1444,14 @@ int main(int argc, char **argv) {
 
   dout("[INFO] Systematics added");
   // Define restriction to the desired category
-  if(category != "all"){
-    cb = cb.bin({category});
+  if(category != "all" && !all_channel_categories){
+    cb = cb.bin(categories);
+    for(auto cat : categories){
+      if(cb.cp().bin({cat}).bin_set().empty()){
+        std::cout << "ERROR: category " << cat << " is not defined for the chosen categorization." << std::endl;
+        exit(1);
+      }
+    }
   }
 
   if(no_shape_systs){
@@ -1415,33 +1460,36 @@ int main(int argc, char **argv) {
     });
   }
 
+  VString required_templates;
   for (string chn : chns) {
     string input_file_base = input_dir[chn] + "htt_all.inputs-mssm-vs-sm-Run" + era_tag + "-" + variable + ".root";
     if (mva) input_file_base = input_dir[chn] + "htt_" + chn + ".inputs-mssm-vs-sm-" + era_tag + "-" + variable + ".root";
     dout("[INFO] Extracting shapes from ", input_file_base);
+    // Keys of the input file are indexed once and shared by all template groups below
+    ch::ShapeFileIndex shapes(input_file_base, !list_templates.empty());
 
     // Adding background templates to processes. This also involves (if configured) SMH125 processes.
     // bsm-model-indep analysis with Higgs boson in BG: ggH125, qqH125, bbH125, and WH125, ZH125
     // bsm-model-dep-additional analysis: ggH125, qqH125, bbH125, and WH125, ZH125
-    cb.cp().channel({chn}).backgrounds().process({"bbH125"}, false).ExtractShapes(
-      input_file_base, "$BIN/$PROCESS", "$BIN/$PROCESS_$SYSTEMATIC");
-    cb.cp().channel({chn}).backgrounds().process({"bbH125"}).ExtractShapes( // "bbH125" needs special treatment because of template name spelling
-      input_file_base, "$BIN/bbH_125", "$BIN/bbH_125_$SYSTEMATIC");
+    shapes.ExtractShapes(cb.cp().channel({chn}).backgrounds().process({"bbH125"}, false),
+      "$BIN/$PROCESS", "$BIN/$PROCESS_$SYSTEMATIC");
+    shapes.ExtractShapes(cb.cp().channel({chn}).backgrounds().process({"bbH125"}), // "bbH125" needs special treatment because of template name spelling
+      "$BIN/bbH_125", "$BIN/bbH_125_$SYSTEMATIC");
 
 
     if(analysis == "sm"){
-      cb.cp().channel({chn}).process(ch::JoinStr({sm_signals,main_sm_signals})).process({"bbH125"}, false).ExtractShapes( // These are ggH125, qqH125, WH125, ZH125
-        input_file_base, "$BIN/$PROCESS$MASS", "$BIN/$PROCESS$MASS_$SYSTEMATIC");
-      cb.cp().channel({chn}).process({"bbH125"}).ExtractShapes( // "bbH125" needs special treatment because of template name spelling
-        input_file_base, "$BIN/bbH_125", "$BIN/bbH_125_$SYSTEMATIC");
+      shapes.ExtractShapes(cb.cp().channel({chn}).process(ch::JoinStr({sm_signals,main_sm_signals})).process({"bbH125"}, false), // These are ggH125, qqH125, WH125, ZH125
+        "$BIN/$PROCESS$MASS", "$BIN/$PROCESS$MASS_$SYSTEMATIC");
+      shapes.ExtractShapes(cb.cp().channel({chn}).process({"bbH125"}), // "bbH125" needs special treatment because of template name spelling
+        "$BIN/bbH_125", "$BIN/bbH_125_$SYSTEMATIC");
     }
     // Adding templates for configured SUSY signals
     // Comprising BSM signal h in model-independent case
     else if(analysis == "bsm-model-indep"){
-      cb.cp().channel({chn}).process(mssm_ggH_signals).ExtractShapes(
-        input_file_base, "$BIN/$PROCESS_$MASS", "$BIN/$PROCESS_$MASS_$SYSTEMATIC");
-      cb.cp().channel({chn}).process(mssm_bbH_signals).ExtractShapes(
-        input_file_base, "$BIN/bbH_$MASS", "$BIN/bbH_$MASS_$SYSTEMATIC");
+      shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_ggH_signals),
+        "$BIN/$PROCESS_$MASS", "$BIN/$PROCESS_$MASS_$SYSTEMATIC");
+      shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_bbH_signals),
+        "$BIN/bbH_$MASS", "$BIN/bbH_$MASS_$SYSTEMATIC");
     }
     // Adding templates for configured SUSY signals of model-dependent analyses
     // sm-like-light sub_analysis: H and A
@@ -1452,56 +1500,56 @@ int main(int argc, char **argv) {
       // It is simpler, when the templates correspond to H, h, or A as it is in for
       // sub_analysis sm-like-light and sm-like-heavy
       if(sub_analysis == "sm-like-light" || sub_analysis == "sm-like-heavy"){
-        cb.cp().channel({chn}).process(mssm_ggH_signals_additional).ExtractShapes(
-          input_file_base, "$BIN/$PROCESS_$MASS", "$BIN/$PROCESS_$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_ggH_signals_additional),
+          "$BIN/$PROCESS_$MASS", "$BIN/$PROCESS_$MASS_$SYSTEMATIC");
         if(enable_bsm_lowmass){
           for(auto ggH : mssm_ggH_lowmass_signals_additional){
             std::string template_ggH = boost::replace_all_copy(ggH, "_lowmass", "");
-            cb.cp().channel({chn}).process({ggH}).ExtractShapes(
-              input_file_base, "$BIN/" + template_ggH + "_$MASS", "$BIN/" + template_ggH + "_$MASS_$SYSTEMATIC");
+            shapes.ExtractShapes(cb.cp().channel({chn}).process({ggH}),
+              "$BIN/" + template_ggH + "_$MASS", "$BIN/" + template_ggH + "_$MASS_$SYSTEMATIC");
           }
         }
       }
       // In case of sub_analysis cpv, the templates have to be included explicitly
       // for ggPhi due to different naming of the process
       else if(sub_analysis == "cpv"){
-        cb.cp().channel({chn}).process({"ggH2_t"}).ExtractShapes(
-          input_file_base, "$BIN/ggH_t_$MASS", "$BIN/ggH_t_$MASS_$SYSTEMATIC");
-        cb.cp().channel({chn}).process({"ggH2_b"}).ExtractShapes(
-          input_file_base, "$BIN/ggH_b_$MASS", "$BIN/ggH_b_$MASS_$SYSTEMATIC");
-        cb.cp().channel({chn}).process({"ggH2_i"}).ExtractShapes(
-          input_file_base, "$BIN/ggH_i_$MASS", "$BIN/ggH_i_$MASS_$SYSTEMATIC");
-
-        cb.cp().channel({chn}).process({"ggH3_t"}).ExtractShapes(
-          input_file_base, "$BIN/ggA_t_$MASS", "$BIN/ggA_t_$MASS_$SYSTEMATIC");
-        cb.cp().channel({chn}).process({"ggH3_b"}).ExtractShapes(
-          input_file_base, "$BIN/ggA_b_$MASS", "$BIN/ggA_b_$MASS_$SYSTEMATIC");
-        cb.cp().channel({chn}).process({"ggH3_i"}).ExtractShapes(
-          input_file_base, "$BIN/ggA_i_$MASS", "$BIN/ggA_i_$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH2_t"}),
+          "$BIN/ggH_t_$MASS", "$BIN/ggH_t_$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH2_b"}),
+          "$BIN/ggH_b_$MASS", "$BIN/ggH_b_$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH2_i"}),
+          "$BIN/ggH_i_$MASS", "$BIN/ggH_i_$MASS_$SYSTEMATIC");
+
+        shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH3_t"}),
+          "$BIN/ggA_t_$MASS", "$BIN/ggA_t_$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH3_b"}),
+          "$BIN/ggA_b_$MASS", "$BIN/ggA_b_$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH3_i"}),
+          "$BIN/ggA_i_$MASS", "$BIN/ggA_i_$MASS_$SYSTEMATIC");
 
         if(enable_bsm_lowmass){
-          cb.cp().channel({chn}).process({"ggH2_t_lowmass"}).ExtractShapes(
-            input_file_base, "$BIN/ggH_t_$MASS", "$BIN/ggH_t_$MASS_$SYSTEMATIC");
-          cb.cp().channel({chn}).process({"ggH2_b_lowmass"}).ExtractShapes(
-            input_file_base, "$BIN/ggH_b_$MASS", "$BIN/ggH_b_$MASS_$SYSTEMATIC");
-          cb.cp().channel({chn}).process({"ggH2_i_lowmass"}).ExtractShapes(
-            input_file_base, "$BIN/ggH_i_$MASS", "$BIN/ggH_i_$MASS_$SYSTEMATIC");
-
-          cb.cp().channel({chn}).process({"ggH3_t_lowmass"}).ExtractShapes(
-            input_file_base, "$BIN/ggA_t_$MASS", "$BIN/ggA_t_$MASS_$SYSTEMATIC");
-          cb.cp().channel({chn}).process({"ggH3_b_lowmass"}).ExtractShapes(
-            input_file_base, "$BIN/ggA_b_$MASS", "$BIN/ggA_b_$MASS_$SYSTEMATIC");
-          cb.cp().channel({chn}).process({"ggH3_i_lowmass"}).ExtractShapes(
-            input_file_base, "$BIN/ggA_i_$MASS", "$BIN/ggA_i_$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH2_t_lowmass"}),
+            "$BIN/ggH_t_$MASS", "$BIN/ggH_t_$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH2_b_lowmass"}),
+            "$BIN/ggH_b_$MASS", "$BIN/ggH_b_$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH2_i_lowmass"}),
+            "$BIN/ggH_i_$MASS", "$BIN/ggH_i_$MASS_$SYSTEMATIC");
+
+          shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH3_t_lowmass"}),
+            "$BIN/ggA_t_$MASS", "$BIN/ggA_t_$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH3_b_lowmass"}),
+            "$BIN/ggA_b_$MASS", "$BIN/ggA_b_$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH3_i_lowmass"}),
+            "$BIN/ggA_i_$MASS", "$BIN/ggA_i_$MASS_$SYSTEMATIC");
         }
       }
       // Inclusion of additional bbPhi is simple for the preconfigured process names
       // in mssm_bbH_signals_additional, reflecting the corresponding sub_analysis
-      cb.cp().channel({chn}).process(mssm_bbH_signals_additional).ExtractShapes(
-        input_file_base, "$BIN/bbH_$MASS", "$BIN/bbH_$MASS_$SYSTEMATIC");
+      shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_bbH_signals_additional),
+        "$BIN/bbH_$MASS", "$BIN/bbH_$MASS_$SYSTEMATIC");
       if(enable_bsm_lowmass){
-        cb.cp().channel({chn}).process(mssm_bbH_lowmass_signals_additional).ExtractShapes(
-          input_file_base, "$BIN/bbH_$MASS", "$BIN/bbH_$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_bbH_lowmass_signals_additional),
+          "$BIN/bbH_$MASS", "$BIN/bbH_$MASS_$SYSTEMATIC");
       }
 
       // In case full neutral Higgs modelling needs to be used (h, H, A or H1, H2, H3),
@@ -1516,62 +1564,73 @@ int main(int argc, char **argv) {
         if(sm_like_hists == "bsm"){
           // It stays simple for ggPhi, in case of sub_analysis sm-like-light or sm-like-heavy
           if(sub_analysis == "sm-like-light" || sub_analysis == "sm-like-heavy"){
-            cb.cp().channel({chn}).process(mssm_ggH_signals_smlike).ExtractShapes(
-              input_file_base, "$BIN/$PROCESS_$MASS", "$BIN/$PROCESS_$MASS_$SYSTEMATIC");
+            shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_ggH_signals_smlike),
+              "$BIN/$PROCESS_$MASS", "$BIN/$PROCESS_$MASS_$SYSTEMATIC");
           }
           // Require explicit assignment for cpv sub_analysis for ggPhi due to different
           // template vs. process naming
           else if(sub_analysis == "cpv"){
-            cb.cp().channel({chn}).process({"ggH1_t"}).ExtractShapes(
-              input_file_base, "$BIN/ggh_t_$MASS", "$BIN/ggh_t_$MASS_$SYSTEMATIC");
-            cb.cp().channel({chn}).process({"ggH1_b"}).ExtractShapes(
-              input_file_base, "$BIN/ggh_b_$MASS", "$BIN/ggh_b_$MASS_$SYSTEMATIC");
-            cb.cp().channel({chn}).process({"ggH1_i"}).ExtractShapes(
-              input_file_base, "$BIN/ggh_i_$MASS", "$BIN/ggh_i_$MASS_$SYSTEMATIC");
+            shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH1_t"}),
+              "$BIN/ggh_t_$MASS", "$BIN/ggh_t_$MASS_$SYSTEMATIC");
+            shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH1_b"}),
+              "$BIN/ggh_b_$MASS", "$BIN/ggh_b_$MASS_$SYSTEMATIC");
+            shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggH1_i"}),
+              "$BIN/ggh_i_$MASS", "$BIN/ggh_i_$MASS_$SYSTEMATIC");
           }
           // It stays simple for bbPhi, since using always the sample template
-          cb.cp().channel({chn}).process(mssm_bbH_signals_smlike).ExtractShapes(
-            input_file_base, "$BIN/bbH_$MASS", "$BIN/bbH_$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_bbH_signals_smlike),
+            "$BIN/bbH_$MASS", "$BIN/bbH_$MASS_$SYSTEMATIC");
         }
         // Here, the SM125 templates are used for ggPhi and bbPhi
         else if(sm_like_hists == "sm125"){
-          cb.cp().channel({chn}).process(mssm_ggH_signals_smlike).ExtractShapes(
-            input_file_base, "$BIN/ggH125$MASS", "$BIN/ggH125$MASS_$SYSTEMATIC");
-          cb.cp().channel({chn}).process(mssm_bbH_signals_smlike).ExtractShapes(
-            input_file_base, "$BIN/bbH_125$MASS", "$BIN/bbH_125$MASS_$SYSTEMATIC"); // Technically, still using SUSY sample but always the 125 GeV template
+          shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_ggH_signals_smlike),
+            "$BIN/ggH125$MASS", "$BIN/ggH125$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_bbH_signals_smlike),
+            "$BIN/bbH_125$MASS", "$BIN/bbH_125$MASS_$SYSTEMATIC"); // Technically, still using SUSY sample but always the 125 GeV template
         }
         // Include qqPhi (and WPhi and ZPhi, if needed) always as 125 templates for
         // analysis bsm-model-dep-full
-        cb.cp().channel({chn}).process(qqh_bsm_signals).ExtractShapes(
-          input_file_base, "$BIN/qqH125$MASS", "$BIN/qqH125$MASS_$SYSTEMATIC");
+        shapes.ExtractShapes(cb.cp().channel({chn}).process(qqh_bsm_signals),
+          "$BIN/qqH125$MASS", "$BIN/qqH125$MASS_$SYSTEMATIC");
         if(sm){
-          cb.cp().channel({chn}).process(wh_bsm_signals).ExtractShapes(
-            input_file_base, "$BIN/WH125$MASS", "$BIN/WH125$MASS_$SYSTEMATIC");
-          cb.cp().channel({chn}).process(zh_bsm_signals).ExtractShapes(
-            input_file_base, "$BIN/ZH125$MASS", "$BIN/ZH125$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process(wh_bsm_signals),
+            "$BIN/WH125$MASS", "$BIN/WH125$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process(zh_bsm_signals),
+            "$BIN/ZH125$MASS", "$BIN/ZH125$MASS_$SYSTEMATIC");
         }
 
         // Adding SM125 signal templates for SM hypothesis of analysis bsm-model-dep-full
         // These comprise ggH125, qqH125, bbH125, and in SM categories WH125 and ZH125
         if(hSM_treatment == "no-hSM-in-bg"){
-          cb.cp().channel({chn}).process(ch::JoinStr({sm_signals, main_sm_signals})).process({"bbH125"}, false).ExtractShapes(
-            input_file_base, "$BIN/$PROCESS$MASS", "$BIN/$PROCESS$MASS_$SYSTEMATIC");
-          cb.cp().channel({chn}).process({"bbH125"}).ExtractShapes(
-            input_file_base, "$BIN/bbH_125$MASS", "$BIN/bbH_125$MASS_$SYSTEMATIC"); // "bbH125" needs special treatment because of template name spelling
+          shapes.ExtractShapes(cb.cp().channel({chn}).process(ch::JoinStr({sm_signals, main_sm_signals})).process({"bbH125"}, false),
+            "$BIN/$PROCESS$MASS", "$BIN/$PROCESS$MASS_$SYSTEMATIC");
+          shapes.ExtractShapes(cb.cp().channel({chn}).process({"bbH125"}),
+            "$BIN/bbH_125$MASS", "$BIN/bbH_125$MASS_$SYSTEMATIC"); // "bbH125" needs special treatment because of template name spelling
         }
       }
     }
     if((variable=="m_sv_puppi" || variable=="m_sv_VS_pt_tt_splitpT" || lowmass) && !(analysis == "bsm-model-dep-full" || analysis == "bsm-model-dep-additional")) {
-      cb.cp().channel({chn}).process(mssm_qqH_signals).ExtractShapes(
-        input_file_base, "$BIN/qqH$MASS", "$BIN/qqH$MASS_$SYSTEMATIC");
-      cb.cp().channel({chn}).process({"ggX_t"}).ExtractShapes(
-        input_file_base, "$BIN/ggh_t_$MASS", "$BIN/ggh_t_$MASS_$SYSTEMATIC");
-      cb.cp().channel({chn}).process({"ggX_b"}).ExtractShapes(
-        input_file_base, "$BIN/ggh_b_$MASS", "$BIN/ggh_b_$MASS_$SYSTEMATIC");
-      cb.cp().channel({chn}).process({"ggX_i"}).ExtractShapes(
-        input_file_base, "$BIN/ggh_i_$MASS", "$BIN/ggh_i_$MASS_$SYSTEMATIC");
+      shapes.ExtractShapes(cb.cp().channel({chn}).process(mssm_qqH_signals),
+        "$BIN/qqH$MASS", "$BIN/qqH$MASS_$SYSTEMATIC");
+      shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggX_t"}),
+        "$BIN/ggh_t_$MASS", "$BIN/ggh_t_$MASS_$SYSTEMATIC");
+      shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggX_b"}),
+        "$BIN/ggh_b_$MASS", "$BIN/ggh_b_$MASS_$SYSTEMATIC");
+      shapes.ExtractShapes(cb.cp().channel({chn}).process({"ggX_i"}),
+        "$BIN/ggh_i_$MASS", "$BIN/ggh_i_$MASS_$SYSTEMATIC");
 
     }
+    if(!list_templates.empty()){
+      for(auto const& path : shapes.requested()) required_templates.push_back(input_file_base + "\t" + path);
+    }
+  }
+
+  // Only the list of required templates is written, e.g. to generate synthetic input files
+  if(!list_templates.empty()){
+    std::ofstream templates_file(list_templates);
+    for(auto const& line : required_templates) templates_file << line << "\n";
+    std::cout << "[INFO] Written " << required_templates.size() << " required templates to " << list_templates << std::endl;
+    return 0;
   }
 
   // Rescale bbH125 to the right cross-section * BR (from 1pb to the value for 125.4 GeV)
@@ -1901,12 +1960,14 @@ int main(int argc, char **argv) {
       for(auto b : cb.cp().bin_id_set())
       {
         TString bstr = b;
-        TString cat = category;
-        std::cout << "[INFO] Desciding the binning for " << b << "/" << category << std::endl;
+        // the category of this bin, if several categories are processed at once
+        TString cat = (category == "all") ? category : *cb.cp().bin_id({b}).bin_set().begin();
+        std::cout << "[INFO] Desciding the binning for " << b << "/" << cat << std::endl;
         if (cat.Contains("xxh")){
           std::cout << "[INFO] Performing auto-rebinning for SM signal category.\n";
           auto rebin = ch::AutoRebin().SetBinThreshold(5.0).SetBinUncertFraction(0.9).SetRebinMode(1).SetPerformRebin(true).SetVerbosity(1);
-          rebin.Rebin(cb, cb);
+          auto cb_bin = cb.cp().bin_id({b});
+          rebin.Rebin(cb_bin, cb);
         }
         else {
           std::cout << "[INFO] Rebin background bin " << b << "\n";
@@ -1,4 +1,9 @@
 #include <map>
+#include <set>
+#include <tuple>
+#include <cmath>
+#include <functional>
+#include <memory>
 #include <iostream>
 #include <fstream>
 #include "boost/program_options.hpp"
@@ -7,28 +12,176 @@
 #include "boost/algorithm/string.hpp"
 #include "TSystem.h"
 #include "TH2F.h"
+#include "RooArgSet.h"
+#include "RooAbsPdf.h"
+#include "RooAbsReal.h"
+#include "RooFitResult.h"
+#include "TMatrixDSym.h"
 #include "CombineHarvester/CombineTools/interface/CombineHarvester.h"
 #include "CombineHarvester/CombineTools/interface/ParseCombineWorkspace.h"
 #include "CombineHarvester/CombineTools/interface/TFileIO.h"
 #include "CombineHarvester/CombineTools/interface/Logging.h"
+#include "CombineHarvester/MSSMvsSMRun2Legacy/interface/WorkspaceCache.h"
 
 namespace po = boost::program_options;
 
 using namespace std;
 
+// Names of the parameters the shapes and yields of the processes in cb can depend on: the variables of
+// their pdfs and normalisations, and the systematics attached to them
+std::set<std::string> DependentParameters(ch::CombineHarvester &cb) {
+  std::set<std::string> names = cb.syst_name_set();
+  auto add_variables = [&](RooAbsArg const* arg) {
+    std::unique_ptr<RooArgSet> variables(arg->getVariables());
+    std::unique_ptr<TIterator> iter(variables->createIterator());
+    for (TObject *var = iter->Next(); var != nullptr; var = iter->Next()) names.insert(var->GetName());
+  };
+  cb.ForEachProc([&](ch::Process *proc) {
+    if (proc->pdf()) add_variables(proc->pdf());
+    if (proc->norm()) add_variables(proc->norm());
+  });
+  return names;
+}
+
+// Write the nominal shape of the processes in cb and its variations by +-1 sigma of each fitted parameter.
+// The parameter values are changed in place and restored afterwards. If dependent is given, the parameters
+// not contained in it are skipped, instead of writing copies of the nominal shape. Otherwise, copies of the
+// nominal shape are also written for the fitted parameters in absent, which are missing in cb.
+void WriteShapeVariations(ch::CombineHarvester &cb, std::string const& name, std::string const& label,
+                          TH1F const& reference_binning, std::set<std::string> const* dependent,
+                          std::vector<std::string> const& absent) {
+  TH1F shape = ch::RestoreBinning(cb.GetShape(), reference_binning);
+  shape.SetName(name.c_str());
+  shape.SetTitle(name.c_str());
+  shape.Write();
+  std::cout << label << ": " << name << ", nominal yield: " << shape.Integral() << std::endl;
+  unsigned skipped = 0;
+  for (auto const& syst : cb.GetParameters()) {
+    if (0 == syst.err_d() && 0 == syst.err_u()) {
+      std::cout << "\tExcluding: " << syst.name() << std::endl;
+      continue; // Avoid parameters not used in the fit
+    }
+    if (dependent && !dependent->count(syst.name())) {
+      ++skipped;
+      continue;
+    }
+    ch::Parameter *par = cb.GetParameter(syst.name());
+    par->set_val(syst.val() + syst.err_u());
+    TH1F shape_up = ch::RestoreBinning(cb.GetShape(), reference_binning);
+    par->set_val(syst.val() + syst.err_d());
+    TH1F shape_down = ch::RestoreBinning(cb.GetShape(), reference_binning);
+    par->set_val(syst.val());
+
+    std::string up_name = name + "_" + syst.name() + "_Up";
+    std::string down_name = name + "_" + syst.name() + "_Down";
+    shape_up.SetName(up_name.c_str());
+    shape_up.SetTitle(up_name.c_str());
+    shape_up.Write();
+    shape_down.SetName(down_name.c_str());
+    shape_down.SetTitle(down_name.c_str());
+    shape_down.Write();
+  }
+  for (auto const& par_name : absent) {
+    if (dependent) break;
+    for (std::string shift : {"_Up", "_Down"}) {
+      TH1F shape_shifted = shape;
+      std::string shifted_name = name + "_" + par_name + shift;
+      shape_shifted.SetName(shifted_name.c_str());
+      shape_shifted.SetTitle(shifted_name.c_str());
+      shape_shifted.Write();
+    }
+  }
+  if (skipped) std::cout << "\tSkipped " << skipped << " parameters without influence on " << name << std::endl;
+}
+
+// Write the correlations between the fitted parameters with |rho| >= 1 % (after rounding to two digits) to
+// <output_directory>/<fit_name>_correlations.json as sparse list of (index1, index2, rho) with index1 > index2
+// into the list of parameters, and optionally also as CSV. The files are only written, if they do not exist yet
+// or are older than the fit result or were taken from another fit file, such that they are created once for all
+// categories using the same fit.
+void WriteCorrelations(RooFitResult const& fitres, std::string const& fit, std::string const& fit_name,
+                       std::string const& output_directory, bool csv) {
+  namespace fs = boost::filesystem;
+  fs::path json_file = fs::path(output_directory) / (fit_name + "_correlations.json");
+  fs::path csv_file = fs::path(output_directory) / (fit_name + "_correlations.csv");
+  std::string fit_path = fs::absolute(fit).string();
+  std::string fit_line = "  \"fit\": \"" + fit_path + "\",";
+  auto up_to_date = [&](fs::path const& path) {
+    return fs::exists(path) && fs::last_write_time(path) >= fs::last_write_time(fit);
+  };
+  // The existing correlations have to be taken from the same fit file, not only be newer than it
+  auto same_fit = [&]() {
+    std::ifstream file(json_file.string());
+    std::string line;
+    while (std::getline(file, line)) {
+      if (line == fit_line) return true;
+    }
+    return false;
+  };
+  if (up_to_date(json_file) && (!csv || up_to_date(csv_file)) && same_fit()) {
+    std::cout << "Correlations of " << fit_name << " are up to date in " << json_file.string() << std::endl;
+    return;
+  }
+
+  // Single pass over the dense correlation matrix, ordered as floatParsFinal
+  RooArgList const& parameters = fitres.floatParsFinal();
+  TMatrixDSym const& matrix = fitres.correlationMatrix();
+  double const* rho = matrix.GetMatrixArray();
+  int n = matrix.GetNrows();
+  std::vector<std::tuple<int, int, double>> correlations;
+  for (int i = 0; i < n; ++i) {
+    for (int j = 0; j < i; ++j) {
+      double correlation_val = std::round(100.0 * rho[i * n + j]) / 100.0;
+      if (std::abs(correlation_val) >= 1e-2) { // Include only correlations >= 1 %
+        correlations.emplace_back(i, j, correlation_val);
+      }
+    }
+  }
+
+  // Written to a temporary file first and moved in place, since several categories may be processed in parallel
+  auto write = [](fs::path const& path, std::function<void(std::ofstream&)> content) {
+    fs::path tmp = path.parent_path() / fs::unique_path(path.filename().string() + ".%%%%%%");
+    std::ofstream file(tmp.string());
+    content(file);
+    file.close();
+    fs::rename(tmp, path);
+  };
+  write(json_file, [&](std::ofstream &file) {
+    file << "{\n" << fit_line << "\n  \"fitname\": \"" << fit_name << "\",\n  \"threshold\": 0.01,\n  \"parameters\": [";
+    for (int i = 0; i < n; ++i) file << (i ? ", " : "") << "\"" << parameters.at(i)->GetName() << "\"";
+    file << "],\n  \"correlations\": [";
+    for (unsigned i = 0; i < correlations.size(); ++i) {
+      file << (i ? ",\n    " : "\n    ") << "[" << std::get<0>(correlations[i]) << ", " << std::get<1>(correlations[i]) << ", " << std::get<2>(correlations[i]) << "]";
+    }
+    file << "\n  ]\n}\n";
+  });
+  if (csv) {
+    write(csv_file, [&](std::ofstream &file) {
+      file << "Parameter1,Parameter2,Correlation\n";
+      for (auto const& c : correlations) {
+        file << parameters.at(std::get<0>(c))->GetName() << "," << parameters.at(std::get<1>(c))->GetName() << "," << std::get<2>(c) << "\n";
+      }
+    });
+  }
+  std::cout << "Stored " << correlations.size() << " correlations of " << n << " parameters in " << json_file.string() << std::endl;
+}
+
 int main(int argc, char* argv[]) {
 
   // Setup program options
-  std::string datacard   = "";
+  std::vector<std::string> datacards;
   std::string workspace  = "";
   std::string fit = "";
   std::string fit_name = "";
-  std::string category_name     = "";
+  std::vector<std::string> categories;
   std::string output_directory = "";
   std::string signal_mass_name = "";
   std::vector<unsigned int> signal_masses;
   std::vector<std::string> parameters_of_interest;
   std::string data       = "data_obs";
+  bool batched = false;
+  bool correlations_csv = false;
+  std::string cache_dir = "";
 
   po::options_description help_config("Help");
   help_config.add_options()
@@ -40,8 +193,8 @@ int main(int argc, char* argv[]) {
       po::value<string>(&workspace)->required(),
       "The input ROOT file containing the workspace [REQUIRED]")
     ("datacard,d",
-      po::value<string>(&datacard)->required(),
-      "The input datacard to be used for restoring the binning. Please note, that the input files mentioned in the datacard should also be accessible [REQUIRED]")
+      po::value<std::vector<std::string>>(&datacards)->required(),
+      "The input datacard to be used for restoring the binning, one for each category in the same order. Please note, that the input files mentioned in the datacard should also be accessible [REQUIRED]")
     ("fit,f",
       po::value<string>(&fit)->required(),
       "The input ROOT file containing the background-only fit [REQUIRED]")
@@ -49,8 +202,8 @@ int main(int argc, char* argv[]) {
       po::value<string>(&fit_name)->required(),
       "Name the background-only fit [REQUIRED]")
     ("category,c ",
-      po::value<string>(&category_name)->required(),
-      "The name of the category [REQUIRED]")
+      po::value<std::vector<std::string>>(&categories)->required(),
+      "The name of the category. Can be given several times, to process all categories of the workspace with a single loading of the workspace and the fit result [REQUIRED]")
     ("output-dir,o ",
       po::value<string>(&output_directory)->required(),
       "The name of the output directory [REQUIRED]")
@@ -65,7 +218,19 @@ int main(int argc, char* argv[]) {
       "The list of parameters of interest and the values they should be given. Each element should be of the following structure: name:value [REQUIRED]")
     ("data",
       po::value<string>(&data)->default_value(data),
-      "The name of observed, measured data");
+      "The name of observed, measured data")
+    ("batched",
+      po::value<bool>(&batched)->default_value(batched)->implicit_value(true),
+      "Evaluate the variations only for parameters the pdf, normalisation or systematics of a process depend on. The variations for all other parameters are identical to the nominal shape and not written")
+    ("correlations-csv",
+      po::value<bool>(&correlations_csv)->default_value(correlations_csv)->implicit_value(true),
+      "Write the correlations between the fitted parameters also as CSV, in addition to the sparse JSON format")
+    ("cache-dir",
+      po::value<string>(&cache_dir)->default_value(cache_dir),
+      "Parse a snapshot of the workspace reduced to the given categories from this directory, instead of the full workspace. "
+      "The snapshot is built if missing or if the workspace file was rewritten since, identified by its UUID, see BuildWorkspaceCache. "
+      "Without --batched, the variations for fitted parameters not contained in the snapshot are written as copies of the nominal shape, "
+      "as in a run without the cache");
 
   po::variables_map vm;
 
@@ -77,7 +242,7 @@ int main(int argc, char* argv[]) {
   if (vm.count("help")) {
     std::cout << config << std::endl;
     std::cout << "Example usage:" << std::endl << std::endl;
-    std::cout << "PostFitShapesForHEPData -w ws_htt_tt_35_2018.root -d htt_tt_35_2018.txt -c htt_tt_35_2018 \\" << std::endl;
+    std::cout << "PostFitShapesForHEPData -w ws_htt_tt_35_2018.root -d htt_tt_32_2018.txt -c htt_tt_32_2018 -d htt_tt_35_2018.txt -c htt_tt_35_2018 \\" << std::endl;
     std::cout << "                       -P r_ggH:1 -P r_bbH:1 -m MH -f multidimfitggH.bkgOnly.bestfit.robustHesse.root -F fit_mdf \\" << std::endl;
     std::cout << "                       -M 60 -M 80 -M 95 -M 100 -M 120 -M 125 -M 130 -M 140 -M 160 -M 180 -M 200 \\" << std::endl;
     std::cout << "                       -M 250 -M 300 -M 350 -M 400 -M 450 -M 500 -M 600 -M 700 -M 800 -M 900 -M 1000 \\" << std::endl;
@@ -88,37 +253,40 @@ int main(int argc, char* argv[]) {
   // Parse the main config options
   po::store(po::command_line_parser(argc, argv).options(config).run(), vm);
   po::notify(vm);
+  if (datacards.size() != categories.size()) {
+    std::cout << "ERROR: " << categories.size() << " categories given, but " << datacards.size() << " datacards for restoring the binning. One datacard per category is required." << std::endl;
+    exit(1);
+  }
 
   // Need this to read combine workspaces
   gSystem->Load("libHiggsAnalysisCombinedLimit");
 
-  // Get workspace
-  auto inputfile = TFile::Open(workspace.c_str(), "read");
-  RooWorkspace *ws = (RooWorkspace*)inputfile->Get("w");
-
   // Obtain background-only fit
   auto fitfile = TFile::Open(fit.c_str(), "read");
   RooFitResult* fitres = (RooFitResult*)fitfile->Get(fit_name.c_str());
   auto postfit_parameters = fitres->floatParsFinal();
   TIterator* iter(postfit_parameters.createIterator());
-  std::vector<std::string> parnames = {};
-
-  // Getting datacard + input root file for restoring the binning
-  ch::CombineHarvester cmb_card;
-  cmb_card.SetFlag("workspaces-use-clone",true);
-  cmb_card.ParseDatacard(datacard.c_str(), "", "", "", 0, "125");
-  TH1F reference_binning = cmb_card.cp().GetObservedShape();
 
-  // Create CH instance and parse the workspace
+  // Create CH instance and parse the workspace, or its snapshot for the categories
   ch::CombineHarvester cmb;
   cmb.SetFlag("workspaces-use-clone", true);
-  ch::ParseCombineWorkspace(cmb, *ws, "ModelConfig", data.c_str(), false);
+  std::unique_ptr<ch::WorkspaceCache> cache;
+  if (!cache_dir.empty()) {
+    cache.reset(new ch::WorkspaceCache(workspace, cache_dir, "w", "ModelConfig", data));
+    cache->Parse(cmb, categories);
+  } else {
+    // Get workspace
+    auto inputfile = TFile::Open(workspace.c_str(), "read");
+    RooWorkspace *ws = (RooWorkspace*)inputfile->Get("w");
+    ch::ParseCombineWorkspace(cmb, *ws, "ModelConfig", data.c_str(), false);
+  }
 
-  // Apply post-fit parameter values from fit
+  // Apply post-fit parameter values from fit. Fitted parameters missing in the snapshot of the categories
+  // do not change the shapes, they are kept to write the same variations as for the full workspace
+  std::vector<std::string> absent_parameters;
   for (TObject *parit = iter->Next(); parit != nullptr; parit = iter->Next()) {
     RooRealVar *postfitpar = dynamic_cast<RooRealVar *>(parit);
     auto par = cmb.cp().GetParameter(postfitpar->GetName());
-    parnames.push_back(postfitpar->GetName());
     if(par){
       //std::cout << "Initial parameter: " << par->name() << ", value: " << par->val() <<", -1 sigma: " << par->err_d() << ", +1 sigma: " << par->err_u() << std::endl;
       par->set_val(postfitpar->getVal());
@@ -128,21 +296,17 @@ int main(int argc, char* argv[]) {
     }
     else {
       //std::cout << "WARNING: Following parameter not in workspace: " << postfitpar->GetName() << std::endl;
+      if (cache && (postfitpar->getErrorLo() != 0. || postfitpar->getErrorHi() != 0.)) {
+        absent_parameters.push_back(postfitpar->GetName());
+      }
     }
   }
 
   // Writing out correlations between parameters
-  std::ofstream correlations;
-  correlations.open(fit_name+"_correlations.csv");
-  correlations << "Parameter1,Parameter2,Correlation\n";
-  for (unsigned int par1=0; par1 < parnames.size(); ++par1){
-    for(unsigned int par2=0; par2 < par1; ++par2){
-      double correlation_val = std::round(100.0*fitres->correlation(parnames.at(par1).c_str(), parnames.at(par2).c_str())) / 100.0;
-      if(std::abs(correlation_val) >= 1e-2){ // Include only correlations >= 1 %
-        correlations << parnames.at(par1) << "," << parnames.at(par2) << "," << correlation_val  << std::endl;
-      }
-    }
+  if (!boost::filesystem::exists(output_directory)){
+    boost::filesystem::create_directory(output_directory);
   }
+  WriteCorrelations(*fitres, fit, fit_name, output_directory, correlations_csv);
 
   // Drop any process that has no hist/data/pdf
   cmb.FilterProcs([&](ch::Process * proc) {
@@ -154,180 +318,86 @@ int main(int argc, char* argv[]) {
     return no_shape;
   });
 
-  ch::CombineHarvester cmb_bin = cmb.cp().bin({category_name.c_str()});
-
-  // Storing all info in an output file
-  if (!boost::filesystem::exists(output_directory)){
-    boost::filesystem::create_directory(output_directory);
-  }
-  TFile* out = TFile::Open((output_directory + "/" + category_name+"_hepdata.root").c_str(), "recreate");
-  out->cd();
-
-  // Extracting observed data
-  out->mkdir("data_obs");
-  out->cd("data_obs");
-  auto data_obs = cmb_bin.cp().GetObservedShape();
-  data_obs = ch::RestoreBinning(data_obs, reference_binning);
-  data_obs.SetName("data_obs");
-  data_obs.SetTitle("data_obs");
-  data_obs.Write();
-  out->cd();
-
-  // Extracting background processes
-  ch::CombineHarvester cmb_bin_bg = cmb_bin.cp().backgrounds();
-  auto bgs = cmb_bin_bg.cp().process_set();
-  for (auto bg : bgs)  {
-    out->mkdir(bg.c_str());
-    out->cd(bg.c_str());
-    ch::CombineHarvester cmb_bin_bgproc = cmb_bin_bg.cp().process({bg});
-    auto bg_shape = cmb_bin_bgproc.cp().GetShape();
-    bg_shape = ch::RestoreBinning(bg_shape, reference_binning);
-    bg_shape.SetName(bg.c_str());
-    bg_shape.SetTitle(bg.c_str());
-    bg_shape.Write();
-    std::cout << "Background: " << bg << ", nominal yield: " << bg_shape.Integral() << std::endl;
-    auto systematics = cmb_bin_bgproc.cp().GetParameters();
-    for (auto syst : systematics) {
-      if (0 == syst.err_d() && 0 == syst.err_u())
-      {
-        std::cout << "\tExcluding: " << syst.name() << std::endl;
-        continue; // Avoid parameters not used in the fit
-      }
-      else
-      {
-        // Determine impact of uncertainty variation
-        //std::cout << "\tSystematic (central): " << syst.name() << ", value: " << syst.val() <<", -1 sigma: " << syst.err_d() << ", +1 sigma: " << syst.err_u() << std::endl;
-        double initial_syst_val = syst.val();
-        syst.set_val(initial_syst_val + syst.err_u());
-        //std::cout << "\tSystematic (up): " << syst.name() << ", value: " << syst.val() <<", -1 sigma: " << syst.err_d() << ", +1 sigma: " << syst.err_u() << std::endl;
-        cmb_bin_bgproc.cp().UpdateParameters({syst});
-        auto bg_shape_syst_up = cmb_bin_bgproc.cp().GetShape();
-        bg_shape_syst_up = ch::RestoreBinning(bg_shape_syst_up, reference_binning);
-        //std::cout << "\tUpdated integral of background (upward): " << bg_shape_syst_up.Integral() << std::endl;
-        std::string up_name;
-        syst.set_val(initial_syst_val + syst.err_d());
-        //std::cout << "\tSystematic (down): " << syst.name() << ", value: " << syst.val() <<", -1 sigma: " << syst.err_d() << ", +1 sigma: " << syst.err_u() << std::endl;
-        cmb_bin_bgproc.cp().UpdateParameters({syst});
-        auto bg_shape_syst_down = cmb_bin_bgproc.cp().GetShape();
-        bg_shape_syst_down = ch::RestoreBinning(bg_shape_syst_down, reference_binning);
-        //std::cout << "\tUpdated integral of background (downward): " << bg_shape_syst_down.Integral() << std::endl;
-        std::string down_name;
-        syst.set_val(initial_syst_val);
-        //std::cout << "\tSystematic (restored): " << syst.name() << ", value: " << syst.val() <<", -1 sigma: " << syst.err_d() << ", +1 sigma: " << syst.err_u() << std::endl;
-        cmb_bin_bgproc.cp().UpdateParameters({syst});
-
-        // Check impact of systematic uncertainty, and excluding, if no impact found
-        bool valid_systematic = true;
-        TH1F* bg_shape_copy_up = (TH1F*) bg_shape.Clone();
-        bg_shape_copy_up->Divide(&bg_shape_syst_up);
-        TH1F* bg_shape_copy_down = (TH1F*) bg_shape.Clone();
-        bg_shape_copy_down->Divide(&bg_shape_syst_down);
-
-        // If a proper uncertainty, write systematic variations to output
-        if (valid_systematic){
-          up_name = bg + "_" + syst.name() + "_Up";
-          down_name = bg + "_" + syst.name() + "_Down";
-          bg_shape_syst_up.SetName(up_name.c_str());
-          bg_shape_syst_up.SetTitle(up_name.c_str());
-          bg_shape_syst_up.Write();
-          bg_shape_syst_down.SetName(down_name.c_str());
-          bg_shape_syst_down.SetTitle(down_name.c_str());
-          bg_shape_syst_down.Write();
-        }
-        else {
-          //std::cout << "\tExcluding: " << syst.name() << std::endl;
-        }
-        //break;
-      }
-    }
-    //break;
-    out->cd();
-  }
-
-  // Extracting signal processes
-  ch::CombineHarvester cmb_bin_sig = cmb_bin.cp().signals();
-  auto mass = cmb_bin_sig.GetParameter(signal_mass_name);
+  // Parameters shared by all categories, the mass and the parameters of interest are set for the signals only
+  auto mass = cmb.GetParameter(signal_mass_name);
   std::map <std::string, ch::Parameter*> pois;
+  std::map <std::string, double> poi_values;
   for (auto par: parameters_of_interest){
     std::vector<std::string> par_infos;
     boost::split(par_infos, par, [](char c){return c == ':';});
-    pois[par_infos.at(0)] = cmb_bin_sig.GetParameter(par_infos.at(0));
-    pois[par_infos.at(0)]->set_val(std::stof(par_infos.at(1)));
+    pois[par_infos.at(0)] = cmb.GetParameter(par_infos.at(0));
+    poi_values[par_infos.at(0)] = std::stof(par_infos.at(1));
   }
-  for (auto m : signal_masses){
-    mass->set_val(m);
-    auto sigs = cmb_bin_sig.cp().process_set();
+  std::map <std::string, double> initial_values = {{signal_mass_name, mass->val()}};
+  for (auto const& poi : pois) initial_values[poi.first] = poi.second->val();
 
-    for (auto sig : sigs){
-      ch::CombineHarvester cmb_bin_sigproc = cmb_bin_sig.cp().process({sig});
-      auto sig_shape = cmb_bin_sigproc.cp().GetShape();
-      sig_shape = ch::RestoreBinning(sig_shape, reference_binning);
-      std::string sig_name = sig + "_" + std::to_string(m);
-      out->mkdir(sig_name.c_str());
-      out->cd(sig_name.c_str());
-      sig_shape.SetName(sig_name.c_str());
-      sig_shape.SetTitle(sig_name.c_str());
-      sig_shape.Write();
-      std::cout << "Signal: " << sig_name << ", nominal yield: " << sig_shape.Integral() << std::endl;
+  // The workspace and the fit result are loaded once for all categories
+  for (unsigned i = 0; i < categories.size(); ++i) {
+    std::string const& category_name = categories.at(i);
+    std::string const& datacard = datacards.at(i);
+    // Getting datacard + input root file for restoring the binning
+    ch::CombineHarvester cmb_card;
+    cmb_card.SetFlag("workspaces-use-clone",true);
+    cmb_card.ParseDatacard(datacard.c_str(), "", "", "", 0, "125");
+    TH1F reference_binning = cmb_card.cp().GetObservedShape();
 
-      auto systematics = cmb_bin_sigproc.cp().GetParameters();
-      for (auto syst : systematics){
-        if (0 == syst.err_d() && 0 == syst.err_u())
-        {
-          std::cout << "\tExcluding: " << syst.name() << std::endl;
-          continue; // Avoid parameters not used in the fit
-        }
-        else
-        {
-          // Determine impact of uncertainty variation
-          //std::cout << "\tSystematic (central): " << syst.name() << ", value: " << syst.val() <<", -1 sigma: " << syst.err_d() << ", +1 sigma: " << syst.err_u() << std::endl;
-          double initial_syst_val = syst.val();
-          syst.set_val(initial_syst_val + syst.err_u());
-          //std::cout << "\tSystematic (up): " << syst.name() << ", value: " << syst.val() <<", -1 sigma: " << syst.err_d() << ", +1 sigma: " << syst.err_u() << std::endl;
-          cmb_bin_sigproc.cp().UpdateParameters({syst});
-          auto sig_shape_syst_up = cmb_bin_sigproc.cp().GetShape();
-          sig_shape_syst_up = ch::RestoreBinning(sig_shape_syst_up, reference_binning);
-          //std::cout << "\tUpdated integral of signal (upward): " << sig_shape_syst_up.Integral() << std::endl;
-          std::string up_name;
-          syst.set_val(initial_syst_val + syst.err_d());
-          //std::cout << "\tSystematic (down): " << syst.name() << ", value: " << syst.val() <<", -1 sigma: " << syst.err_d() << ", +1 sigma: " << syst.err_u() << std::endl;
-          cmb_bin_sigproc.cp().UpdateParameters({syst});
-          auto sig_shape_syst_down = cmb_bin_sigproc.cp().GetShape();
-          sig_shape_syst_down = ch::RestoreBinning(sig_shape_syst_down, reference_binning);
-          //std::cout << "\tUpdated integral of signal (downward): " << sig_shape_syst_down.Integral() << std::endl;
-          std::string down_name;
-          syst.set_val(initial_syst_val);
-          //std::cout << "\tSystematic (restored): " << syst.name() << ", value: " << syst.val() <<", -1 sigma: " << syst.err_d() << ", +1 sigma: " << syst.err_u() << std::endl;
-          cmb_bin_sigproc.cp().UpdateParameters({syst});
+    ch::CombineHarvester cmb_bin = cmb.cp().bin({category_name.c_str()});
 
-          // Check impact of systematic uncertainty, and excluding, if no impact found
-          bool valid_systematic = true;
-          TH1F* sig_shape_copy_up = (TH1F*) sig_shape.Clone();
-          sig_shape_copy_up->Divide(&sig_shape_syst_up);
-          TH1F* sig_shape_copy_down = (TH1F*) sig_shape.Clone();
-          sig_shape_copy_down->Divide(&sig_shape_syst_down);
+    // Storing all info in an output file
+    TFile* out = TFile::Open((output_directory + "/" + category_name + "_hepdata.root").c_str(), "recreate");
+    out->cd();
 
-          // If a proper uncertainty, write systematic variations to output
-          if (valid_systematic){
-            up_name = sig_name + "_" + syst.name() + "_Up";
-            down_name = sig_name + "_" + syst.name() + "_Down";
-            sig_shape_syst_up.SetName(up_name.c_str());
-            sig_shape_syst_up.SetTitle(up_name.c_str());
-            sig_shape_syst_up.Write();
-            sig_shape_syst_down.SetName(down_name.c_str());
-            sig_shape_syst_down.SetTitle(down_name.c_str());
-            sig_shape_syst_down.Write();
-          }
-          else {
-            //std::cout << "\tExcluding: " << syst.name() << std::endl;
-          }
-          //break;
-        }
-      }
-      //break;
+    // Extracting observed data
+    out->mkdir("data_obs");
+    out->cd("data_obs");
+    auto data_obs = cmb_bin.cp().GetObservedShape();
+    data_obs = ch::RestoreBinning(data_obs, reference_binning);
+    data_obs.SetName("data_obs");
+    data_obs.SetTitle("data_obs");
+    data_obs.Write();
+    out->cd();
+
+    // Extracting background processes
+    ch::CombineHarvester cmb_bin_bg = cmb_bin.cp().backgrounds();
+    auto bgs = cmb_bin_bg.cp().process_set();
+    for (auto bg : bgs)  {
+      out->mkdir(bg.c_str());
+      out->cd(bg.c_str());
+      ch::CombineHarvester cmb_bin_bgproc = cmb_bin_bg.cp().process({bg});
+      std::set<std::string> dependent;
+      if (batched) dependent = DependentParameters(cmb_bin_bgproc);
+      WriteShapeVariations(cmb_bin_bgproc, bg, "Background", reference_binning, batched ? &dependent : nullptr, absent_parameters);
       out->cd();
     }
-    //break;
+
+    // Extracting signal processes
+    ch::CombineHarvester cmb_bin_sig = cmb_bin.cp().signals();
+    for (auto const& poi : poi_values) pois[poi.first]->set_val(poi.second);
+    // The parameters a signal depends on are the same for all masses
+    auto sigs = cmb_bin_sig.cp().process_set();
+    std::map<std::string, std::set<std::string>> signal_dependencies;
+    if (batched) {
+      for (auto sig : sigs) {
+        ch::CombineHarvester cmb_bin_sigproc = cmb_bin_sig.cp().process({sig});
+        signal_dependencies[sig] = DependentParameters(cmb_bin_sigproc);
+      }
+    }
+    for (auto m : signal_masses){
+      mass->set_val(m);
+      for (auto sig : sigs){
+        ch::CombineHarvester cmb_bin_sigproc = cmb_bin_sig.cp().process({sig});
+        std::string sig_name = sig + "_" + std::to_string(m);
+        out->mkdir(sig_name.c_str());
+        out->cd(sig_name.c_str());
+        WriteShapeVariations(cmb_bin_sigproc, sig_name, "Signal", reference_binning, batched ? &signal_dependencies[sig] : nullptr, absent_parameters);
+        out->cd();
+      }
+    }
+
+    // Reset the mass and the parameters of interest for the next category, as for a separate run per category
+    mass->set_val(initial_values[signal_mass_name]);
+    for (auto const& poi : pois) poi.second->set_val(initial_values[poi.first]);
+    out->Close();
   }
   return 0;
 }
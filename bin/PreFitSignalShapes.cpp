@@ -1,12 +1,21 @@
 #include <map>
+#include <set>
+#include <cmath>
+#include <memory>
+#include <fstream>
 #include "boost/program_options.hpp"
 #include "boost/format.hpp"
+#include "boost/algorithm/string.hpp"
 #include "TSystem.h"
 #include "TH2F.h"
+#include "RooArgSet.h"
+#include "RooAbsPdf.h"
+#include "RooAbsReal.h"
 #include "CombineHarvester/CombineTools/interface/CombineHarvester.h"
 #include "CombineHarvester/CombineTools/interface/ParseCombineWorkspace.h"
 #include "CombineHarvester/CombineTools/interface/TFileIO.h"
 #include "CombineHarvester/CombineTools/interface/Logging.h"
+#include "CombineHarvester/MSSMvsSMRun2Legacy/interface/WorkspaceCache.h"
 
 namespace po = boost::program_options;
 
@@ -25,6 +34,198 @@ void ReverseBins(TH1F & h) {
   }
 }
 
+// Shape of the processes in cb for the current parameter values, and shifted down and up by the uncertainty of
+// each of the given parameters
+struct ShiftedShapes {
+  TH1F nominal;
+  std::vector<TH1F> down;
+  std::vector<TH1F> up;
+};
+
+// The same for the value of a scaling function
+struct ShiftedScaling {
+  double nominal;
+  std::vector<double> down;
+  std::vector<double> up;
+};
+
+// Templates of a signal process with its scaling function divided out. They are computed once per value of the
+// point parameters the shape of the process depends on, and scaled to each point with the scaling function.
+// Processes without scaling function, or with a shape depending on all point parameters, such that no template
+// could be reused, are evaluated at each point instead.
+struct SignalTemplates {
+  std::string name;
+  ch::CombineHarvester cb;
+  double x;
+  std::vector<ch::Parameter*> params;
+  std::vector<ch::Parameter*> shape_point_params;
+  RooAbsReal const* scaling = nullptr;
+  std::set<std::string> scaling_vars;
+  bool use_templates = false;
+  std::map<std::vector<double>, ShiftedShapes> templates;
+};
+
+std::set<std::string> VariableNames(RooAbsArg const* arg) {
+  std::set<std::string> names;
+  std::unique_ptr<RooArgSet> variables(arg->getVariables());
+  std::unique_ptr<TIterator> iter(variables->createIterator());
+  for (TObject *var = iter->Next(); var != nullptr; var = iter->Next()) names.insert(var->GetName());
+  return names;
+}
+
+// Parameters with uncertainties, the shape or yield of the processes in cb depends on. Shifting any other
+// parameter leaves the shape unchanged and does not contribute to its uncertainty
+std::vector<ch::Parameter*> ShiftedParameters(ch::CombineHarvester &cb) {
+  std::set<std::string> names = cb.syst_name_set();
+  cb.ForEachProc([&](ch::Process *proc) {
+    if (proc->pdf()) for (auto const& name : VariableNames(proc->pdf())) names.insert(name);
+    if (proc->norm()) for (auto const& name : VariableNames(proc->norm())) names.insert(name);
+  });
+  std::vector<ch::Parameter*> params;
+  for (auto const& name : names) {
+    ch::Parameter *par = cb.GetParameter(name);
+    if (par && (par->err_d() != 0. || par->err_u() != 0.)) params.push_back(par);
+  }
+  return params;
+}
+
+ShiftedShapes GetShiftedShapes(ch::CombineHarvester &cb, std::vector<ch::Parameter*> const& params) {
+  ShiftedShapes shapes;
+  shapes.nominal = cb.GetShape();
+  for (auto par : params) {
+    double val = par->val();
+    par->set_val(val + par->err_d());
+    shapes.down.push_back(cb.GetShape());
+    par->set_val(val + par->err_u());
+    shapes.up.push_back(cb.GetShape());
+    par->set_val(val);
+  }
+  return shapes;
+}
+
+// Only the parameters the scaling function depends on are shifted, its value is unchanged for the others
+ShiftedScaling GetShiftedScaling(SignalTemplates const& signal) {
+  ShiftedScaling scaling;
+  scaling.nominal = signal.scaling->getVal();
+  for (auto par : signal.params) {
+    if (!signal.scaling_vars.count(par->name())) {
+      scaling.down.push_back(scaling.nominal);
+      scaling.up.push_back(scaling.nominal);
+      continue;
+    }
+    double val = par->val();
+    par->set_val(val + par->err_d());
+    scaling.down.push_back(signal.scaling->getVal());
+    par->set_val(val + par->err_u());
+    scaling.up.push_back(signal.scaling->getVal());
+    par->set_val(val);
+  }
+  return scaling;
+}
+
+bool Vanishes(ShiftedScaling const& scaling) {
+  if (scaling.nominal == 0.) return true;
+  for (unsigned i = 0; i < scaling.down.size(); ++i) {
+    if (scaling.down[i] == 0. || scaling.up[i] == 0.) return true;
+  }
+  return false;
+}
+
+// Multiply the shapes with the scaling, or divide them by it
+ShiftedShapes Scaled(ShiftedShapes shapes, ShiftedScaling const& scaling, bool divide) {
+  auto factor = [&](double value) { return divide ? 1. / value : value; };
+  shapes.nominal.Scale(factor(scaling.nominal));
+  for (unsigned i = 0; i < shapes.down.size(); ++i) {
+    shapes.down[i].Scale(factor(scaling.down[i]));
+    shapes.up[i].Scale(factor(scaling.up[i]));
+  }
+  return shapes;
+}
+
+// Nominal shape with the uncertainty as in CombineHarvester::GetShapeWithUncertainty: half the difference
+// of the shifted shapes, added in quadrature over the parameters
+TH1F WithUncertainty(ShiftedShapes const& shapes) {
+  TH1F shape = shapes.nominal;
+  for (int i = 1; i <= shape.GetNbinsX(); ++i) {
+    double err2 = 0.;
+    for (unsigned k = 0; k < shapes.down.size(); ++k) {
+      double err = std::fabs(shapes.up[k].GetBinContent(i) - shapes.down[k].GetBinContent(i)) / 2.0;
+      err2 += err * err;
+    }
+    shape.SetBinError(i, std::sqrt(err2));
+  }
+  return shape;
+}
+
+SignalTemplates MakeSignalTemplates(ch::CombineHarvester &cb, std::string const& name, double x,
+                                    std::vector<ch::Parameter*> const& point_params) {
+  SignalTemplates signal;
+  signal.name = name;
+  signal.cb = cb.cp().process({name});
+  signal.x = x;
+  signal.params = ShiftedParameters(signal.cb);
+  unsigned nprocs = 0;
+  std::set<std::string> shape_vars;
+  signal.cb.ForEachProc([&](ch::Process *proc) {
+    ++nprocs;
+    if (proc->pdf()) shape_vars = VariableNames(proc->pdf());
+    if (proc->norm()) {
+      std::unique_ptr<RooArgSet> components(proc->norm()->getComponents());
+      signal.scaling = dynamic_cast<RooAbsReal const*>(components->find(("scaling_" + name).c_str()));
+    }
+  });
+  // The scaling function is used only if it is unique
+  if (nprocs != 1) signal.scaling = nullptr;
+  if (signal.scaling) signal.scaling_vars = VariableNames(signal.scaling);
+  for (auto par : point_params) {
+    if (shape_vars.count(par->name())) signal.shape_point_params.push_back(par);
+  }
+  signal.use_templates = signal.scaling && signal.shape_point_params.size() < point_params.size();
+  return signal;
+}
+
+// Shape with uncertainty of the signal at the current parameter values. Counts the shapes computed from the
+// workspace instead of from the templates in computed
+TH1F EvaluateSignal(SignalTemplates &signal, unsigned &computed) {
+  if (!signal.use_templates) {
+    ++computed;
+    return WithUncertainty(GetShiftedShapes(signal.cb, signal.params));
+  }
+  std::vector<double> key;
+  for (auto par : signal.shape_point_params) key.push_back(par->val());
+  ShiftedScaling scaling = GetShiftedScaling(signal);
+  auto it = signal.templates.find(key);
+  if (it == signal.templates.end()) {
+    ++computed;
+    ShiftedShapes shapes = GetShiftedShapes(signal.cb, signal.params);
+    // No template can be derived from a vanishing scaling, the shapes at this point are used directly
+    if (Vanishes(scaling)) return WithUncertainty(shapes);
+    it = signal.templates.emplace(key, Scaled(shapes, scaling, true)).first;
+  }
+  return WithUncertainty(Scaled(it->second, scaling, false));
+}
+
+// Points of the (mass, tanb) plane, one per line with the two values separated by spaces or a comma
+std::vector<std::pair<double, double>> ReadPoints(std::string const& filename) {
+  std::ifstream file(filename);
+  if (!file) {
+    throw std::runtime_error(FNERROR("Could not open the file of points " + filename));
+  }
+  std::vector<std::pair<double, double>> points;
+  std::string line;
+  while (std::getline(file, line)) {
+    boost::trim(line);
+    if (line.empty() || line[0] == '#') continue;
+    vector<string> parts;
+    boost::split(parts, line, boost::is_any_of(", \t"), boost::token_compress_on);
+    if (parts.size() != 2) {
+      throw std::runtime_error(FNERROR("Expected two values per line in the file of points, got: " + line));
+    }
+    points.emplace_back(boost::lexical_cast<double>(parts[0]), boost::lexical_cast<double>(parts[1]));
+  }
+  return points;
+}
+
 int main(int argc, char* argv[]) {
   // Need this to read combine workspaces
   gSystem->Load("libHiggsAnalysisCombinedLimit");
@@ -35,6 +236,9 @@ int main(int argc, char* argv[]) {
   string output     = "";
   std::string freeze_arg = "";
   string data       = "data_obs";
+  string points_file = "";
+  string mass_parameter = "mA";
+  string cache_dir  = "";
 
   po::options_description help_config("Help");
   help_config.add_options()
@@ -54,6 +258,17 @@ int main(int argc, char* argv[]) {
     ("freeze",
       po::value<string>(&freeze_arg)->default_value(freeze_arg),
       "Format PARAM1,PARAM2=X,PARAM3=Y where the values X and Y are optional")
+    ("points",
+      po::value<string>(&points_file)->default_value(points_file),
+      "File with one (mass, tanb) point per line. The signal shapes of all points are written to the output "
+      "file, computed from templates of the processes with their scaling functions divided out")
+    ("mass-parameter",
+      po::value<string>(&mass_parameter)->default_value(mass_parameter),
+      "Name of the mass parameter of the points, mA or mHp")
+    ("cache-dir",
+      po::value<string>(&cache_dir)->default_value(cache_dir),
+      "Parse a snapshot of the workspace reduced to the category from this directory, instead of the full workspace. "
+      "The snapshot is built if missing or if the workspace file was rewritten since, identified by its UUID, see BuildWorkspaceCache")
     ("output,o ",
       po::value<string>(&output)->required(),
       "Name of the output root file to create [REQUIRED]");
@@ -69,19 +284,26 @@ int main(int argc, char* argv[]) {
   po::store(po::command_line_parser(argc, argv).options(config).run(), vm);
   po::notify(vm);
 
-  TFile infile(workspace.c_str());
+  // Create CH instance and parse the workspace, or its snapshot for the category
+  ch::CombineHarvester cmb;
+  cmb.SetFlag("workspaces-use-clone", true);
+  std::unique_ptr<TFile> infile;
+  std::unique_ptr<ch::WorkspaceCache> cache;
+  if (!cache_dir.empty()) {
+    cache.reset(new ch::WorkspaceCache(workspace, cache_dir, "w", "ModelConfig", data));
+    cache->Parse(cmb, {category});
+  } else {
+    infile.reset(new TFile(workspace.c_str()));
 
-  RooWorkspace *ws = dynamic_cast<RooWorkspace*>(gDirectory->Get("w"));
+    RooWorkspace *ws = dynamic_cast<RooWorkspace*>(gDirectory->Get("w"));
 
-  if (!ws) {
-    throw std::runtime_error(
-        FNERROR("Could not locate workspace in input file"));
-  }
+    if (!ws) {
+      throw std::runtime_error(
+          FNERROR("Could not locate workspace in input file"));
+    }
 
-  // Create CH instance and parse the workspace
-  ch::CombineHarvester cmb;
-  cmb.SetFlag("workspaces-use-clone", true);
-  ch::ParseCombineWorkspace(cmb, *ws, "ModelConfig", data, false);
+    ch::ParseCombineWorkspace(cmb, *ws, "ModelConfig", data, false);
+  }
 
   // Only evaluate in case parameters to freeze are provided
   if(! freeze_arg.empty())
@@ -145,10 +367,63 @@ int main(int argc, char* argv[]) {
   pre_shapes_tot["TotalBkg"] =
       cmb.cp().backgrounds().GetShapeWithUncertainty();
 
+  std::vector<std::string> sm_signals = {"ggH125", "qqH125", "WH125", "ZH125", "ttH125"};
+  std::vector<std::string> mssm_signals = {"ggh_i", "ggh_t", "ggh_b", "ggA_i", "ggA_t", "ggA_b", "ggH_i", "ggH_t", "ggH_b", "bbh", "bbH", "bbA", "qqh", "ggh"};
+
+  if (!points_file.empty()) {
+    std::vector<std::pair<double, double>> points = ReadPoints(points_file);
+    ch::Parameter *par_mass = cmb.GetParameter(mass_parameter);
+    ch::Parameter *par_tanb = cmb.GetParameter("tanb");
+    ch::Parameter *par_x = cmb.GetParameter("x");
+    if (!par_mass || !par_tanb || !par_x) {
+      throw std::runtime_error(
+          FNERROR("Parameters " + mass_parameter + ", tanb and x are required in the workspace for --points"));
+    }
+    std::vector<ch::Parameter*> point_params = {par_mass, par_tanb};
+
+    // The SM signals are evaluated with x = 0, the MSSM signals with x = 1
+    std::vector<SignalTemplates> signals;
+    for (auto const& signal : {std::make_pair(sm_signals, 0.0), std::make_pair(mssm_signals, 1.0)}) {
+      for (auto const& proc : signal.first) {
+        if (!cmb.cp().process({proc}).process_set().size()) continue;
+        cmb.cp().process({proc}).PrintProcs();
+        signals.push_back(MakeSignalTemplates(cmb, proc, signal.second, point_params));
+        std::cout << ">> " << proc << ": " << (signals.back().use_templates ? "templates" : "evaluated at each point")
+                  << ", shape depends on " << signals.back().shape_point_params.size() << " point parameters" << std::endl;
+      }
+    }
+
+    TH1F ref;
+    if (datacard != "") ref = cmb_card.cp().GetObservedShape();
+    outfile.cd();
+    for (auto& iter : pre_shapes_tot) {
+      if (datacard != "") iter.second = ch::RestoreBinning(iter.second, ref);
+      ch::WriteToTFile(&(iter.second), &outfile, category + "_prefit/" + iter.first);
+    }
+
+    // Each point in its own directory <category>_prefit/<mass parameter>_<mass>_tanb_<tanb>
+    unsigned computed = 0;
+    for (auto const& point : points) {
+      par_mass->set_val(point.first);
+      par_tanb->set_val(point.second);
+      std::string label = (boost::format("%s_%g_tanb_%g") % mass_parameter % point.first % point.second).str();
+      std::cout << ">> Doing point " << label << std::endl;
+      for (auto& signal : signals) {
+        par_x->set_val(signal.x);
+        TH1F shape = EvaluateSignal(signal, computed);
+        if (datacard != "") shape = ch::RestoreBinning(shape, ref);
+        ch::WriteToTFile(&shape, &outfile, category + "_prefit/" + label + "/" + signal.name);
+      }
+    }
+    std::cout << ">> Wrote " << points.size() * signals.size() << " signal shapes for " << points.size()
+              << " points, " << computed << " of them computed from the workspace" << std::endl;
+    outfile.Close();
+    return 0;
+  }
+
   ch::CombineHarvester cmb_sm = cmb.cp();
   ch::Parameter *par_sm = cmb_sm.GetParameter("x");
   par_sm->set_val(0.0);
-  std::vector<std::string> sm_signals = {"ggH125", "qqH125", "WH125", "ZH125", "ttH125"};
   for (auto proc : sm_signals) {
     cmb_sm.cp().process({proc}).PrintProcs();
     pre_shapes_tot[proc] = cmb_sm.cp().process({proc}).GetShapeWithUncertainty();
@@ -157,7 +432,6 @@ int main(int argc, char* argv[]) {
   ch::CombineHarvester cmb_mssm = cmb.cp();
   ch::Parameter *par_mssm = cmb_mssm.GetParameter("x");
   par_mssm->set_val(1.0);
-  std::vector<std::string> mssm_signals = {"ggh_i", "ggh_t", "ggh_b", "ggA_i", "ggA_t", "ggA_b", "ggH_i", "ggH_t", "ggH_b", "bbh", "bbH", "bbA", "qqh", "ggh"};
   for (auto proc : mssm_signals) {
     cmb_mssm.cp().process({proc}).PrintProcs();
     pre_shapes_tot[proc] = cmb_mssm.cp().process({proc}).GetShapeWithUncertainty();
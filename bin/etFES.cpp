@@ -19,6 +19,7 @@
 #include "CombineHarvester/CombineTools/interface/AutoRebin.h"
 #include "CombineHarvester/CombinePdfs/interface/MorphFunctions.h"
 #include "CombineHarvester/CombineTools/interface/HttSystematics.h"
+#include "CombineHarvester/MSSMvsSMRun2Legacy/interface/ShapeFileIndex.h"
 #include "RooWorkspace.h"
 #include "RooRealVar.h"
 #include "TH2.h"
@@ -561,6 +562,8 @@ int main(int argc, char** argv)
     }
 
     //! [part7]
+    // The same input file is used for all channels, its keys are indexed only once
+    ch::ShapeFileIndex shapes(input_file);
     for (auto channel: channels)
     {
         dout("Extracting shapes for channel ", channel);
@@ -568,15 +571,13 @@ int main(int argc, char** argv)
         dout(input_file);
 
         // Problem: TH1 et_nojets_alldm/data_obs not found in /nfs/dust/cms/user/glusheno/Combine/MSSM-Full-2016/KIT/htt_et.inputs-mssm-13TeV-mttot.root
-        cb.cp().channel({channel}).backgrounds().ExtractShapes(
-        input_file,
+        shapes.ExtractShapes(cb.cp().channel({channel}).backgrounds(),
         // input_dir + "htt_" + channel + ".inputs-mssm-13TeV" + postfix + ".root",
         "$BIN/$PROCESS",
         "$BIN/$PROCESS_$SYSTEMATIC");
 
         dout("process...");
-        cb.cp().channel({channel}).process({"ZL"}).ExtractShapes(
-        input_file,
+        shapes.ExtractShapes(cb.cp().channel({channel}).process({"ZL"}),
         // input_dir + "htt_" + channel + ".inputs-mssm-13TeV" + postfix + ".root",
         "$BIN/ZL_$MASS",
         "$BIN/ZL_$MASS_$SYSTEMATIC");
@@ -0,0 +1,79 @@
+#ifndef MSSMvsSMRun2Legacy_ShapeFileIndex_h
+#define MSSMvsSMRun2Legacy_ShapeFileIndex_h
+#include <memory>
+#include <set>
+#include <string>
+#include <unordered_map>
+#include "TFile.h"
+#include "TH1.h"
+#include "TKey.h"
+#include "CombineHarvester/CombineTools/interface/CombineHarvester.h"
+
+namespace ch {
+/**
+ * Index of all keys in a shape input file, built once when the file is opened
+ *
+ * ch::CombineHarvester::ExtractShapes opens the input file again for each
+ * call and looks up every template by walking the directory structure. The
+ * morphing executables call it dozens of times per channel on the same file,
+ * once for each group of processes. This class opens the file once, maps the
+ * full path of each object ("<directory>/<name>") to its TKey and reads the
+ * templates directly from there.
+ *
+ * Typical usage:
+ *
+ *     ch::ShapeFileIndex shapes(input_file);
+ *     shapes.ExtractShapes(cb.cp().channel({chn}).backgrounds(),
+ *                          "$BIN/$PROCESS", "$BIN/$PROCESS_$SYSTEMATIC");
+ *     shapes.ExtractShapes(cb.cp().channel({chn}).process({"bbH"}),
+ *                          "$BIN/bbH_$MASS", "$BIN/bbH_$MASS_$SYSTEMATIC");
+ *
+ * With **record_only** the file is not opened. ExtractShapes then only
+ * records the paths of all templates it would read, see \ref requested.
+ */
+class ShapeFileIndex {
+ public:
+  explicit ShapeFileIndex(std::string const& file, bool record_only = false);
+
+  /**
+   * Same as ch::CombineHarvester::ExtractShapes, but using the index instead
+   * of the file name
+   *
+   * Observations and processes without shape are filled from **rule**,
+   * systematics of type shape, shapeN2 and shapeU from **syst_rule**. The
+   * placeholders $BIN, $CHANNEL (also replaced by the bin name), $PROCESS,
+   * $MASS and $SYSTEMATIC are substituted as in ExtractShapes.
+   */
+  void ExtractShapes(CombineHarvester &cb, std::string const& rule, std::string const& syst_rule = "") const;
+
+  /**
+   * Whether an object with the full path **path** exists in the file
+   */
+  inline bool Contains(std::string const& path) const { return keys_.count(path) > 0; }
+
+  /**
+   * Read the histogram **path** from the file, detached from any directory.
+   * Throws if it does not exist.
+   */
+  std::unique_ptr<TH1> GetClonedTH1(std::string const& path) const;
+
+  inline std::string const& file() const { return file_name_; }
+  inline unsigned size() const { return keys_.size(); }
+
+  /**
+   * Paths of the templates requested by ExtractShapes in record-only mode
+   */
+  inline std::set<std::string> const& requested() const { return requested_; }
+
+ private:
+  void IndexDirectory(TDirectory *dir, std::string const& prefix);
+
+  std::string file_name_;
+  std::shared_ptr<TFile> file_;
+  std::unordered_map<std::string, TKey*> keys_;
+  bool record_only_;
+  mutable std::set<std::string> requested_;
+};
+}
+
+#endif
@@ -0,0 +1,89 @@
+#ifndef MSSMvsSMRun2Legacy_WorkspaceCache_h
+#define MSSMvsSMRun2Legacy_WorkspaceCache_h
+#include <memory>
+#include <string>
+#include <vector>
+#include "TFile.h"
+#include "RooWorkspace.h"
+#include "CombineHarvester/CombineTools/interface/CombineHarvester.h"
+
+namespace ch {
+/**
+ * Snapshots of a combine workspace reduced to a few categories, for tools
+ * parsing it with ch::ParseCombineWorkspace
+ *
+ * For the full combination, reading the workspace and parsing it costs tens
+ * of seconds and gigabytes of memory, although most tools need only the
+ * categories they process. This class writes, for each set of categories, a
+ * snapshot into **cache_dir**. It holds a workspace with the pdfs of these
+ * categories only, the reduced dataset and a matching ModelConfig. The
+ * snapshots are tied to the UUID of the input file. A rewritten workspace
+ * file makes them stale, and they are rebuilt when they are requested the
+ * next time.
+ *
+ * Parsing a snapshot gives the same processes, observations and parameters
+ * as parsing the full workspace and selecting the categories with
+ * ch::CombineHarvester::bin. Parameters not used by any of the categories are
+ * missing. The snapshots are meant for the shape tools only, not for fits.
+ *
+ * Typical usage:
+ *
+ *     ch::WorkspaceCache cache(workspace_file, cache_dir);
+ *     ch::CombineHarvester cmb;
+ *     cmb.SetFlag("workspaces-use-clone", true);
+ *     cache.Parse(cmb, {"htt_tt_32_2018", "htt_tt_35_2018"});
+ *
+ * BuildWorkspaceCache writes the snapshots of many categories with a single
+ * reading of the workspace, before the tools are run per category.
+ */
+class WorkspaceCache {
+ public:
+  WorkspaceCache(std::string const& workspace_file, std::string const& cache_dir,
+                 std::string const& workspace = "w", std::string const& modelcfg = "ModelConfig",
+                 std::string const& data = "data_obs");
+
+  /**
+   * Parse the snapshot of the **categories** into **cb**, after building it
+   * if it is missing or stale
+   */
+  void Parse(CombineHarvester &cb, std::vector<std::string> const& categories);
+
+  /**
+   * Write the snapshot of the **categories**, if it is missing or stale.
+   * Returns the path of the snapshot file.
+   */
+  std::string Build(std::vector<std::string> const& categories);
+
+  /**
+   * Whether the snapshot of the **categories** exists and belongs to the
+   * current workspace file
+   */
+  bool UpToDate(std::vector<std::string> const& categories) const;
+
+  /**
+   * Path of the snapshot of the **categories**
+   */
+  std::string SnapshotFile(std::vector<std::string> const& categories) const;
+
+  /**
+   * All categories of the workspace. Reads the full workspace.
+   */
+  std::vector<std::string> Categories();
+
+ private:
+  RooWorkspace * FullWorkspace();
+  std::string Key(std::vector<std::string> const& categories) const;
+
+  std::string workspace_file_;
+  std::string cache_dir_;
+  std::string workspace_;
+  std::string modelcfg_;
+  std::string data_;
+  std::string uuid_;
+  std::shared_ptr<TFile> full_file_;
+  RooWorkspace *full_ws_;
+  std::vector<std::shared_ptr<TFile>> snapshot_files_;
+};
+}
+
+#endif
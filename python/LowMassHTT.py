@@ -1,4 +1,5 @@
 from HiggsAnalysis.CombinedLimit.PhysicsModel import PhysicsModel
+from CombineHarvester.MSSMvsSMRun2Legacy.model_profiling import ModelProfiler
 import math
 
 class LowMassHTT(PhysicsModel):
@@ -13,6 +14,7 @@ class LowMassHTT(PhysicsModel):
                 self.HggModel = True
             if po.startswith("floatR"):
                 self.floatR = True
+        self.profiler = ModelProfiler.fromPhysicsOptions(self, physOptions)
 
     def doParametersOfInterest(self):
         """Create POI and other parameters, and define the POI set."""
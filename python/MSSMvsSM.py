@@ -1,5 +1,7 @@
 from HiggsAnalysis.CombinedLimit.PhysicsModel import *
 from CombineHarvester.MSSMvsSMRun2Legacy.mssm_xs_tools import mssm_xs_tools
+from CombineHarvester.MSSMvsSMRun2Legacy.model_profiling import ModelProfiler
+from CombineHarvester.MSSMvsSMRun2Legacy.model_tools import scalingNuisances
 
 import os
 import ROOT
@@ -9,6 +11,8 @@ import pprint
 import numpy as np
 import itertools
 import re
+import hashlib
+import tempfile
 from collections import defaultdict
 from array import array
 
@@ -26,6 +30,9 @@ class MSSMvsSMHiggsModel(PhysicsModel):
         self.debug_output = None
         self.minTemplateMass = None
         self.maxTemplateMass = None
+        self.grid_values = {}
+        self.grid_cache = None
+        self.model_library = None
         self.quantity_map = {
             "mass"             : {"method" :     "mass", "name" : "m{HIGGS}",                 "access" : "{HIGGS}"},
             "width"            : {"method" :    "width", "name" : "w{HIGGS}",                 "access" : "{HIGGS}"},
@@ -98,6 +105,7 @@ class MSSMvsSMHiggsModel(PhysicsModel):
         self.PROC_SETS = []
         self.SYST_DICT = defaultdict(list)
         self.NUISANCES = set()
+        self.scaling_nuisances = {}
         self.scaleforh = 1.0
         self.bsmscalar = ""
         self.smlike = "h"
@@ -180,7 +188,16 @@ class MSSMvsSMHiggsModel(PhysicsModel):
                 self.qqh_pred_from_scaling = bool(int(po.replace('qqh-pred-from-scaling=', ''))) # use either 1 or 0 for the choice
                 print "Scale qqH process for sm-like H by hand instead from values in root file?", self.qqh_pred_from_scaling
 
+            if po.startswith('grid-cache='):
+                self.grid_cache = po.replace('grid-cache=', '')
+                print "Using %s as cache directory for evaluated model grids"%self.grid_cache
+
+            if po.startswith('model-library='):
+                self.model_library = po.replace('model-library=', '')
+                print "Using %s as library workspace for model quantities"%self.model_library
+
         self.filename = os.path.join(self.filePrefix, self.modelFile)
+        self.profiler = ModelProfiler.fromPhysicsOptions(self, physOptions)
 
     def setModelBuilder(self, modelBuilder):
         # First call the parent class implementation
@@ -197,8 +214,114 @@ class MSSMvsSMHiggsModel(PhysicsModel):
         self.modelBuilder.out._import(hfunc, ROOT.RooFit.RecycleConflictNodes())
         return self.modelBuilder.out.function(name)
 
+    def evaluateGrids(self, quantities, varlist):
+        # Batch evaluation of mssm_xs_tools quantities on the full (mass, tanb) grid.
+        # Each (method, accesskey) pair is read only once per workspace build and kept as NumPy array
+        # of shape (len(x_binning), len(y_binning)), such that quantities shared between several
+        # histfuncs (e.g. BRs of the SM-like Higgs boson) are not evaluated again.
+        x_binning = self.binning[self.scenario][varlist[0].GetName()]
+        y_binning = self.binning[self.scenario][varlist[1].GetName()]
+
+        missing = []
+        for quantity in quantities:
+            if quantity not in self.grid_values and quantity not in missing:
+                missing.append(quantity)
+
+        if missing:
+            if self.mssm_inputs is None:
+                self.mssm_inputs = mssm_xs_tools(self.filename, False, 1) # syntax: model filename, Flag for interpolation ('True' or 'False'), verbosity level
+            print "Evaluating %i quantities on %ix%i grid points from mssm_xs_tools..." %(len(missing), len(x_binning), len(y_binning))
+            readers = [(getattr(self.mssm_inputs, method), accesskey) for method, accesskey in missing]
+            values = np.empty((len(missing), len(x_binning), len(y_binning)))
+            for i_x, x in enumerate(x_binning):
+                for i_y, y in enumerate(y_binning):
+                    for i_q, (reader, accesskey) in enumerate(readers):
+                        values[i_q, i_x, i_y] = reader(accesskey, x, y)
+            for i_q, quantity in enumerate(missing):
+                self.grid_values[quantity] = values[i_q]
+
+        return [self.grid_values[quantity] for quantity in quantities]
+
+    def fileHash(self, path):
+        hasher = hashlib.sha1()
+        with open(path, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(1 << 20), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def makeDirectory(self, path):
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+
+    def gridCacheFile(self, varlist):
+        # Cache entries are identified by the content of the model file and the grid they are evaluated on.
+        # Physics options only enter the histograms derived from the cached grids, such that workspaces
+        # built with different options can share the same entry.
+        hasher = hashlib.sha1(self.fileHash(self.filename))
+        for var in varlist:
+            hasher.update(var.GetName())
+            hasher.update(np.asarray(self.binning[self.scenario][var.GetName()], dtype=np.float64).tobytes())
+        return os.path.join(self.grid_cache, "{SCENARIO}_{HASH}.npz".format(SCENARIO=self.scenario, HASH=hasher.hexdigest()))
+
+    def loadGridCache(self, cache_file):
+        if not os.path.exists(cache_file):
+            print "No cached model grids found in %s" %cache_file
+            return
+        cached = np.load(cache_file)
+        for key, values in zip(cached['keys'], cached['values']):
+            method, accesskey = str(key).split(':', 1)
+            self.grid_values[(method, accesskey)] = values
+        print "Loaded %i cached model grids from %s" %(len(cached['keys']), cache_file)
+
+    def saveGridCache(self, cache_file):
+        # Write to a temporary file first and move it in place afterwards, since several
+        # workspaces may be built in parallel from the same model file.
+        self.makeDirectory(self.grid_cache)
+        quantities = sorted(self.grid_values.keys())
+        fd, tmp_name = tempfile.mkstemp(suffix='.npz', dir=self.grid_cache)
+        with os.fdopen(fd, 'wb') as tmp_file:
+            np.savez_compressed(tmp_file,
+                                keys=np.array([':'.join(quantity) for quantity in quantities]),
+                                values=np.stack([self.grid_values[quantity] for quantity in quantities]))
+        os.rename(tmp_name, cache_file)
+        print "Stored %i model grids in %s" %(len(quantities), cache_file)
+
+    def doHistFromArray(self, name, values, varlist):
+        # Translator NumPy array -> TH2D, filling all bins in one call from the array buffer
+        x_binning = self.binning[self.scenario][varlist[0].GetName()]
+        y_binning = self.binning[self.scenario][varlist[1].GetName()]
+
+        hist = ROOT.TH2D(name, name, len(x_binning)-1, x_binning, len(y_binning)-1, y_binning)
+        # Grid point (i_x, i_y) is stored in bin (i_x+1, i_y+1), with global bin numbering running along x first.
+        # The last grid point in each direction ends up in the overflow bin, as for the per-point filling.
+        content = np.zeros((len(y_binning)+1, len(x_binning)+1))
+        content[1:, 1:] = values.T
+        hist.SetContent(np.ascontiguousarray(content.ravel()))
+        return hist
+
+    def fixNonPositivePredictions(self, bsm, sm, label, varlist):
+        # Fallbacks for BSM and SM predictions used in ratios:
+        # both <= 0 -> set both to 1; only SM <= 0 -> set SM to BSM prediction
+        x_binning = self.binning[self.scenario][varlist[0].GetName()]
+        y_binning = self.binning[self.scenario][varlist[1].GetName()]
+
+        both_invalid = (bsm <= 0) & (sm <= 0)
+        sm_invalid = (sm <= 0) & ~both_invalid
+        for i_x, i_y in zip(*np.nonzero(both_invalid)):
+            print "[WARNING]: Both BSM and SM {LABEL} predictions are <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting both to 1.".format(LABEL=label, MASS=self.massparameter, MASSVAL=x_binning[i_x], TANBVAL=y_binning[i_y])
+        for i_x, i_y in zip(*np.nonzero(sm_invalid)):
+            print "[WARNING]: SM {LABEL} prediction is <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting to BSM prediction.".format(LABEL=label, MASS=self.massparameter, MASSVAL=x_binning[i_x], TANBVAL=y_binning[i_y])
+
+        sm = np.where(both_invalid, 1., np.where(sm_invalid, bsm, sm))
+        bsm = np.where(both_invalid, 1., bsm)
+        return bsm, sm
+
     def doHistFuncFromXsecTools(self, higgs, quantity, varlist, production=None):
-        # Translator mssm_xs_tools -> TH1D -> RooDataHist
+        # Translator mssm_xs_tools -> NumPy array -> TH2D -> RooDataHist
         name  = self.quantity_map[quantity]['name']
         accesskey = self.quantity_map[quantity]['access']
         method = self.quantity_map[quantity]['method']
@@ -216,33 +339,30 @@ class MSSMvsSMHiggsModel(PhysicsModel):
         y_parname = varlist[1].GetName()
         y_binning = self.binning[self.scenario][y_parname]
 
-        hist = ROOT.TH2D(name, name, len(x_binning)-1, x_binning, len(y_binning)-1, y_binning)
-        for i_x, x in enumerate(x_binning):
-            for i_y, y in enumerate(y_binning):
-                value = getattr(self.mssm_inputs, method)(accesskey, x, y)
-                if quantity == 'mass' and self.minTemplateMass:
-                    if value < self.minTemplateMass:
-                        print "[WARNING]: Found a value for {MH} below lower mass limit: {VALUE} < {MINMASS} for {XNAME} = {XVALUE}, {YNAME} = {YVALUE}. Setting it to limit".format(
-                            MH=name,
-                            VALUE=value,
-                            MINMASS=self.minTemplateMass,
-                            XNAME=x_parname,
-                            XVALUE=x,
-                            YNAME=y_parname,
-                            YVALUE=y)
-                        value = self.minTemplateMass
-                if quantity == 'mass' and self.maxTemplateMass:
-                    if value > self.maxTemplateMass:
-                        print "[WARNING]: Found a value for {MH} above upper mass limit: {VALUE} > {MINMASS} for {XNAME} = {XVALUE}, {YNAME} = {YVALUE}. Setting it to limit".format(
-                            MH=name,
-                            VALUE=value,
-                            MINMASS=self.maxTemplateMass,
-                            XNAME=x_parname,
-                            XVALUE=x,
-                            YNAME=y_parname,
-                            YVALUE=y)
-                        value = self.maxTemplateMass
-                hist.SetBinContent(i_x+1, i_y+1, value)
+        values, = self.evaluateGrids([(method, accesskey)], varlist)
+        if quantity == 'mass' and self.minTemplateMass:
+            for i_x, i_y in zip(*np.nonzero(values < self.minTemplateMass)):
+                print "[WARNING]: Found a value for {MH} below lower mass limit: {VALUE} < {MINMASS} for {XNAME} = {XVALUE}, {YNAME} = {YVALUE}. Setting it to limit".format(
+                    MH=name,
+                    VALUE=values[i_x, i_y],
+                    MINMASS=self.minTemplateMass,
+                    XNAME=x_parname,
+                    XVALUE=x_binning[i_x],
+                    YNAME=y_parname,
+                    YVALUE=y_binning[i_y])
+            values = np.maximum(values, self.minTemplateMass)
+        if quantity == 'mass' and self.maxTemplateMass:
+            for i_x, i_y in zip(*np.nonzero(values > self.maxTemplateMass)):
+                print "[WARNING]: Found a value for {MH} above upper mass limit: {VALUE} > {MINMASS} for {XNAME} = {XVALUE}, {YNAME} = {YVALUE}. Setting it to limit".format(
+                    MH=name,
+                    VALUE=values[i_x, i_y],
+                    MINMASS=self.maxTemplateMass,
+                    XNAME=x_parname,
+                    XVALUE=x_binning[i_x],
+                    YNAME=y_parname,
+                    YVALUE=y_binning[i_y])
+            values = np.minimum(values, self.maxTemplateMass)
+        hist = self.doHistFromArray(name, values, varlist)
         return self.doHistFunc(name, hist, varlist)
 
     def doHistFuncForQQH(self, varlist):
@@ -261,78 +381,61 @@ class MSSMvsSMHiggsModel(PhysicsModel):
 
         print "Computing 'qqphi' scaling function from xsec tools"
 
-        x_parname = varlist[0].GetName()
-        x_binning = self.binning[self.scenario][x_parname]
-
-        y_parname = varlist[1].GetName()
-        y_binning = self.binning[self.scenario][y_parname]
-
-        hist = ROOT.TH2D(name, name, len(x_binning)-1, x_binning, len(y_binning)-1, y_binning)
-        for i_x, x in enumerate(x_binning):
-            for i_y, y in enumerate(y_binning):
-
-                br_htautau = getattr(self.mssm_inputs, self.quantity_map['br']['method'])(accesskey_br, x, y)
-                br_htautau_SM = getattr(self.mssm_inputs, self.quantity_map['br_SM']['method'])(accesskey_br_SM, x, y)
-
-                # Check if values for BR returned from tool are sensible.
-                if br_htautau <= 0 and br_htautau_SM <= 0:
-                    print "[WARNING]: Both BSM and SM BR predictions are <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting both to 1.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                    br_htautau_SM = 1.
-                    br_htautau = 1.
-                elif br_htautau_SM <= 0:
-                    print "[WARNING]: SM BR prediction is <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting to BSM prediction.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                    br_htautau_SM = br_htautau
-
-                if self.qqh_pred_from_scaling:
-                    # Check if qqH prediction should not be read from root files but be computed as
-                    # xs_qqh = sin(beta-alpha)**2 * xs_qqh_SM  # if h SM like
-                    # xs_qqH = cos(beta-alpha)**2 * xs_qqh_SM  # if H SM like
-                    # Get Yukawa coupling from predictions file to solve for mixing angle alpha
-                    # In type-II THDM scaling of Htop coupling is sin(alpha)/sin(beta)
-                    if self.scenario != 'mh1125_CPV':
-                        # Get value of beta angle from histogram binning
-                        beta = np.arctan(y)
-                        gt_H = getattr(self.mssm_inputs, self.quantity_map['yukawa_top']['method'])('gt_H', x, y)
-                        sin_alpha = gt_H * np.sin(beta)
-                        if abs(sin_alpha) > 1:
-                            sin_alpha = np.sign(sin_alpha)
-                        alpha = np.arcsin(sin_alpha)
-                        # Scale the predictions correctly for h and H
-                        if self.smlike == 'h':
-                            value = np.sin(beta-alpha)**2
-                        elif self.smlike == 'H':
-                            value = np.cos(beta-alpha)**2
-                    else:
-                        value = 1.0
-                else:
-                    xsec_vbf = getattr(self.mssm_inputs, self.quantity_map['xsec']['method'])(accesskey_vbf, x, y)
-                    xsec_vbf_SM = getattr(self.mssm_inputs, self.quantity_map['xsec_SM']['method'])(accesskey_vbf_SM, x, y)
-                    xsec_Wh = getattr(self.mssm_inputs, self.quantity_map['xsec']['method'])(accesskey_Wh, x, y)
-                    xsec_Wh_SM = getattr(self.mssm_inputs, self.quantity_map['xsec_SM']['method'])(accesskey_Wh_SM, x, y)
-                    xsec_Zh = getattr(self.mssm_inputs, self.quantity_map['xsec']['method'])(accesskey_Zh, x, y)
-                    xsec_Zh_SM = getattr(self.mssm_inputs, self.quantity_map['xsec_SM']['method'])(accesskey_Zh_SM, x, y)
-
-                    xsec = xsec_vbf + xsec_Wh + xsec_Zh
-                    xsec_SM = xsec_vbf_SM + xsec_Wh_SM + xsec_Zh_SM
-
-                    if xsec <= 0 and xsec_SM <= 0:
-                        print "[WARNING]: Both BSM and SM xsec predictions are <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting both to 1.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                        xsec_SM = 1.
-                        xsec = 1.
-                    elif xsec_SM <= 0:
-                        print "[WARNING]: SM xsec prediction is <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting to BSM prediction.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                        xsec_SM = xsec
-
-                    value = xsec / xsec_SM # xsec(mh) / xsec_SM(mh), correcting for mass dependence mh vs. 125.4 GeV
-
-                # BR rescaling calculated independently from cross section and needs to be corrected for
-                # mass prediction as well.
-                value *= br_htautau / br_htautau_SM # br_htautau(mh) / br_htautau_SM(mh), correcting for mass dependence mh vs. 125.4 GeV
-                value *= self.scaleforh # additional manual rescaling of light scalar h (default is 1.0)
-                if self.use_hSM_difference:
-                    value -= 1.0
-                hist.SetBinContent(i_x+1, i_y+1, value)
-
+        y_binning = self.binning[self.scenario][varlist[1].GetName()]
+
+        br_htautau, br_htautau_SM = self.evaluateGrids([
+            (self.quantity_map['br']['method'], accesskey_br),
+            (self.quantity_map['br_SM']['method'], accesskey_br_SM),
+        ], varlist)
+
+        # Check if values for BR returned from tool are sensible.
+        br_htautau, br_htautau_SM = self.fixNonPositivePredictions(br_htautau, br_htautau_SM, "BR", varlist)
+
+        if self.qqh_pred_from_scaling:
+            # Check if qqH prediction should not be read from root files but be computed as
+            # xs_qqh = sin(beta-alpha)**2 * xs_qqh_SM  # if h SM like
+            # xs_qqH = cos(beta-alpha)**2 * xs_qqh_SM  # if H SM like
+            # Get Yukawa coupling from predictions file to solve for mixing angle alpha
+            # In type-II THDM scaling of Htop coupling is sin(alpha)/sin(beta)
+            if self.scenario != 'mh1125_CPV':
+                # Get value of beta angle from histogram binning
+                beta = np.arctan(y_binning)[np.newaxis, :]
+                gt_H, = self.evaluateGrids([(self.quantity_map['yukawa_top']['method'], 'gt_H')], varlist)
+                sin_alpha = gt_H * np.sin(beta)
+                sin_alpha = np.where(np.abs(sin_alpha) > 1, np.sign(sin_alpha), sin_alpha)
+                alpha = np.arcsin(sin_alpha)
+                # Scale the predictions correctly for h and H
+                if self.smlike == 'h':
+                    value = np.sin(beta-alpha)**2
+                elif self.smlike == 'H':
+                    value = np.cos(beta-alpha)**2
+            else:
+                value = np.ones_like(br_htautau)
+        else:
+            xsec_vbf, xsec_vbf_SM, xsec_Wh, xsec_Wh_SM, xsec_Zh, xsec_Zh_SM = self.evaluateGrids([
+                (self.quantity_map['xsec']['method'], accesskey_vbf),
+                (self.quantity_map['xsec_SM']['method'], accesskey_vbf_SM),
+                (self.quantity_map['xsec']['method'], accesskey_Wh),
+                (self.quantity_map['xsec_SM']['method'], accesskey_Wh_SM),
+                (self.quantity_map['xsec']['method'], accesskey_Zh),
+                (self.quantity_map['xsec_SM']['method'], accesskey_Zh_SM),
+            ], varlist)
+
+            xsec = xsec_vbf + xsec_Wh + xsec_Zh
+            xsec_SM = xsec_vbf_SM + xsec_Wh_SM + xsec_Zh_SM
+
+            xsec, xsec_SM = self.fixNonPositivePredictions(xsec, xsec_SM, "xsec", varlist)
+
+            value = xsec / xsec_SM # xsec(mh) / xsec_SM(mh), correcting for mass dependence mh vs. 125.4 GeV
+
+        # BR rescaling calculated independently from cross section and needs to be corrected for
+        # mass prediction as well.
+        value = value * br_htautau / br_htautau_SM # br_htautau(mh) / br_htautau_SM(mh), correcting for mass dependence mh vs. 125.4 GeV
+        value *= self.scaleforh # additional manual rescaling of light scalar h (default is 1.0)
+        if self.use_hSM_difference:
+            value -= 1.0
+
+        hist = self.doHistFromArray(name, value, varlist)
         return self.doHistFunc(name, hist, varlist)
 
     def doHistFuncForGGH(self, varlist):
@@ -347,42 +450,20 @@ class MSSMvsSMHiggsModel(PhysicsModel):
 
         print "Computing 'ggphi' scaling function from xsec tools"
 
-        x_parname = varlist[0].GetName()
-        x_binning = self.binning[self.scenario][x_parname]
+        xs_ggh, xs_ggh_SM, br_htautau, br_htautau_SM = self.evaluateGrids([
+            (self.quantity_map['xsec']['method'], accesskey_xs),
+            (self.quantity_map['xsec_SM']['method'], accesskey_xs_SM),
+            (self.quantity_map['br']['method'], accesskey_br),
+            (self.quantity_map['br_SM']['method'], accesskey_br_SM),
+        ], varlist)
 
-        y_parname = varlist[1].GetName()
-        y_binning = self.binning[self.scenario][y_parname]
+        xs_ggh, xs_ggh_SM = self.fixNonPositivePredictions(xs_ggh, xs_ggh_SM, "ggh xs", varlist)
+        br_htautau, br_htautau_SM = self.fixNonPositivePredictions(br_htautau, br_htautau_SM, "BR", varlist)
 
-        hist = ROOT.TH2D(name, name, len(x_binning)-1, x_binning, len(y_binning)-1, y_binning)
-        for i_x, x in enumerate(x_binning):
-            for i_y, y in enumerate(y_binning):
-
-                xs_ggh = getattr(self.mssm_inputs, self.quantity_map['xsec']['method'])(accesskey_xs, x, y)
-                xs_ggh_SM = getattr(self.mssm_inputs, self.quantity_map['xsec_SM']['method'])(accesskey_xs_SM, x, y)
-
-                br_htautau = getattr(self.mssm_inputs, self.quantity_map['br']['method'])(accesskey_br, x, y)
-                br_htautau_SM = getattr(self.mssm_inputs, self.quantity_map['br_SM']['method'])(accesskey_br_SM, x, y)
-
-                if xs_ggh <= 0 and xs_ggh_SM <= 0:
-                    print "[WARNING]: Both BSM and SM ggh xs predictions are <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting both to 1.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                    xs_ggh_SM = 1.
-                    xs_ggh = 1.
-                elif xs_ggh_SM <= 0:
-                    print "[WARNING]: SM ggh xs prediction is <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting to BSM prediction.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                    xs_ggh_SM = xs_ggh
-
-                if br_htautau <= 0 and br_htautau_SM <= 0:
-                    print "[WARNING]: Both BSM and SM BR predictions are <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting both to 1.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                    br_htautau_SM = 1.
-                    br_htautau = 1.
-                elif br_htautau_SM <= 0:
-                    print "[WARNING]: SM BR prediction is <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting to BSM prediction.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                    br_htautau_SM = br_htautau
-
-                value =  xs_ggh / xs_ggh_SM * br_htautau / br_htautau_SM # xs(mh) * BR(mh) / (xs_SM(mh) * BR_SM(mh)) correcting for mass dependence mh vs. 125.4 GeV
-                value *= self.scaleforh # additional manual rescaling of light scalar h (default is 1.0)
-                hist.SetBinContent(i_x+1, i_y+1, value)
+        value =  xs_ggh / xs_ggh_SM * br_htautau / br_htautau_SM # xs(mh) * BR(mh) / (xs_SM(mh) * BR_SM(mh)) correcting for mass dependence mh vs. 125.4 GeV
+        value *= self.scaleforh # additional manual rescaling of light scalar h (default is 1.0)
 
+        hist = self.doHistFromArray(name, value, varlist)
         return self.doHistFunc(name, hist, varlist)
 
     def doHistFuncForBBH(self, varlist):
@@ -400,39 +481,24 @@ class MSSMvsSMHiggsModel(PhysicsModel):
 
         print "Computing 'bbphi' scaling function from xsec tools"
 
-        x_parname = varlist[0].GetName()
-        x_binning = self.binning[self.scenario][x_parname]
-
-        y_parname = varlist[1].GetName()
-        y_binning = self.binning[self.scenario][y_parname]
-
-        hist = ROOT.TH2D(name, name, len(x_binning)-1, x_binning, len(y_binning)-1, y_binning)
-        for i_x, x in enumerate(x_binning):
-            for i_y, y in enumerate(y_binning):
+        xs_bbh, xs_bbh_SM, br_htautau, br_htautau_SM = self.evaluateGrids([
+            (self.quantity_map['xsec']['method'], accesskey_xs),
+            (self.quantity_map['xsec_SM']['method'], accesskey_xs_SM),
+            (self.quantity_map['br']['method'], accesskey_br),
+            (self.quantity_map['br_SM']['method'], accesskey_br_SM),
+        ], varlist)
 
-                xs_bbh = getattr(self.mssm_inputs, self.quantity_map['xsec']['method'])(accesskey_xs, x, y)
-                xs_bbh_SM = getattr(self.mssm_inputs, self.quantity_map['xsec_SM']['method'])(accesskey_xs_SM, x, y)
+        br_htautau, br_htautau_SM = self.fixNonPositivePredictions(br_htautau, br_htautau_SM, "BR", varlist)
 
-                br_htautau = getattr(self.mssm_inputs, self.quantity_map['br']['method'])(accesskey_br, x, y)
-                br_htautau_SM = getattr(self.mssm_inputs, self.quantity_map['br_SM']['method'])(accesskey_br_SM, x, y)
-
-                if br_htautau <= 0 and br_htautau_SM <= 0:
-                    print "[WARNING]: Both BSM and SM BR predictions are <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting both to 1.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                    br_htautau_SM = 1.
-                    br_htautau = 1.
-                elif br_htautau_SM <= 0:
-                    print "[WARNING]: SM BR prediction is <= 0 for {MASS}={MASSVAL}, tanb={TANBVAL}. Setting to BSM prediction.".format(MASS=self.massparameter, MASSVAL=x, TANBVAL=y)
-                    br_htautau_SM = br_htautau
-
-                # xs(mh) * (xs_SM(125.4)/xs_SM(mh)) * BR(mh) * (BR_SM(125.4)/BR_SM(mh)) correcting for mass dependence mh vs. 125.4 GeV
-                value =  xs_bbh * (xs_bbh_SM125 / xs_bbh_SM) * br_htautau * (br_htautau_SM125 / br_htautau_SM)
-                value *= self.scaleforh # additional manual rescaling of light scalar h (default is 1.0)
-                hist.SetBinContent(i_x+1, i_y+1, value)
+        # xs(mh) * (xs_SM(125.4)/xs_SM(mh)) * BR(mh) * (BR_SM(125.4)/BR_SM(mh)) correcting for mass dependence mh vs. 125.4 GeV
+        value =  xs_bbh * (xs_bbh_SM125 / xs_bbh_SM) * br_htautau * (br_htautau_SM125 / br_htautau_SM)
+        value *= self.scaleforh # additional manual rescaling of light scalar h (default is 1.0)
 
+        hist = self.doHistFromArray(name, value, varlist)
         return self.doHistFunc(name, hist, varlist)
 
     def doAsymPowSystematic(self, higgs, quantity, varlist, production, uncertainty):
-        # Translator mssm_xs_tools -> TH1D -> RooDataHist -> Systematic
+        # Translator mssm_xs_tools -> NumPy array -> TH2D -> RooDataHist -> Systematic
         name  = self.quantity_map[quantity]['name'].format(HIGGS=higgs, PROD=production)
         accesskey = self.quantity_map[quantity]['access'].format(HIGGS=higgs, PROD=production)
         uncertaintykey = self.uncertainty_map[production+uncertainty]
@@ -444,25 +510,15 @@ class MSSMvsSMHiggsModel(PhysicsModel):
         param_var = self.modelBuilder.out.var(param)
         systname = "systeff_%s"%param
 
-        x_parname = varlist[0].GetName()
-        x_binning = self.binning[self.scenario][x_parname]
-
-        y_parname = varlist[1].GetName()
-        y_binning = self.binning[self.scenario][y_parname]
-
-        hist_hi = ROOT.TH2D(systname+"_hi", systname+"_hi", len(x_binning)-1, x_binning, len(y_binning)-1, y_binning)
-        hist_lo = ROOT.TH2D(systname+"_lo", systname+"_lo", len(x_binning)-1, x_binning, len(y_binning)-1, y_binning)
-        for i_x, x in enumerate(x_binning):
-            for i_y, y in enumerate(y_binning):
-                nominal  = getattr(self.mssm_inputs, method)(accesskey, x, y)
-                value_hi = getattr(self.mssm_inputs, method)(accesskey+uncertaintykey.format(VAR='up'), x, y)
-                value_lo = getattr(self.mssm_inputs, method)(accesskey+uncertaintykey.format(VAR='down'), x, y)
-                if nominal == 0:
-                    hist_hi.SetBinContent(i_x+1, i_y+1, 1.0)
-                    hist_lo.SetBinContent(i_x+1, i_y+1, 1.0)
-                else:
-                    hist_hi.SetBinContent(i_x+1, i_y+1, (nominal+value_hi)/nominal)
-                    hist_lo.SetBinContent(i_x+1, i_y+1, (nominal+value_lo)/nominal)
+        nominal, value_hi, value_lo = self.evaluateGrids([
+            (method, accesskey),
+            (method, accesskey+uncertaintykey.format(VAR='up')),
+            (method, accesskey+uncertaintykey.format(VAR='down')),
+        ], varlist)
+        valid = nominal != 0
+        safe_nominal = np.where(valid, nominal, 1.0)
+        hist_hi = self.doHistFromArray(systname+"_hi", np.where(valid, (nominal+value_hi)/safe_nominal, 1.0), varlist)
+        hist_lo = self.doHistFromArray(systname+"_lo", np.where(valid, (nominal+value_lo)/safe_nominal, 1.0), varlist)
         print "Doing AsymPow systematic '%s' with '%s' key for quantity '%s' from mssm_xs_tools..." %(param, accesskey+uncertaintykey.format(VAR='up/down'), quantity)
 
         self.NUISANCES.add(param)
@@ -489,15 +545,11 @@ class MSSMvsSMHiggsModel(PhysicsModel):
 
 
     def preProcessNuisances(self,nuisances):
+        # The scaling functions depend on the process only, such that each one is scanned once instead of once per bin
+        signals = set(proc for bin in self.DC.bins for proc in self.DC.exp[bin].keys() if self.DC.isSignal[proc])
         doParams = set()
-        for bin in self.DC.bins:
-            for proc in self.DC.exp[bin].keys():
-                if self.DC.isSignal[proc]:
-                    scaling = 'scaling_%s' % proc
-                    params = self.modelBuilder.out.function(scaling).getParameters(ROOT.RooArgSet()).contentsString().split(',')
-                    for param in params:
-                        if param in self.NUISANCES:
-                            doParams.add(param)
+        for proc in sorted(signals):
+            doParams.update(scalingNuisances(self.scaling_nuisances, self.modelBuilder.out, self.NUISANCES, proc))
         for param in doParams:
             print 'Add nuisance parameter %s to datacard' % param
             nuisances.append((param,False, "param", [ "0", "1"], [] ) )
@@ -569,26 +621,20 @@ class MSSMvsSMHiggsModel(PhysicsModel):
         else:
             return 1
 
-    def buildModel(self):
-        mass = ROOT.RooRealVar(self.massparameter, 'm_{A} [GeV]' if self.massparameter == 'mA' else 'm_{H^{+}} [GeV]', 160.) # the other case would be 'mHp'
-        tanb = ROOT.RooRealVar('tanb', 'tan#beta', 5.5)
-        pars = [mass, tanb]
-
-        self.mssm_inputs = mssm_xs_tools(self.filename, False, 1) # syntax: model filename, Flag for interpolation ('True' or 'False'), verbosity level
+    def buildHistFuncs(self, pars, procs):
+        # Function to implement the histograms of (mA, tanb) dependent quantities, the AsymPow systematics and the ggH loop fractions
+        if self.grid_cache:
+            grid_cache_file = self.gridCacheFile(pars)
+            self.loadGridCache(grid_cache_file)
+            n_cached_grids = len(self.grid_values)
 
         # qqphi, Zphi and Wphi  added always in this setup
         self.doHistFuncForQQH(pars)
-        self.PROC_SETS.extend(['qq'+self.smlike, 'Z'+self.smlike, 'W'+self.smlike])
 
         # adding ggphi & bbphi as 125 templates only if requested
         if self.replace_with_sm125:
-
             self.doHistFuncForGGH(pars)
-            self.PROC_SETS.append('gg'+self.smlike)
-
-            self.doHistFuncForBBH(pars) # no need to add since added later
-
-        procs = ['H1', 'H2', 'H3'] if self.scenario == "mh1125_CPV" else ['h', 'H', 'A']
+            self.doHistFuncForBBH(pars)
 
         for X in procs:
             if self.massparameter.replace('m','') == X: # don't create histogram for 'A' in cases, where its mass is a model-parameter
@@ -617,6 +663,89 @@ class MSSMvsSMHiggsModel(PhysicsModel):
             # bbH total uncertainty
             self.doAsymPowSystematic(X, "xsec", pars, "bb", "total")
 
+        if self.grid_cache and len(self.grid_values) > n_cached_grids:
+            self.saveGridCache(grid_cache_file)
+
+    def modelLibrarySignature(self):
+        # Everything the content of the model library depends on, including the code building it
+        source = os.path.splitext(__file__)[0] + '.py'
+        return json.dumps({
+            "modelSource" : self.fileHash(source if os.path.exists(source) else __file__),
+            "modelFile" : self.fileHash(self.filename),
+            "scenario" : self.scenario,
+            "MSSM-NLO-Workspace" : self.fileHash(self.ggHatNLO),
+            "sm-predictions" : self.sm_predictions,
+            "replace-with-SM125" : self.replace_with_sm125,
+            "hSM-treatment" : self.use_hSM_difference,
+            "qqh-pred-from-scaling" : self.qqh_pred_from_scaling,
+            "scaleforh" : self.scaleforh,
+            "minTemplateMass" : self.minTemplateMass,
+            "maxTemplateMass" : self.maxTemplateMass,
+        }, sort_keys=True)
+
+    def importModelLibrary(self):
+        # Import all model quantities wholesale from a previously built library workspace
+        if not os.path.exists(self.model_library):
+            print "No model library found in %s, building it from scratch" %self.model_library
+            return False
+        library_file = ROOT.TFile.Open(self.model_library, 'read')
+        signature = library_file.Get('signature')
+        if not signature or signature.GetString().Data() != self.modelLibrarySignature():
+            print "[WARNING]: Model library %s was built from different inputs or physics options. Rebuilding it." %self.model_library
+            library_file.Close()
+            return False
+        library = library_file.Get('w')
+        getattr(self.modelBuilder.out, 'import')(library.components(), ROOT.RooFit.RecycleConflictNodes())
+        for param in library.set('nuisances').contentsString().split(','):
+            self.NUISANCES.add(param)
+        library_file.Close()
+        print "Imported model library from %s" %self.model_library
+        return True
+
+    def exportModelLibrary(self, names):
+        # Store the quantities created in this workspace build as library for later builds
+        library = ROOT.RooWorkspace('w', 'w')
+        args = ROOT.RooArgSet()
+        for name in names:
+            args.add(self.modelBuilder.out.arg(name))
+        getattr(library, 'import')(args, ROOT.RooFit.RecycleConflictNodes())
+        library.defineSet('nuisances', ','.join(sorted(self.NUISANCES)))
+
+        # Write to a temporary file first and move it in place afterwards, since several
+        # workspaces may be built in parallel for the same scenario.
+        library_dir = os.path.dirname(os.path.abspath(self.model_library))
+        self.makeDirectory(library_dir)
+        fd, tmp_name = tempfile.mkstemp(suffix='.root', dir=library_dir)
+        os.close(fd)
+        library_file = ROOT.TFile.Open(tmp_name, 'recreate')
+        library.Write()
+        ROOT.TObjString(self.modelLibrarySignature()).Write('signature')
+        library_file.Close()
+        os.rename(tmp_name, self.model_library)
+        print "Stored model library with %i quantities in %s" %(len(names), self.model_library)
+
+    def buildModel(self):
+        mass = ROOT.RooRealVar(self.massparameter, 'm_{A} [GeV]' if self.massparameter == 'mA' else 'm_{H^{+}} [GeV]', 160.) # the other case would be 'mHp'
+        tanb = ROOT.RooRealVar('tanb', 'tan#beta', 5.5)
+        pars = [mass, tanb]
+
+        procs = ['H1', 'H2', 'H3'] if self.scenario == "mh1125_CPV" else ['h', 'H', 'A']
+
+        if not (self.model_library and self.importModelLibrary()):
+            existing = set(self.modelBuilder.out.components().contentsString().split(','))
+            self.buildHistFuncs(pars, procs)
+            if self.model_library:
+                built = set(self.modelBuilder.out.components().contentsString().split(',')) - existing
+                self.exportModelLibrary(sorted(built))
+
+        # qqphi, Zphi and Wphi  added always in this setup
+        self.PROC_SETS.extend(['qq'+self.smlike, 'Z'+self.smlike, 'W'+self.smlike])
+
+        # adding ggphi & bbphi as 125 templates only if requested
+        if self.replace_with_sm125:
+            self.PROC_SETS.append('gg'+self.smlike) # bbphi no need to add since added later
+
+        for X in procs:
             for loopcontrib in ['t','b','i']:
                 self.SYST_DICT['xs_gg%s_%s' % (X, loopcontrib)].append('systeff_xs_gg%s_MSSM_scale' %X)
                 self.SYST_DICT['xs_gg%s_%s' % (X, loopcontrib)].append('systeff_xs_gg%s_MSSM_pdfas' %X)
@@ -640,5 +769,4 @@ class MSSMvsSMHiggsModel(PhysicsModel):
         if self.debug_output:
             self.debug_output.Close()
 
-
 MSSMvsSM = MSSMvsSMHiggsModel()
@@ -1,5 +1,6 @@
 from HiggsAnalysis.CombinedLimit.PhysicsModel import *
 from CombineHarvester.MSSMvsSMRun2Legacy.mssm_xs_tools import mssm_xs_tools
+from CombineHarvester.MSSMvsSMRun2Legacy.model_tools import scalingNuisances
 
 import os
 import ROOT
@@ -102,6 +103,7 @@ class MSSMvsSMOldModelsHiggsModel(PhysicsModel):
         self.PROC_SETS = []
         self.SYST_DICT = defaultdict(list)
         self.NUISANCES = set()
+        self.scaling_nuisances = {}
         self.scaleforh = 1.0
         self.bsmscalar = ""
         self.smlike = "h"
@@ -465,15 +467,11 @@ class MSSMvsSMOldModelsHiggsModel(PhysicsModel):
 
 
     def preProcessNuisances(self,nuisances):
+        # The scaling functions depend on the process only, such that each one is scanned once instead of once per bin
+        signals = set(proc for bin in self.DC.bins for proc in self.DC.exp[bin].keys() if self.DC.isSignal[proc])
         doParams = set()
-        for bin in self.DC.bins:
-            for proc in self.DC.exp[bin].keys():
-                if self.DC.isSignal[proc]:
-                    scaling = 'scaling_%s' % proc
-                    params = self.modelBuilder.out.function(scaling).getParameters(ROOT.RooArgSet()).contentsString().split(',')
-                    for param in params:
-                        if param in self.NUISANCES:
-                            doParams.add(param)
+        for proc in sorted(signals):
+            doParams.update(scalingNuisances(self.scaling_nuisances, self.modelBuilder.out, self.NUISANCES, proc))
         for param in doParams:
             print 'Add nuisance parameter %s to datacard' % param
             nuisances.append((param,False, "param", [ "0", "1"], [] ) )
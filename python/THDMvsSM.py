@@ -9,6 +9,8 @@ import numpy as np
 import ROOT
 
 from HiggsAnalysis.CombinedLimit.PhysicsModel import *
+from CombineHarvester.MSSMvsSMRun2Legacy.model_profiling import ModelProfiler
+from CombineHarvester.MSSMvsSMRun2Legacy.model_tools import scalingNuisances
 
 
 class THDMvsSMHiggsModel(PhysicsModel):
@@ -60,6 +62,7 @@ class THDMvsSMHiggsModel(PhysicsModel):
         self.PROC_SETS = []
         self.SYST_DICT = defaultdict(list)
         self.NUISANCES = set()
+        self.scaling_nuisances = {}
         self.filename = ''
         self.debug_output = None
         self.x_variable = "mH"
@@ -96,6 +99,7 @@ class THDMvsSMHiggsModel(PhysicsModel):
         self.filename = os.path.join(filePrefix, modelFile)
         if "FixedMass" in modelFile.replace(".root", ""):
             self.x_variable = "cos_betal"
+        self.profiler = ModelProfiler.fromPhysicsOptions(self, physOptions)
 
     def setModelBuilder(self, modelBuilder):
         """Used to load quantities in empty workspace."""
@@ -167,16 +171,11 @@ class THDMvsSMHiggsModel(PhysicsModel):
         return
 
     def preProcessNuisances(self,nuisances):
+        # The scaling functions depend on the process only, such that each one is scanned once instead of once per bin
+        signals = set(proc for bin in self.DC.bins for proc in self.DC.exp[bin].keys() if self.DC.isSignal[proc])
         doParams = set()
-        for bin in self.DC.bins:
-            for proc in self.DC.exp[bin].keys():
-                if self.DC.isSignal[proc]:
-                    scaling = 'scaling_%s' % proc
-                    print(scaling)
-                    params = self.modelBuilder.out.function(scaling).getParameters(ROOT.RooArgSet()).contentsString().split(',')
-                    for param in params:
-                        if param in self.NUISANCES:
-                            doParams.add(param)
+        for proc in sorted(signals):
+            doParams.update(scalingNuisances(self.scaling_nuisances, self.modelBuilder.out, self.NUISANCES, proc, verbose=True))
         for param in doParams:
             print 'Add nuisance parameter %s to datacard' % param
             nuisances.append((param,False, "param", [ "0", "1"], [] ) )
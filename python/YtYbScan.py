@@ -1,4 +1,6 @@
 from HiggsAnalysis.CombinedLimit.PhysicsModel import *
+from CombineHarvester.MSSMvsSMRun2Legacy.model_profiling import ModelProfiler
+from CombineHarvester.MSSMvsSMRun2Legacy.model_tools import scalingNuisances
 
 import os
 import ROOT
@@ -17,6 +19,7 @@ class YtYbScan(PhysicsModel):
         self.XS_File = ''
         self.PROC_SETS = []
         self.NUISANCES = set()
+        self.scaling_nuisances = {}
         self.SYST_DICT = defaultdict(list)
 
     def setPhysicsOptions(self,physOptions):
@@ -24,6 +27,7 @@ class YtYbScan(PhysicsModel):
             if po.startswith('XS-Workspace='):
                 self.XS_File = po.replace('XS-Workspace=', '')
                 print "Using %s for XS inputs"%self.XS_File
+        self.profiler = ModelProfiler.fromPhysicsOptions(self, physOptions)
 
     def setModelBuilder(self, modelBuilder):
         PhysicsModel.setModelBuilder(self, modelBuilder)
@@ -77,15 +81,11 @@ class YtYbScan(PhysicsModel):
         getattr(self.modelBuilder.out, 'import')(func_down, ROOT.RooFit.RecycleConflictNodes())
         
     def preProcessNuisances(self,nuisances):
+        # The scaling functions depend on the process only, such that each one is scanned once instead of once per bin
+        signals = set(proc for bin in self.DC.bins for proc in self.DC.exp[bin].keys() if self.DC.isSignal[proc])
         doParams = set()
-        for bin in self.DC.bins:
-            for proc in self.DC.exp[bin].keys():
-                if self.DC.isSignal[proc]:
-                    scaling = 'scaling_%s' % proc
-                    params = self.modelBuilder.out.function(scaling).getParameters(ROOT.RooArgSet()).contentsString().split(',')
-                    for param in params:
-                        if param in self.NUISANCES:
-                            doParams.add(param)
+        for proc in sorted(signals):
+            doParams.update(scalingNuisances(self.scaling_nuisances, self.modelBuilder.out, self.NUISANCES, proc))
         for param in doParams:
             print 'Add nuisance parameter %s to datacard' % param
             nuisances.append((param,False, "param", [ "0", "1"], [] ) )
@@ -0,0 +1,145 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import resource
+import subprocess
+import traceback
+from multiprocessing import Pool
+
+
+class Task(object):
+    """Unit of work for the local executor: either a shell command or a picklable function with arguments.
+
+    The cost is only used to order the tasks, such that the most expensive ones are started first.
+    """
+    def __init__(self, name, command=None, function=None, args=(), cost=0.0):
+        if (command is None) == (function is None):
+            raise ValueError("Task '%s' needs either a command or a function" % name)
+        self.name = name
+        self.command = command
+        self.function = function
+        self.args = args
+        self.cost = cost
+
+
+def _run_command(command):
+    # Run the command and collect the resource usage of this child process only
+    process = subprocess.Popen(command, shell=True)
+    _, status, usage = os.wait4(process.pid, 0)
+    returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    return returncode, usage.ru_maxrss / 1024., None
+
+
+def _run_function(function, args):
+    try:
+        returncode = function(*args)
+        error = None
+    except Exception:
+        returncode = 1
+        error = traceback.format_exc()
+    # For functions only the peak memory of the worker process is available
+    return int(returncode or 0), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024., error
+
+
+def _execute(info):
+    task, retries = info
+    attempts = []
+    for attempt in range(retries + 1):
+        start = time.time()
+        if task.command is not None:
+            returncode, max_rss, error = _run_command(task.command)
+        else:
+            returncode, max_rss, error = _run_function(task.function, task.args)
+        attempts.append({
+            "returncode" : returncode,
+            "wall_time" : time.time() - start,
+            "max_rss_mb" : max_rss,
+            "error" : error,
+        })
+        if returncode == 0:
+            break
+        print("[WARNING] Task '%s' failed with return code %i (attempt %i of %i)" % (task.name, returncode, attempt + 1, retries + 1))
+    return {
+        "name" : task.name,
+        "command" : task.command,
+        "returncode" : attempts[-1]["returncode"],
+        "attempts" : attempts,
+        "wall_time" : sum(a["wall_time"] for a in attempts),
+        "max_rss_mb" : max(a["max_rss_mb"] for a in attempts),
+    }
+
+
+def run_task(task, retries=0):
+    """Run a single task in the current process and return its result with wall time and peak memory."""
+    return _execute((task, retries))
+
+
+def load_timings(summary):
+    """Wall times of the tasks in a previous summary, to be used as cost estimates."""
+    if not summary or not os.path.exists(summary):
+        return {}
+    with open(summary, "r") as f:
+        previous = json.load(f)
+    return dict((result["name"], result["wall_time"]) for result in previous.get("tasks", []))
+
+
+def add_executor_arguments(parser):
+    parser.add_argument('--retries', type=int, default=1, help="Number of retries for failed tasks")
+    parser.add_argument('--summary', default=None,
+                        help="JSON file to store wall time, memory and return code of each task. If it exists, the timings of the previous run are used to start the longest tasks first")
+
+
+def run_tasks(tasks, parallel=1, retries=0, summary=None):
+    """Run the tasks longest first, each worker picking up the next task as soon as it is idle.
+
+    Failed tasks are retried up to 'retries' times. Returns the list of failed task results.
+    """
+    timings = load_timings(summary)
+    for task in tasks:
+        if task.name in timings:
+            task.cost = timings[task.name]
+    ordered = sorted(tasks, key=lambda task: task.cost, reverse=True)
+    infos = [(task, retries) for task in ordered]
+
+    start = time.time()
+    results = []
+    if parallel < 2:
+        for info in infos:
+            results.append(_execute(info))
+    else:
+        pool = Pool(parallel)
+        try:
+            # chunksize 1: no static assignment of tasks to workers
+            for result in pool.imap_unordered(_execute, infos, chunksize=1):
+                results.append(result)
+                print("[INFO] Finished %i of %i tasks" % (len(results), len(infos)))
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    failures = [result for result in results if result["returncode"] != 0]
+    print("[INFO] Processed %i tasks in %.1f s, %i failed" % (len(results), time.time() - start, len(failures)))
+    for failure in failures:
+        print("[ERROR] Task '%s' failed with return code %i after %i attempts" % (failure["name"], failure["returncode"], len(failure["attempts"])))
+
+    if summary:
+        with open(summary, "w") as f:
+            json.dump({
+                "wall_time" : time.time() - start,
+                "parallel" : parallel,
+                "retries" : retries,
+                "failed" : [failure["name"] for failure in failures],
+                "tasks" : results,
+            }, f, indent=2)
+        print("[INFO] Task summary written to %s" % summary)
+    return failures
+
+
+def exit_status(failures):
+    sys.exit(1 if failures else 0)
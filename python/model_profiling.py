@@ -0,0 +1,158 @@
+from __future__ import print_function
+
+import json
+import time
+import atexit
+import cProfile
+import resource
+from collections import defaultdict
+
+
+def cpuTime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class ModelProfiler(object):
+    """Timing of the physics model methods called by text2workspace.
+
+    Enabled with '--PO profile=<file>', the report is written as JSON to <file>. For each method it contains
+    the number of calls, the wall and CPU time, the RooFit factory calls and the workspace components created,
+    counted by class. With '--PO profile-cprofile=<file>' the wrapped methods are additionally profiled with
+    cProfile and the statistics are dumped to <file>, to be read with pstats.
+    """
+    methods = ['buildModel', 'doParametersOfInterest', 'preProcessNuisances', 'getYieldScale']
+    # Called once per bin and process, the workspace is not scanned for new components after these
+    per_process_methods = ['getYieldScale']
+
+    def __init__(self, model, output, cprofile_output=None):
+        self.model = model
+        self.output = output
+        self.cprofile_output = cprofile_output
+        self.cprofile = cProfile.Profile() if cprofile_output else None
+        self.stats = defaultdict(lambda: {'calls': 0, 'wall_time': 0., 'cpu_time': 0., 'factory_calls': 0, 'created': defaultdict(int)})
+        self.factory_calls = 0
+        self.active = None
+        self.in_factory = False
+        self.builder = None
+        for method in self.methods:
+            if hasattr(model, method):
+                setattr(model, method, self.wrap(method, getattr(model, method)))
+        atexit.register(self.finish)
+
+    @classmethod
+    def fromPhysicsOptions(cls, model, physOptions):
+        """Install a profiler on the model, if requested by the physics options. Returns None otherwise."""
+        output, cprofile_output = None, None
+        for po in physOptions:
+            if po.startswith('profile='):
+                output = po.replace('profile=', '')
+            if po.startswith('profile-cprofile='):
+                cprofile_output = po.replace('profile-cprofile=', '')
+        if not output:
+            return None
+        print('Profiling physics model methods %s, report written to %s' % (', '.join(m for m in cls.methods if hasattr(model, m)), output))
+        return cls(model, output, cprofile_output)
+
+    def countComponents(self):
+        counts = defaultdict(int)
+        iterator = self.model.modelBuilder.out.components().createIterator()
+        component = iterator.Next()
+        while component:
+            counts[component.ClassName()] += 1
+            component = iterator.Next()
+        return counts
+
+    def wrapBuilder(self):
+        # Count the factory calls of the model builder and the direct ones on the workspace.
+        # The modelBuilder is only known once the first method is called.
+        builder = self.model.modelBuilder
+        if self.builder is builder:
+            return
+        self.builder = builder
+        factory_ = builder.factory_
+        def countedFactory_(*args, **kwargs):
+            self.countFactoryCall()
+            self.in_factory = True
+            try:
+                return factory_(*args, **kwargs)
+            finally:
+                self.in_factory = False
+        builder.factory_ = countedFactory_
+
+        factory = builder.out.factory
+        def countedFactory(*args, **kwargs):
+            if not self.in_factory:
+                self.countFactoryCall()
+            return factory(*args, **kwargs)
+        try:
+            builder.out.factory = countedFactory
+        except (AttributeError, TypeError):
+            print('[WARNING] Direct RooWorkspace::factory calls cannot be counted, only the ones via ModelBuilder.factory_')
+
+    def countFactoryCall(self):
+        self.factory_calls += 1
+        if self.active:
+            self.stats[self.active]['factory_calls'] += 1
+
+    def wrap(self, name, method):
+        def profiled(*args, **kwargs):
+            if self.active:
+                # nested call of another profiled method, attributed to the outer one
+                return method(*args, **kwargs)
+            self.wrapBuilder()
+            snapshot = name not in self.per_process_methods
+            before = self.countComponents() if snapshot else None
+            self.active = name
+            start, start_cpu = time.time(), cpuTime()
+            if self.cprofile:
+                self.cprofile.enable()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if self.cprofile:
+                    self.cprofile.disable()
+                stats = self.stats[name]
+                stats['calls'] += 1
+                stats['wall_time'] += time.time() - start
+                stats['cpu_time'] += cpuTime() - start_cpu
+                self.active = None
+                if snapshot:
+                    for cls, n in self.countComponents().items():
+                        if n != before.get(cls, 0):
+                            stats['created'][cls] += n - before.get(cls, 0)
+                    self.write()
+        return profiled
+
+    def totalCreated(self):
+        created = defaultdict(int)
+        for stats in self.stats.values():
+            for cls, n in stats['created'].items():
+                created[cls] += n
+        return created
+
+    def write(self):
+        created = self.totalCreated()
+        report = {
+            'model': self.model.__class__.__name__,
+            'methods': self.stats,
+            'factory_calls': self.factory_calls,
+            'created': created,
+            'histfuncs': created.get('RooHistFunc', 0),
+            'expressions': created.get('RooFormulaVar', 0) + created.get('RooGenericPdf', 0),
+        }
+        with open(self.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        if self.cprofile:
+            self.cprofile.dump_stats(self.cprofile_output)
+
+    def finish(self):
+        self.write()
+        print('Physics model profile of %s, written to %s:' % (self.model.__class__.__name__, self.output))
+        print('%-24s %8s %10s %10s %10s' % ('method', 'calls', 'wall [s]', 'cpu [s]', 'factory'))
+        for name in self.methods:
+            if name in self.stats:
+                stats = self.stats[name]
+                print('%-24s %8i %10.2f %10.2f %10i' % (name, stats['calls'], stats['wall_time'], stats['cpu_time'], stats['factory_calls']))
+        created = self.totalCreated()
+        print('Created %i histfuncs and %i expressions with %i factory calls' % (created.get('RooHistFunc', 0), created.get('RooFormulaVar', 0) + created.get('RooGenericPdf', 0), self.factory_calls))
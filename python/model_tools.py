@@ -0,0 +1,19 @@
+from __future__ import print_function
+
+import ROOT
+
+
+def scalingNuisances(memo, workspace, nuisances, proc, verbose=False):
+    """Model nuisance parameters the scaling function of the process depends on.
+
+    The scaling function 'scaling_<proc>' is looked up in the workspace and its parameters are intersected
+    with the set of model nuisances. The result is memoized in the dictionary memo per scaling function, since
+    the same signal processes appear in many bins.
+    """
+    scaling = 'scaling_%s' % proc
+    if scaling not in memo:
+        if verbose:
+            print(scaling)
+        params = workspace.function(scaling).getParameters(ROOT.RooArgSet()).contentsString().split(',')
+        memo[scaling] = nuisances.intersection(params)
+    return memo[scaling]
@@ -38,6 +38,10 @@ fi
 
 
 datacarddir=${defaultdir}/datacards_bsm-model-indep
+
+# record wall time, CPU time, peak memory and output sizes of the mode in ${defaultdir}/logs/run_log.jsonl
+source ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/utils/instrumentation.sh
+instrument_mode "$@"
 taskname="impacts_${TAG}_${PROCESS}_mH${MASS}"
 
 case $MODE in
@@ -185,6 +185,10 @@ defaultdir=$(readlink -f ${defaultdir})
 [[ ! -d ${defaultdir}/limits_${MODEL}/condor ]] && mkdir -p ${defaultdir}/limits_${MODEL}/condor
 
 datacarddir=${defaultdir}/datacards_${analysis}
+
+# record wall time, CPU time, peak memory and output sizes of the mode in ${defaultdir}/logs/run_log.jsonl
+source ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/utils/instrumentation.sh
+instrument_mode "$@"
 taskname="${analysis}_${TAG}_${MODEL}_1"
 taskname2="${analysis}_${TAG}_${MODEL}_2"
 
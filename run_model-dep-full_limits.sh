@@ -203,15 +203,26 @@ defaultdir=$(readlink -f ${defaultdir})
 [[ ! -d ${defaultdir}/limits_${MODEL}/condor ]] && mkdir -p ${defaultdir}/limits_${MODEL}/condor
 
 datacarddir=${defaultdir}/datacards_${analysis}
+
+# record wall time, CPU time, peak memory and output sizes of the mode in ${defaultdir}/logs/run_log.jsonl
+source ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/utils/instrumentation.sh
+instrument_mode "$@"
 taskname="${analysis}_${TAG}_${MODEL}_1"
 taskname2="${analysis}_${TAG}_${MODEL}_2"
 
+# use the adaptively refined grid configuration, once it has been created with the 'refine' mode
+gridjson=${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_asymptotic_grid_${MODEL}.json
+refinedgridjson=${defaultdir}/limits_${MODEL}/mssm_asymptotic_grid_${MODEL}_refined.json
+[[ -f ${refinedgridjson} ]] && gridjson=${refinedgridjson}
+mass_parameter="mA"
+[[ $MODEL == "mHH125" || $MODEL == "mh1125_CPV" ]] && mass_parameter="mHp"
+
 if [[ $MODE == "initial" ]]; then
     ############
     # morphing
     ############
     if [[ $ANALYSISTYPE == "classic" ]]; then
-        morph_parallel.py --output ${defaultdir}/datacards \
+        instrument morph_mssm ${datacarddir} -- morph_parallel.py --output ${defaultdir}/datacards \
             --analysis ${analysis} \
             --sub-analysis ${sub_analysis} \
             --hSM-treatment $HSMTREATMENT  \
@@ -224,7 +235,7 @@ if [[ $MODE == "initial" ]]; then
             --variable mt_tot_puppi \
             --parallel 10 2>&1 | tee -a ${defaultdir}/logs/morph_mssm_log.txt
     elif [[ $ANALYSISTYPE == "classic_lowmass" ]]; then
-        morph_parallel.py --output ${defaultdir}/datacards \
+        instrument morph_mssm_lowmass ${datacarddir} -- morph_parallel.py --output ${defaultdir}/datacards \
             --analysis ${analysis} \
             --sub-analysis ${sub_analysis} \
             --hSM-treatment $HSMTREATMENT  \
@@ -236,7 +247,7 @@ if [[ $MODE == "initial" ]]; then
             --category-list ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_classic_categories_2d_to_1d.txt \
             --variable m_sv_VS_pt_tt_splitpT \
             --parallel 10 2>&1 | tee -a ${defaultdir}/logs/morph_mssm_log_lowmass.txt
-        morph_parallel.py --output ${defaultdir}/datacards \
+        instrument morph_mssm_btag ${datacarddir} -- morph_parallel.py --output ${defaultdir}/datacards \
             --analysis ${analysis} \
             --sub-analysis ${sub_analysis} \
             --hSM-treatment $HSMTREATMENT  \
@@ -248,7 +259,7 @@ if [[ $MODE == "initial" ]]; then
             --category-list ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_classic_categories_1d_btag.txt \
             --variable m_sv_puppi \
             --parallel 10 2>&1 | tee -a ${defaultdir}/logs/morph_mssm_log_btag.txt
-        morph_parallel.py --output ${defaultdir}/datacards \
+        instrument morph_mssm_cr ${datacarddir} -- morph_parallel.py --output ${defaultdir}/datacards \
             --analysis ${analysis} \
             --sub-analysis ${sub_analysis} \
             --hSM-treatment $HSMTREATMENT  \
@@ -261,7 +272,7 @@ if [[ $MODE == "initial" ]]; then
             --variable mt_tot_puppi \
             --parallel 10 2>&1 | tee -a ${defaultdir}/logs/morph_mssm_log_cr.txt
     elif [[ $ANALYSISTYPE == "with-sm-ml" || $ANALYSISTYPE == "sm-ml-only" ]]; then
-        morph_parallel.py --output ${defaultdir}/datacards \
+        instrument morph_sm ${datacarddir} -- morph_parallel.py --output ${defaultdir}/datacards \
             --analysis ${analysis} \
             --sub-analysis ${sub_analysis} \
             --hSM-treatment $HSMTREATMENT  \
@@ -276,7 +287,7 @@ if [[ $MODE == "initial" ]]; then
             --parallel 10 2>&1 | tee -a ${defaultdir}/logs/morph_sm_log.txt
 
         if [[ $ANALYSISTYPE == "with-sm-ml" ]]; then
-            morph_parallel.py --output ${defaultdir}/datacards \
+            instrument morph_mssm ${datacarddir} -- morph_parallel.py --output ${defaultdir}/datacards \
                 --analysis ${analysis} \
                 --sub-analysis ${sub_analysis} \
                 --hSM-treatment $HSMTREATMENT  \
@@ -296,15 +307,15 @@ if [[ $MODE == "initial" ]]; then
     ############
     mkdir -p ${datacarddir}/combined/cmb/
 
-    rsync -av --progress ${datacarddir}/201?/htt_*/* ${datacarddir}/combined/cmb/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
+    instrument copy_datacards ${datacarddir}/combined/cmb -- rsync -av --progress ${datacarddir}/201?/htt_*/* ${datacarddir}/combined/cmb/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
     for era in 2016 2017 2018;
     do
         mkdir -p ${datacarddir}/${era}/cmb/
-        rsync -av --progress ${datacarddir}/${era}/htt_*/* ${datacarddir}/${era}/cmb/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards_${era}.txt
+        instrument copy_datacards ${datacarddir}/${era}/cmb -- rsync -av --progress ${datacarddir}/${era}/htt_*/* ${datacarddir}/${era}/cmb/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards_${era}.txt
         for channel in "et" "mt" "tt";
         do
             mkdir -p ${datacarddir}/${era}/${channel}/
-            rsync -av --progress ${datacarddir}/${era}/htt_${channel}*/* ${datacarddir}/${era}/${channel}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards_${era}_${channel}.txt
+            instrument copy_datacards ${datacarddir}/${era}/${channel} -- rsync -av --progress ${datacarddir}/${era}/htt_${channel}*/* ${datacarddir}/${era}/${channel}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards_${era}_${channel}.txt
         done
     done
     # Check if the expected number of datacards has been written
@@ -319,8 +330,10 @@ elif [[ $MODE == "ws" ]]; then
     # workspace creation
     ############
     if [[ $OLDFILES == 0 ]]; then
-        combineTool.py -M T2W -o ${wsoutput} \
+        instrument T2W ${datacarddir}/combined/cmb/${wsoutput} -- combineTool.py -M T2W -o ${wsoutput} \
         -P CombineHarvester.MSSMvsSMRun2Legacy.MSSMvsSM:MSSMvsSM \
+        --PO grid-cache=$(dirname ${defaultdir})/model_grid_cache \
+        --PO model-library=$(dirname ${defaultdir})/model_library/${MODEL}_${HSMTREATMENT}.root \
         --PO filePrefix=${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/data/ \
         --PO replace-with-SM125=${replace_with_sm125} \
         --PO hSM-treatment=$HSMTREATMENT \
@@ -332,7 +345,7 @@ elif [[ $MODE == "ws" ]]; then
         --PO qqh-pred-from-scaling=${scale_qqh_by_hand} \
         -i ${datacarddir}/combined/cmb/ 2>&1 | tee -a ${defaultdir}/logs/workspace_${MODEL}.txt
     else
-        combineTool.py -M T2W -o ${wsoutput} \
+        instrument T2W ${datacarddir}/combined/cmb/${wsoutput} -- combineTool.py -M T2W -o ${wsoutput} \
         -P CombineHarvester.MSSMvsSMRun2Legacy.MSSMvsSM_oldModels:MSSMvsSM_oldModels \
         --PO filePrefix=${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/data/ \
         --PO replace-with-SM125=${replace_with_sm125} \
@@ -352,8 +365,8 @@ elif [[ $MODE == "setup" ]]; then
     ############
     cd ${defaultdir}/limits_${MODEL}/condor
     if [[ $HSMTREATMENT == "hSM-in-bg" ]]; then
-        combineTool.py -M AsymptoticGrid \
-        ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_asymptotic_grid_${MODEL}.json \
+        instrument AsymptoticGrid ${defaultdir}/limits_${MODEL}/condor -- combineTool.py -M AsymptoticGrid \
+        ${gridjson} \
         -d ${datacarddir}/combined/cmb/${wsoutput} \
         --job-mode 'condor' \
         --task-name $taskname \
@@ -366,8 +379,8 @@ elif [[ $MODE == "setup" ]]; then
         --X-rtd MINIMIZER_analytic \
         --cminDefaultMinimizerTolerance 0.01 2>&1 | tee -a ${defaultdir}/logs/job_setup_${MODEL}.txt
     elif [[ $HSMTREATMENT == "no-hSM-in-bg" ]]; then
-        combineTool.py -M AsymptoticGrid \
-        ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_asymptotic_grid_${MODEL}.json \
+        instrument AsymptoticGrid ${defaultdir}/limits_${MODEL}/condor -- combineTool.py -M AsymptoticGrid \
+        ${gridjson} \
         -d ${datacarddir}/combined/cmb/${wsoutput} \
         --job-mode 'condor' \
         --task-name $taskname \
@@ -380,6 +393,16 @@ elif [[ $MODE == "setup" ]]; then
         --X-rtd MINIMIZER_analytic \
         --cminDefaultMinimizerTolerance 0.01 2>&1 | tee -a ${defaultdir}/logs/job_setup_${MODEL}.txt
     fi
+    # pack the points into jobs of similar wall time, using the fit times of earlier runs collected with 'collect-db'.
+    # Without such a database, the task is kept as created by AsymptoticGrid
+    if [[ -s ${datacarddir}/combined/cmb/limits_${MODEL}.db ]]; then
+        instrument pack_jobs ${defaultdir}/limits_${MODEL}/condor -- pack_asymptotic_grid_jobs.py \
+            --task-script condor_${taskname}.sh \
+            --database ${datacarddir}/combined/cmb/limits_${MODEL}.db \
+            --model ${MODEL} \
+            --pois ${mass_parameter},tanb \
+            --target-time 3600 2>&1 | tee -a ${defaultdir}/logs/job_setup_${MODEL}.txt
+    fi
 
 elif [[ $MODE == "submit" ]]; then
     ############
@@ -388,13 +411,24 @@ elif [[ $MODE == "submit" ]]; then
     cd ${defaultdir}/limits_${MODEL}/condor
     condor_submit condor_${taskname}.sub
 
+elif [[ $MODE == "refine" ]]; then
+    ############
+    # adaptive grid refinement around the CLs contours of the collected results,
+    # to be followed by 'setup', 'submit' and 'collect' until the contours are stable
+    ############
+    instrument refine_grid ${refinedgridjson} -- refine_asymptotic_grid.py \
+        --input-json ${gridjson} \
+        --grid-root ${defaultdir}/limits_${MODEL}/asymptotic_grid.root \
+        --output-json ${refinedgridjson} \
+        --points-output ${defaultdir}/limits_${MODEL}/refined_points_${MODEL}.txt 2>&1 | tee -a ${defaultdir}/logs/refine_grid_${MODEL}.txt
+
 elif [[ $MODE == "submit-local" ]]; then
     ############
     # job submission
     ############
     cp scripts/run_limits_locally.py ${defaultdir}/limits_${MODEL}/condor
     cd ${defaultdir}/limits_${MODEL}/condor
-    python run_limits_locally.py --cores 20 --taskname condor_${taskname}.sh
+    instrument run_limits_locally ${defaultdir}/limits_${MODEL}/condor -- python run_limits_locally.py --cores 20 --taskname condor_${taskname}.sh
 
 elif [[ $MODE == "hybrid-lhc" ]]; then
 
@@ -408,7 +442,7 @@ elif [[ $MODE == "hybrid-lhc" ]]; then
         jsonfile=${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_hybrid_grid_LHC_${MODEL}.json
     fi
 
-    combineTool.py -M HybridNewGrid \
+    instrument HybridNewGrid ${defaultdir}/limits_${MODEL}_hybrid_lhc/condor -- combineTool.py -M HybridNewGrid \
     ${jsonfile} \
     --cycles $CYCLES \
     -d ${datacarddir}/combined/cmb/${wsoutput} \
@@ -425,7 +459,7 @@ elif [[ $MODE == "hybrid-tev" ]]; then
     mkdir -p ${defaultdir}/limits_${MODEL}_hybrid_tev/condor
     cd ${defaultdir}/limits_${MODEL}_hybrid_tev/condor
 
-    combineTool.py -M HybridNewGrid \
+    instrument HybridNewGrid ${defaultdir}/limits_${MODEL}_hybrid_tev/condor -- combineTool.py -M HybridNewGrid \
     ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_hybrid_grid_TEV_${MODEL}.json \
     --cycles $CYCLES \
     -d ${datacarddir}/combined/cmb/${wsoutput} \
@@ -441,7 +475,7 @@ elif [[ $MODE == "collect-hybrid-lhc" ]]; then
 
     cd ${defaultdir}/limits_${MODEL}_hybrid_lhc/condor
 
-    combineTool.py -M HybridNewGrid \
+    instrument HybridNewGrid ${defaultdir}/limits_${MODEL}_hybrid_lhc/condor -- combineTool.py -M HybridNewGrid \
     ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_hybrid_grid_LHC_${MODEL}.json \
     --cycles 0 \
     --output \
@@ -458,7 +492,7 @@ elif [[ $MODE == "collect-hybrid-tev" ]]; then
 
     cd ${defaultdir}/limits_${MODEL}_hybrid_tev/condor
 
-    combineTool.py -M HybridNewGrid \
+    instrument HybridNewGrid ${defaultdir}/limits_${MODEL}_hybrid_tev/condor -- combineTool.py -M HybridNewGrid \
     ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_hybrid_grid_LHC_${MODEL}.json \
     --cycles 0 \
     --output \
@@ -501,15 +535,31 @@ elif [[ $MODE == "copy-results-gc" ]]; then
     ############
     # job submission
     ############
-    rsync -avhP /storage/gridka-nrg/${GRIDUSER}/gc_storage/combine/${taskname}/output/ ${defaultdir}/limits_${MODEL}/condor
+    instrument copy_results ${defaultdir}/limits_${MODEL}/condor -- rsync -avhP /storage/gridka-nrg/${GRIDUSER}/gc_storage/combine/${taskname}/output/ ${defaultdir}/limits_${MODEL}/condor
+
+elif [[ $MODE == "collect-db" ]]; then
+    ############
+    # incremental job collection into the result database next to the workspace,
+    # only job outputs added or modified since the last collection are read
+    ############
+    instrument ingest_db ${datacarddir}/combined/cmb/limits_${MODEL}.db -- limit_result_database.py ingest "${defaultdir}/limits_${MODEL}/condor/higgsCombine*.root" \
+        --database ${datacarddir}/combined/cmb/limits_${MODEL}.db \
+        --model ${MODEL} \
+        --pois ${mass_parameter},tanb \
+        --parallel 10 2>&1 | tee -a ${defaultdir}/logs/collect_jobs_db_${MODEL}.txt
+    instrument export_db ${defaultdir}/limits_${MODEL}/asymptotic_grid.root -- limit_result_database.py export \
+        --database ${datacarddir}/combined/cmb/limits_${MODEL}.db \
+        --model ${MODEL} \
+        --method AsymptoticLimits \
+        --output ${defaultdir}/limits_${MODEL}/asymptotic_grid.root 2>&1 | tee -a ${defaultdir}/logs/collect_jobs_db_${MODEL}.txt
 
 elif [[ $MODE == "collect" ]]; then
     ############
     # job collection
     ############
     cd ${defaultdir}/limits_${MODEL}/condor
-    combineTool.py -M AsymptoticGrid \
-    ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_asymptotic_grid_${MODEL}.json \
+    instrument AsymptoticGrid ${defaultdir}/limits_${MODEL}/condor/asymptotic_grid.root -- combineTool.py -M AsymptoticGrid \
+    ${gridjson} \
     -d ${datacarddir}/combined/cmb/${wsoutput} \
     --job-mode 'condor' \
     --task-name $taskname2 \
@@ -543,7 +593,7 @@ elif [[ $MODE == "collect" ]]; then
     modelname=${MODEL}_13.root
     [[ $OLDFILES == 1 ]] && modelname="${MODEL}_13_old.root"
     for label in "Preliminary" "" "Supplementary"; do
-        ${CMSSW_BASE}/src/CombineHarvester/CombineTools/scripts/plotLimitGrid.py asymptotic_grid.root \
+        instrument plotLimitGrid "${defaultdir}/limits_${MODEL}/${TAG}_${MODEL}_${label}*" -- ${CMSSW_BASE}/src/CombineHarvester/CombineTools/scripts/plotLimitGrid.py asymptotic_grid.root \
         --scenario-label="${scenario_label}" \
         --output ${TAG}_${MODEL}_${label} \
         --title-right="${title}" \
@@ -197,6 +197,10 @@ defaultdir=$(readlink -f ${defaultdir})
 [[ ! -d ${defaultdir}/limits_${MODEL}/jobs ]] && mkdir -p ${defaultdir}/limits_${MODEL}/jobs
 
 datacarddir=${defaultdir}/datacards_${analysis}
+
+# record wall time, CPU time, peak memory and output sizes of the mode in ${defaultdir}/logs/run_log.jsonl
+source ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/utils/instrumentation.sh
+instrument_mode "$@"
 taskname="${analysis}_${TAG}_${MODEL}_1"
 taskname2="${analysis}_${TAG}_${MODEL}_2"
 
@@ -323,6 +327,7 @@ elif [[ $MODE == "ws" ]]; then
     elif [[ $OLDFILES == 0 ]]; then
         combineTool.py -M T2W -o ${wsoutput} \
         -P CombineHarvester.MSSMvsSMRun2Legacy.MSSMvsSM:MSSMvsSM \
+        --PO grid-cache=$(dirname ${defaultdir})/model_grid_cache \
         --PO filePrefix=${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/data/ \
         --PO replace-with-SM125=${replace_with_sm125} \
         --PO hSM-treatment=$HSMTREATMENT \
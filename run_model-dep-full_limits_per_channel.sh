@@ -95,6 +95,10 @@ defaultdir=$(readlink -f analysis/$TAG)
 [[ ! -d ${defaultdir}/limits_${MODEL}/condor ]] && mkdir -p ${defaultdir}/limits_${MODEL}/condor
 
 datacarddir=${defaultdir}/datacards_${analysis}
+
+# record wall time, CPU time, peak memory and output sizes of the mode in ${defaultdir}/logs/run_log.jsonl
+source ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/utils/instrumentation.sh
+instrument_mode "$@"
 taskname="${analysis}_${TAG}_1"
 taskname2="${analysis}_${TAG}_2"
 
@@ -146,6 +150,7 @@ elif [[ $MODE == "ws" ]]; then
     ############
     combineTool.py -M T2W -o ${wsoutput} \
     -P CombineHarvester.MSSMvsSMRun2Legacy.MSSMvsSM:MSSMvsSM \
+    --PO grid-cache=$(dirname ${defaultdir})/model_grid_cache \
     --PO filePrefix=${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/data/ \
     --PO replace-with-SM125=${replace_with_sm125} \
     --PO hSM-treatment=$HSMTREATMENT \
@@ -274,6 +279,7 @@ elif [[ $MODE == "collect" ]]; then
 elif [[ $MODE == "plot-prefit" ]]; then
     combineTool.py -M T2W -o ${wsoutput} \
         -P CombineHarvester.MSSMvsSMRun2Legacy.MSSMvsSM:MSSMvsSM \
+        --PO grid-cache=$(dirname ${defaultdir})/model_grid_cache \
         --PO filePrefix=${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/data/ \
         --PO modelFile=${modelfile} \
         --PO minTemplateMass=${min_mass} \
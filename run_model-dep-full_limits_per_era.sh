@@ -40,6 +40,10 @@ defaultdir=analysis/$TAG
 [[ ! -d ${defaultdir}/limits_ind/condor ]] && mkdir -p ${defaultdir}/limits_ind/condor
 defaultdir=$(readlink -f analysis/$TAG)
 datacarddir=${defaultdir}/datacards_${analysis}
+
+# record wall time, CPU time, peak memory and output sizes of the mode in ${defaultdir}/logs/run_log.jsonl
+source ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/utils/instrumentation.sh
+instrument_mode "$@"
 taskname="${analysis}_${TAG}_1"
 taskname2="${analysis}_${TAG}_2"
 
@@ -100,6 +104,7 @@ elif [[ $MODE == "ws" ]]; then
     ############
     combineTool.py -M T2W -o ws_mh125.root \
     -P CombineHarvester.MSSMvsSMRun2Legacy.MSSMvsSM:MSSMvsSM \
+    --PO grid-cache=$(dirname ${defaultdir})/model_grid_cache \
     --PO filePrefix=${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/data/ \
     --PO replace-with-SM125=${replace_with_sm125} \
     --PO hSM-treatment=$HSMTREATMENT \
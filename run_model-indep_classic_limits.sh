@@ -21,6 +21,10 @@ sm_like_hists="bsm"
 [[ ! -d ${defaultdir}/limits_ind/condor ]] && mkdir -p ${defaultdir}/limits_ind/condor
 defaultdir=$(readlink -f analysis_2022_02_28/$TAG)
 datacarddir=${defaultdir}/datacards_${analysis}
+
+# record wall time, CPU time, peak memory and output sizes of the mode in ${defaultdir}/logs/run_log.jsonl
+source ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/utils/instrumentation.sh
+instrument_mode "$@"
 freeze="MH=1200,r_ggH=0.005,r_bbH=0.0015"
 identifier_toy_submit=$(date +%Y_%m_%d)
 [[ -z $3 ]] || identifier_toy_submit=$3
@@ -173,7 +177,7 @@ if [[ $MODE == "initial" ]]; then
     ############
     # morphing
     ############
-    morph_parallel.py --output ${defaultdir}/datacards \
+    instrument morph_mssm ${datacarddir} -- morph_parallel.py --output ${defaultdir}/datacards \
         --analysis ${analysis} \
         --sub-analysis "none" \
         --hSM-treatment ${hSM_treatment} \
@@ -190,20 +194,20 @@ if [[ $MODE == "initial" ]]; then
     # combining outputs
     ############
     mkdir -p ${datacarddir}/combined/cmb/
-    rsync -av --progress ${datacarddir}/201?/htt_*/* ${datacarddir}/combined/cmb/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
+    instrument copy_datacards ${datacarddir}/combined/cmb -- rsync -av --progress ${datacarddir}/201?/htt_*/* ${datacarddir}/combined/cmb/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
     for ERA in 2016 2017 2018; do
         for CH in et mt tt em; do
             mkdir -p ${datacarddir}/${ERA}/${CH}/
-            rsync -av --progress ${datacarddir}/${ERA}/htt_${CH}*/* ${datacarddir}/${ERA}/${CH}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
+            instrument copy_datacards ${datacarddir}/${ERA}/${CH} -- rsync -av --progress ${datacarddir}/${ERA}/htt_${CH}*/* ${datacarddir}/${ERA}/${CH}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
         done
         mkdir -p ${datacarddir}/${ERA}/cmb/
-        rsync -av --progress ${datacarddir}/${ERA}/htt_*/* ${datacarddir}/${ERA}/cmb/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
+        instrument copy_datacards ${datacarddir}/${ERA}/cmb -- rsync -av --progress ${datacarddir}/${ERA}/htt_*/* ${datacarddir}/${ERA}/cmb/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
     done
 
     # Perform checks on the produced datacards
 
     # Run datacard check from Higgs PAG
-    combineTool.py -M T2W \
+    instrument check_physics_model -- combineTool.py -M T2W \
         -o ws.root \
         -P HiggsAnalysis.CombinedLimit.PhysicsModel:multiSignalModel \
         --PO '"map=^.*/ggh_(i|t|b).?$:r_ggH[0,0,200]"' \
@@ -212,7 +216,7 @@ if [[ $MODE == "initial" ]]; then
         -m 110 \
         --X-allow-no-signal --just-check-physics-model
 
-    ValidateDatacards.py ${datacarddir}/restore_binning/combined.txt.cmb \
+    instrument validate_datacards ${datacarddir}/restore_binning/validation_restore_binning.json -- ValidateDatacards.py ${datacarddir}/restore_binning/combined.txt.cmb \
         --jsonFile ${datacarddir}/restore_binning/validation_restore_binning.json \
         --mass 110 --printLevel 1
 
@@ -228,7 +232,7 @@ elif [[ $MODE == "ws" ]]; then
     # workspace creation
     ############
 
-    combineTool.py -M T2W -o "ws.root" \
+    instrument T2W "${datacarddir}/combined/cmb/ws.root" -- combineTool.py -M T2W -o "ws.root" \
     -P HiggsAnalysis.CombinedLimit.PhysicsModel:multiSignalModel \
     --PO '"map=^.*/ggh_(i|t|b).?$:r_ggH[0,0,200]"' \
     --PO '"map=^.*/bbh$:r_bbH[0,0,200]"' \
@@ -241,7 +245,7 @@ elif [[ $MODE == "setup" ]]; then
     # job setup creation
     ############
     cd ${defaultdir}/limits_ind/condor
-    combineTool.py -m "60,80,100,120,125,130,140,160,180,200,250,300,350,400,450,500,600,700,800,900,1000,1200,1400,1600,1800,2000,2300,2600,2900,3200,3500" \
+    instrument AsymptoticLimits_bbH ${defaultdir}/limits_ind/condor -- combineTool.py -m "60,80,100,120,125,130,140,160,180,200,250,300,350,400,450,500,600,700,800,900,1000,1200,1400,1600,1800,2000,2300,2600,2900,3200,3500" \
     -M AsymptoticLimits \
     --rAbsAcc 0 \
     --rRelAcc 0.0005 \
@@ -258,7 +262,7 @@ elif [[ $MODE == "setup" ]]; then
     --cminDefaultMinimizerTolerance 0.01 \
     -v 1 | tee -a ${defaultdir}/logs/job_setup_modelind_bbh.txt
 
-    combineTool.py -m "60,80,100,120,125,130,140,160,180,200,250,300,350,400,450,500,600,700,800,900,1000,1200,1400,1600,1800,2000,2300,2600,2900,3200,3500" \
+    instrument AsymptoticLimits_ggH ${defaultdir}/limits_ind/condor -- combineTool.py -m "60,80,100,120,125,130,140,160,180,200,250,300,350,400,450,500,600,700,800,900,1000,1200,1400,1600,1800,2000,2300,2600,2900,3200,3500" \
     -M AsymptoticLimits \
     --rAbsAcc 0 \
     --rRelAcc 0.0005 \
@@ -277,20 +281,20 @@ elif [[ $MODE == "setup" ]]; then
 
 elif [[ $MODE == "ws-gof" ]]; then
     for CH in et mt tt em; do
-        rsync -av --progress ${datacarddir}/201?/htt_${CH}_*/* ${datacarddir}/combined/${CH}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
+        instrument copy_datacards ${datacarddir}/combined/${CH} -- rsync -av --progress ${datacarddir}/201?/htt_${CH}_*/* ${datacarddir}/combined/${CH}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
     done
     # Copy ttbar control region to every channel to include it in the workspaces
     for ERA in 2016 2017 2018; do
         for CH in et mt tt; do
-            rsync -av --progress ${datacarddir}/${ERA}/htt_em_2_${ERA}/* ${datacarddir}/${ERA}/${CH}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
-            rsync -av --progress ${datacarddir}/${ERA}/htt_em_2_${ERA}/* ${datacarddir}/combined/${CH}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
+            instrument copy_datacards ${datacarddir}/${ERA}/${CH} -- rsync -av --progress ${datacarddir}/${ERA}/htt_em_2_${ERA}/* ${datacarddir}/${ERA}/${CH}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
+            instrument copy_datacards ${datacarddir}/combined/${CH} -- rsync -av --progress ${datacarddir}/${ERA}/htt_em_2_${ERA}/* ${datacarddir}/combined/${CH}/ 2>&1 | tee -a ${defaultdir}/logs/copy_datacards.txt
         done
     done
     ############
     # workspace creation for GoF tests
     ############
 
-    combineTool.py -M T2W -o "ws-gof.root" \
+    instrument T2W_gof "${datacarddir}/*/*/ws-gof.root" -- combineTool.py -M T2W -o "ws-gof.root" \
     -i ${datacarddir}/*/{et,mt,tt,em,cmb}/ \
     --channel-masks \
     -m 125.0 --parallel 8 | tee -a ${defaultdir}/logs/workspace_gof_independent.txt
@@ -299,7 +303,7 @@ elif [[ $MODE == "ws-plot" ]]; then
     ###############
     # workspace production for plots
     ###############
-    combineTool.py -M T2W -o "ws.root" \
+    instrument T2W_plots "${datacarddir}/201?/htt_*/ws.root" -- combineTool.py -M T2W -o "ws.root" \
     -P HiggsAnalysis.CombinedLimit.PhysicsModel:multiSignalModel \
     --PO '"map=^.*/ggh_(i|t|b).?$:r_ggH[-50,200]"' \
     --PO '"map=^.*/bbh$:r_bbH[-50,0,200]"' \
@@ -322,17 +326,17 @@ elif [[ $MODE == "submit-local" ]]; then
     ############
     cp scripts/run_limits_locally.py ${defaultdir}/limits_ind/condor
     cd ${defaultdir}/limits_ind/condor
-    python run_limits_locally.py --cores 10 --njobs 31 --taskname condor_bbH_full_cmb.sh
-    python run_limits_locally.py --cores 10 --njobs 31 --taskname condor_ggH_full_cmb.sh
+    instrument run_limits_locally_bbH ${defaultdir}/limits_ind/condor -- python run_limits_locally.py --cores 10 --njobs 31 --taskname condor_bbH_full_cmb.sh
+    instrument run_limits_locally_ggH ${defaultdir}/limits_ind/condor -- python run_limits_locally.py --cores 10 --njobs 31 --taskname condor_ggH_full_cmb.sh
 
 elif [[ $MODE == "collect" ]]; then
     for p in gg bb
     do
-        combineTool.py -M CollectLimits ${datacarddir}/combined/cmb/higgsCombine.${p}H*.root \
+        instrument CollectLimits ${datacarddir}/combined/cmb/mssm_${p}H_cmb.json -- combineTool.py -M CollectLimits ${datacarddir}/combined/cmb/higgsCombine.${p}H*.root \
         --use-dirs \
         -o ${datacarddir}/combined/cmb/mssm_${p}H_cmb.json
 
-        plotMSSMLimits.py --cms-sub "Preliminary" \
+        instrument plot_limits "mssm_model-independent_${p}H_cmb*" -- plotMSSMLimits.py --cms-sub "Preliminary" \
         --title-right "138 fb^{-1} (13 TeV)" \
         --process "${p}#phi" \
         --y-axis-min 0.0001 \
@@ -348,20 +352,20 @@ elif [[ $MODE == "prefit-plots" ]]; then
     # Extract prefit shapes.
     #####################
     for era in 2016 2017 2018; do
-        prefit_postfit_shapes_parallel.py --datacard_pattern "${datacarddir}/${era}/htt_em_2_*/combined.txt.cmb" \
+        instrument prefit_shapes "${datacarddir}/${era}/htt_*/prefit_shapes_${freeze}.root" -- prefit_postfit_shapes_parallel.py --datacard_pattern "${datacarddir}/${era}/htt_em_2_*/combined.txt.cmb" \
                                           --workspace_name ws.root \
                                           --output_name prefit_shapes_${freeze}.root \
                                           --parallel 8 | tee -a ${defaultdir}/logs/extract_model_independent_shapes-combined-${freeze}.log
-        prefit_postfit_shapes_parallel.py --datacard_pattern "${datacarddir}/${era}/htt_*_3*/combined.txt.cmb" \
+        instrument prefit_shapes "${datacarddir}/${era}/htt_*/prefit_shapes_${freeze}.root" -- prefit_postfit_shapes_parallel.py --datacard_pattern "${datacarddir}/${era}/htt_*_3*/combined.txt.cmb" \
                                           --workspace_name ws.root \
                                           --freeze_arguments "--freeze ${freeze}" \
                                           --output_name prefit_shapes_${freeze}.root \
                                           --parallel 8 | tee -a ${defaultdir}/logs/extract_model_independent_shapes-combined-${freeze}.log
     done
-    hadd -f ${datacarddir}/combined/cmb/prefit_shapes_${freeze}.root ${datacarddir}/201?/htt_*/prefit_shapes_${freeze}.root | tee -a ${defaultdir}/logs/extract_model_independent_shapes-combined-${freeze}.log
+    instrument hadd_prefit_shapes ${datacarddir}/combined/cmb/prefit_shapes_${freeze}.root -- hadd -f ${datacarddir}/combined/cmb/prefit_shapes_${freeze}.root ${datacarddir}/201?/htt_*/prefit_shapes_${freeze}.root | tee -a ${defaultdir}/logs/extract_model_independent_shapes-combined-${freeze}.log
 
     for era in 2016 2017 2018; do
-        bash plotting/plot_shapes_mssm_model_independent.sh \
+        instrument plot_prefit_shapes ${datacarddir}/plots -- bash plotting/plot_shapes_mssm_model_independent.sh \
             ${era} \
             "${datacarddir}/combined/cmb/prefit_shapes_${freeze}.root" \
             "${datacarddir}/plots/prefit_shapes_$(echo ${freeze} | sed 's/=//g; s/\./p/g')/" \
@@ -371,7 +375,7 @@ elif [[ $MODE == "prefit-plots" ]]; then
     done
 
 elif [[ $MODE == "fit-for-plots" ]]; then
-    combineTool.py -M FitDiagnostics \
+    instrument FitDiagnostics ${datacarddir}/combined/cmb/fitDiagnostics.combined-cmb.for_shape_unblinding.root -- combineTool.py -M FitDiagnostics \
         -d ${datacarddir}/combined/cmb/ws.root \
         -m 200 \
         --setParameters r_ggH=0,r_bbH=0 --setParameterRange r_ggH=-0.00001,0.00001:r_bbH=-2,5 \
@@ -389,12 +393,12 @@ elif [[ $MODE == "postfit-plots" ]]; then
     #####################
     fitfile=${datacarddir}/combined/cmb/fitDiagnostics.combined-cmb.for_shape_unblinding.root
     for era in 2016 2017 2018; do
-        prefit_postfit_shapes_parallel.py --datacard_pattern "${datacarddir}/${era}/htt_em_2_*/combined.txt.cmb" \
+        instrument postfit_shapes "${datacarddir}/${era}/htt_*/postfit_shapes_${freeze}.root" -- prefit_postfit_shapes_parallel.py --datacard_pattern "${datacarddir}/${era}/htt_em_2_*/combined.txt.cmb" \
                                           --workspace_name ws.root \
                                           --fit_arguments "-f ${fitfile}:fit_b --postfit --sampling" \
                                           --output_name postfit_shapes_${freeze}.root \
                                           --parallel 8 | tee -a ${defaultdir}/logs/extract_model_independent_shapes-postfit-combined-${freeze}.log
-        prefit_postfit_shapes_parallel.py --datacard_pattern "${datacarddir}/${era}/htt_*_3*_*/combined.txt.cmb" \
+        instrument postfit_shapes "${datacarddir}/${era}/htt_*/postfit_shapes_${freeze}.root" -- prefit_postfit_shapes_parallel.py --datacard_pattern "${datacarddir}/${era}/htt_*_3*_*/combined.txt.cmb" \
                                           --workspace_name ws.root \
                                           --freeze_arguments "--freeze ${freeze}" \
                                           --fit_arguments "-f ${fitfile}:fit_b --postfit --sampling" \
@@ -402,10 +406,10 @@ elif [[ $MODE == "postfit-plots" ]]; then
                                           --parallel 8 | tee -a ${defaultdir}/logs/extract_model_independent_shapes-postfit-combined-${freeze}.log
     done
 
-    hadd -f ${datacarddir}/combined/cmb/postfit_shapes_${freeze}.root ${datacarddir}/201?/htt_*/postfit_shapes_${freeze}.root | tee -a ${defaultdir}/logs/extract_model_independent_shapes-postfit-combined-${freeze}.log
+    instrument hadd_postfit_shapes ${datacarddir}/combined/cmb/postfit_shapes_${freeze}.root -- hadd -f ${datacarddir}/combined/cmb/postfit_shapes_${freeze}.root ${datacarddir}/201?/htt_*/postfit_shapes_${freeze}.root | tee -a ${defaultdir}/logs/extract_model_independent_shapes-postfit-combined-${freeze}.log
 
     for era in 2016 2017 2018; do
-        bash plotting/plot_shapes_mssm_model_independent.sh \
+        instrument plot_postfit_shapes ${datacarddir}/plots -- bash plotting/plot_shapes_mssm_model_independent.sh \
             ${era} \
             "${datacarddir}/combined/cmb/postfit_shapes_${freeze}.root" \
             "${datacarddir}/plots/postfit_shapes_$(echo ${freeze} | sed 's/=//g; s/\./p/g')/" \
@@ -418,7 +422,7 @@ elif [[ $MODE == "prepare-ggH-bbH-scan" ]]; then
     [[ ! -d ${defaultdir}/ggH_bbH_scan_ind/condor ]] && mkdir -p ${defaultdir}/ggH_bbH_scan_ind/condor
     cd ${defaultdir}/ggH_bbH_scan_ind/condor
     # Run 2D likelihood scans for r_ggH and r_bbH
-    combineTool.py -M MultiDimFit \
+    instrument MultiDimFit_scan ${defaultdir}/ggH_bbH_scan_ind/condor -- combineTool.py -M MultiDimFit \
         --algo grid --points 225 --split-points 50 \
         -m "60,80,100,120,125,130,140,160,180,200,250,300,350,400,450,500,600,700,800,900,1000,1200,1400,1600,1800,2000,2300,2600,2900,3200,3500" \
         --boundlist ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_ggH_bbH_2D_boundaries.json \
@@ -432,7 +436,7 @@ elif [[ $MODE == "prepare-ggH-bbH-scan" ]]; then
         # -m "60,80,100,120,125,130,140,160,180,200,250,300,350,400,450,500,600,700,800,900,1000,1200,1400,1600,1800,2000,2300,2600,2900,3200,3500" \
 
     # Create asimov dataset for SM-expectation.
-    combineTool.py -M MultiDimFit \
+    instrument MultiDimFit_asimov ${datacarddir}/combined/cmb -- combineTool.py -M MultiDimFit \
         --algo none \
         -m "125" \
         --boundlist ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_ggH_bbH_2D_boundaries.json \
@@ -448,7 +452,7 @@ elif [[ $MODE == "prepare-ggH-bbH-scan" ]]; then
     # cp output/mssm_070617_SMHbkg/cmb/higgsCombine.2D.ToyDataset.SM1.MultiDimFit.mH125.123456.root output/mssm_201017/cmb/higgsCombine.2D.ToyDataset.SM1.MultiDimFit.mH125.123456.root
 
     # Run fits on this asimov dataset
-    combineTool.py -M MultiDimFit \
+    instrument MultiDimFit_bestfit ${defaultdir}/ggH_bbH_scan_ind/condor -- combineTool.py -M MultiDimFit \
         --algo none \
         -m "60,80,100,120,125,130,140,160,180,200,250,300,350,400,450,500,600,700,800,900,1000,1200,1400,1600,1800,2000,2300,2600,2900,3200,3500" \
         --boundlist ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/input/mssm_ggH_bbH_2D_boundaries.json \
@@ -466,7 +470,7 @@ elif [[ $MODE == "submit-ggH-bbH-scan" ]]; then
 elif [[ $MODE == "collect-ggH-bbH-scan" ]]; then
     cd ${defaultdir}/ggH_bbH_scan_ind/
     for mass in 60 80 100 120 125 130 140 160 180 200 250 300 350 400 450 500 600 700 800 900 1000 1200 1400 1600 1800 2000 2300 2600 2900 3200 3500; do
-        python ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/plotting/plotMultiDimFit.py \
+        instrument plot_MultiDimFit "${defaultdir}/ggH_bbH_scan_ind/2D_limit_mH${mass}*" -- python ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/plotting/plotMultiDimFit.py \
             --title-right="138 fb^{-1} (13 TeV)" \
             --cms-sub="Preliminary" \
             --mass $mass \
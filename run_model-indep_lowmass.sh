@@ -105,6 +105,10 @@ real_data=1
 [[ ! -d ${defaultdir}/limits_ind/condor ]] && mkdir -p ${defaultdir}/limits_ind/condor
 defaultdir=$(readlink -f analysis_2022_02_28/$TAG)
 datacarddir=${defaultdir}/datacards_${analysis}
+
+# record wall time, CPU time, peak memory and output sizes of the mode in ${defaultdir}/logs/run_log.jsonl
+source ${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/utils/instrumentation.sh
+instrument_mode "$@"
 identifier_toy_submit=$(date +%Y_%m_%d)
 [[ -z $3 ]] || identifier_toy_submit=$3
 
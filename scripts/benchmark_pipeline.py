@@ -0,0 +1,406 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+from CombineHarvester.MSSMvsSMRun2Legacy.local_executor import Task, run_task
+
+PACKAGE = os.path.join(os.environ.get("CMSSW_BASE", ""), "src/CombineHarvester/MSSMvsSMRun2Legacy")
+
+STAGES = ["generate", "morphing", "t2w", "asymptotic", "postfit"]
+
+MASS_POINTS = ["60", "80", "100", "120", "125", "130", "140", "160", "180", "200", "250", "300", "350", "400", "450", "500",
+               "600", "700", "800", "900", "1000", "1200", "1400", "1600", "1800", "2000", "2300", "2600", "2900", "3200", "3500"]
+
+# Physics models for the workspace creation with their options, following the run_*.sh scripts.
+# No model grid cache or library is used, such that the full workspace building is timed.
+PHYSICS_MODELS = {
+    "MSSMvsSM" : ["-P CombineHarvester.MSSMvsSMRun2Legacy.MSSMvsSM:MSSMvsSM",
+                  "--PO filePrefix={PACKAGE}/data/",
+                  "--PO replace-with-SM125=1",
+                  "--PO hSM-treatment={HSM_TREATMENT}",
+                  "--PO modelFile={MODEL_FILE}",
+                  "--PO minTemplateMass={MIN_MASS}",
+                  "--PO maxTemplateMass={MAX_MASS}",
+                  "--PO MSSM-NLO-Workspace={PACKAGE}/data/higgs_pt_reweighting_fullRun2.root",
+                  "--PO sm-predictions={PACKAGE}/input/sm_predictions_13TeV.json"],
+    "THDMvsSM" : ["-P CombineHarvester.MSSMvsSMRun2Legacy.THDMvsSM:THDMvsSM",
+                  "--PO filePrefix={PACKAGE}/data/",
+                  "--PO modelFile={THDM_MODEL_FILE}",
+                  "--PO MSSM-NLO-Workspace={PACKAGE}/data/higgs_pt_reweighting_fullRun2.root",
+                  "--PO replace-with-sm125=1",
+                  "--PO sm-predictions={PACKAGE}/input/sm_predictions_13TeV.json"],
+    "YtYbScan" : ["-P CombineHarvester.MSSMvsSMRun2Legacy.YtYbScan:YtYbScan",
+                  "--PO XS-Workspace={PACKAGE}/data/xs_lowmass_yb_yt.root"],
+}
+
+# Parameters of the single AsymptoticGrid point and the prefit shapes for each physics model
+MODEL_POINTS = {
+    "MSSMvsSM" : ("mA", "tanb"),
+    "THDMvsSM" : ("mH", "tanb"),
+}
+
+ASYMPTOTIC_OPTIONS = "--redefineSignalPOI r --setParameterRanges r=0,1 --setParameters r=1,x=1 --freezeParameters x" \
+                     " --cminDefaultMinimizerStrategy 0 --X-rtd MINIMIZER_analytic --cminDefaultMinimizerTolerance 0.01"
+
+X_RANGE = (0., 4000.)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the datacard to limits pipeline on synthetic shape files. Times the morphing, "
+                    "the workspace creation, a single AsymptoticGrid point and the prefit shapes, and records "
+                    "the results as JSON to compare them across commits.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--workdir", default="benchmark", help="Directory for the synthetic inputs and all outputs")
+    parser.add_argument("--output", default=None, help="JSON file with the results, by default benchmark_<commit>.json in the working directory")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma separated list of stages to run, out of {}".format(",".join(STAGES)))
+    parser.add_argument("--compare", nargs=2, metavar=("REFERENCE", "RESULT"), default=None,
+                        help="Compare two result files instead of running the benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative increase of the wall time counted as regression in --compare mode")
+    size = parser.add_argument_group("size of the synthetic inputs")
+    size.add_argument("--era", default="2018", help="Data-taking period")
+    size.add_argument("--channels", default="mt", help="Comma separated list of channels")
+    size.add_argument("--categories", type=int, default=0, help="Number of categories per channel, 0 for all")
+    size.add_argument("--bins", type=int, default=40, help="Number of bins of each template")
+    size.add_argument("--mass-points", type=int, default=6, help="Number of signal mass points, spread over the full mass range")
+    size.add_argument("--no-shape-systematics", action="store_true",
+                      help="Drop all shape systematics. Otherwise the full set of the systematics model is used")
+    size.add_argument("--seed", type=int, default=42, help="Seed of the random numbers used for the templates")
+    config = parser.add_argument_group("analysis configuration")
+    config.add_argument("--analysis", default="bsm-model-dep-full", help="Analysis passed to MorphingMSSMvsSM")
+    config.add_argument("--sub-analysis", default="sm-like-light", help="Sub-analysis passed to MorphingMSSMvsSM")
+    config.add_argument("--hSM-treatment", default="hSM-in-bg", help="hSM treatment passed to MorphingMSSMvsSM and the physics models")
+    config.add_argument("--categorization", default="classic", help="Categorization passed to MorphingMSSMvsSM")
+    config.add_argument("--sm-like-hists", default="sm125", help="Templates of the SM-like Higgs boson passed to MorphingMSSMvsSM")
+    config.add_argument("--variable", default="mt_tot_puppi", help="Discriminating variable")
+    config.add_argument("--models", default="MSSMvsSM", help="Comma separated list of physics models, out of {}".format(",".join(sorted(PHYSICS_MODELS))))
+    config.add_argument("--model-file", default="13,Run2017,mh125_13.root", help="Benchmark scenario for MSSMvsSM")
+    config.add_argument("--thdm-model-file", default="BP1_Type2.root", help="Benchmark scenario for THDMvsSM")
+    config.add_argument("--point", default="500,10", help="Mass and tanb of the AsymptoticGrid point and the prefit shapes")
+    config.add_argument("--parallel", type=int, default=1, help="Parallel processes for the morphing")
+    config.add_argument("--no-group-categories", action="store_true", help="Run the morphing in one process per category")
+    return parser.parse_args()
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(["git", "-C", PACKAGE, "rev-parse", "HEAD"]).decode().strip()
+        dirty = bool(subprocess.check_output(["git", "-C", PACKAGE, "status", "--porcelain", "--untracked-files=no"]).decode().strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def timed(name, command, workdir, cwd=None):
+    """Run the command with its output in <workdir>/logs/<name>.log and return wall time and peak memory."""
+    log = os.path.join(workdir, "logs", "{}.log".format(name))
+    if cwd:
+        command = "cd {} && {}".format(cwd, command)
+    print("[INFO] Running stage '{}': {}".format(name, command))
+    result = run_task(Task(name, command="({}) > {} 2>&1".format(command, log)))
+    if result["returncode"] != 0:
+        print("[ERROR] Stage '{}' failed with return code {}, see {}".format(name, result["returncode"], log))
+    else:
+        print("[INFO] Stage '{}' finished in {:.1f} s".format(name, result["wall_time"]))
+    return {
+        "command" : command,
+        "returncode" : result["returncode"],
+        "wall_time" : result["wall_time"],
+        "max_rss_mb" : result["max_rss_mb"],
+        "log" : log,
+    }
+
+
+def mass_points(n):
+    # n points spread evenly over the list of templated masses, always including both ends
+    if n >= len(MASS_POINTS):
+        return list(MASS_POINTS)
+    n = max(n, 2)
+    return [MASS_POINTS[int(round(i * (len(MASS_POINTS) - 1) / float(n - 1)))] for i in range(n)]
+
+
+def morphing_arguments(args):
+    masses = " ".join(mass_points(args.mass_points))
+    return "--base-path={SHAPES} --auto_rebin=0 --manual_rebin=0 --real_data=0 --no_shape_systs={NOSHAPE}" \
+           " --mass-susy-ggH {MASSES} --mass-susy-qqH {MASSES}".format(
+               SHAPES=os.path.join(args.workdir, "shapes"), NOSHAPE=int(args.no_shape_systematics), MASSES=masses)
+
+
+def morphing_options(args):
+    return "--analysis={ANALYSIS} --sub-analysis={SUB_ANALYSIS} --hSM-treatment={HSM_TREATMENT}" \
+           " --categorization={CATEGORIZATION} --sm-like-hists={SM_LIKE_HISTS} --variable={VARIABLE}".format(
+               ANALYSIS=args.analysis, SUB_ANALYSIS=args.sub_analysis, HSM_TREATMENT=args.hSM_treatment,
+               CATEGORIZATION=args.categorization, SM_LIKE_HISTS=args.sm_like_hists, VARIABLE=args.variable)
+
+
+def read_templates(filename):
+    # Lines of '<input file>\t<bin>/<template>', as written by MorphingMSSMvsSM --list-templates
+    templates = []
+    with open(filename, "r") as f:
+        for line in f:
+            if line.strip():
+                input_file, path = line.rstrip("\n").split("\t")
+                templates.append((input_file, path))
+    return templates
+
+
+def template_shape(name, centers, rng):
+    # Falling spectrum for backgrounds, a peak at the mass for templates with a mass in their name
+    mass = re.search(r"(\d+)$", name)
+    if mass and float(mass.group(1)) > 50.:
+        m = float(mass.group(1))
+        return [math.exp(-0.5 * ((x - m) / (0.15 * m))**2) for x in centers]
+    slope = 150. + 350. * rng.random()
+    return [math.exp(-x / slope) for x in centers]
+
+
+def write_synthetic_shapes(templates, args):
+    import ROOT
+    ROOT.PyConfig.IgnoreCommandLineOptions = True
+    ROOT.gROOT.SetBatch(True)
+    rng = random.Random(args.seed)
+    width = (X_RANGE[1] - X_RANGE[0]) / args.bins
+    centers = [X_RANGE[0] + (i + 0.5) * width for i in range(args.bins)]
+    by_file = {}
+    systematics = set()
+    for input_file, path in templates:
+        by_file.setdefault(input_file, []).append(path)
+    for input_file, paths in sorted(by_file.items()):
+        if not os.path.exists(os.path.dirname(input_file)):
+            os.makedirs(os.path.dirname(input_file))
+        out = ROOT.TFile(input_file, "RECREATE")
+        nominal_values = {}
+        ordered = sorted(paths, key=lambda p: (p.endswith("Up") or p.endswith("Down"), p))
+        for path in ordered:
+            directory, name = path.split("/", 1)
+            if not out.GetDirectory(directory):
+                out.mkdir(directory)
+            out.cd(directory)
+            nominal = None
+            if name.endswith("Up") or name.endswith("Down"):
+                candidates = [n for n in nominal_values.get(directory, {}) if name.startswith(n + "_")]
+                nominal = nominal_values[directory][max(candidates, key=len)] if candidates else None
+            if nominal is not None:
+                systematics.add(re.sub(r"(Up|Down)$", "", name[len(max(candidates, key=len)) + 1:]))
+                sign = 1. if name.endswith("Up") else -1.
+                tilt = 0.02 + 0.08 * rng.random()
+                norm = 0.03 * (2 * rng.random() - 1)
+                values = [v * max(0.05, 1. + sign * (norm + tilt * (2. * i / max(1, args.bins - 1) - 1.))) for i, v in enumerate(nominal)]
+            else:
+                scale = 10**(1 + 3 * rng.random())
+                # small floor, such that no bin of the synthetic templates is empty
+                values = [scale * (v + 1e-3) for v in template_shape(name, centers, rng)]
+                if name == "data_obs":
+                    values = [float(int(v)) for v in values]
+                nominal_values.setdefault(directory, {})[name] = values
+            hist = ROOT.TH1D(name, name, args.bins, X_RANGE[0], X_RANGE[1])
+            hist.Sumw2()
+            for i, value in enumerate(values):
+                hist.SetBinContent(i + 1, value)
+                hist.SetBinError(i + 1, math.sqrt(0.1 * value))
+            hist.Write()
+            hist.SetDirectory(0)
+        out.Close()
+        print("[INFO] Written {} synthetic templates to {}".format(len(paths), input_file))
+    return len(systematics)
+
+
+def generate(args, results):
+    results["sizes"]["templates"] = 0
+    selected = []
+    templates = []
+    for channel in args.channels.split(","):
+        # SM categories need their own runs, the groups of categories are given by MorphingMSSMvsSM
+        listing = os.path.join(args.workdir, "categories_{}.txt".format(channel))
+        command = "MorphingMSSMvsSM --era={ERA} {OPTIONS} --category={CHANNEL}_all --output_folder={OUTPUT} --list-categories={LISTING}".format(
+            ERA=args.era, OPTIONS=morphing_options(args), CHANNEL=channel, OUTPUT=os.path.join(args.workdir, "listing"), LISTING=listing)
+        results["stages"]["list_categories_{}".format(channel)] = timed("list_categories_{}".format(channel), command, args.workdir)
+        with open(listing, "r") as f:
+            groups = [l.strip() for l in f if l.strip()]
+        channel_templates = []
+        for i, group in enumerate(groups):
+            listing = os.path.join(args.workdir, "templates_{}_{}.txt".format(channel, i))
+            command = "MorphingMSSMvsSM --era={ERA} {OPTIONS} --category={GROUP} --output_folder={OUTPUT}" \
+                      " --sm_gg_fractions={PACKAGE}/data/higgs_pt_reweighting_fullRun2.root {ARGS} --list-templates={LISTING}".format(
+                          ERA=args.era, OPTIONS=morphing_options(args), GROUP=group, OUTPUT=os.path.join(args.workdir, "listing"),
+                          PACKAGE=PACKAGE, ARGS=morphing_arguments(args), LISTING=listing)
+            name = "list_templates_{}_{}".format(channel, i)
+            results["stages"][name] = timed(name, command, args.workdir)
+            channel_templates += read_templates(listing)
+        categories = []
+        for _, path in channel_templates:
+            category = path.split("/")[0]
+            if category not in categories:
+                categories.append(category)
+        if args.categories > 0:
+            categories = categories[:args.categories]
+        selected += categories
+        templates += [(f, p) for f, p in channel_templates if p.split("/")[0] in categories]
+    with open(os.path.join(args.workdir, "categories.txt"), "w") as f:
+        f.write("\n".join(selected) + "\n")
+    start = time.time()
+    n_systematics = write_synthetic_shapes(templates, args)
+    results["stages"]["generate"] = {"returncode" : 0, "wall_time" : time.time() - start}
+    results["sizes"]["templates"] = len(templates)
+    results["sizes"]["categories"] = len(selected)
+    results["sizes"]["shape_systematics"] = n_systematics
+    results["sizes"]["input_bytes"] = sum(os.path.getsize(f) for f in set(f for f, _ in templates))
+
+
+def morphing(args, results):
+    output = os.path.join(args.workdir, "datacards")
+    command = "morph_parallel.py --output-folder {OUTPUT} {OPTIONS} --eras {ERA} --category-list {CATEGORIES}" \
+              " --sm-gg-fractions {PACKAGE}/data/higgs_pt_reweighting_fullRun2.root --parallel {PARALLEL} {GROUP}" \
+              " --additional-arguments=\"{ARGS}\"".format(
+                  OUTPUT=output, ERA=args.era, CATEGORIES=os.path.join(args.workdir, "categories.txt"), PACKAGE=PACKAGE,
+                  PARALLEL=args.parallel, GROUP="" if args.no_group_categories else "--group-categories",
+                  ARGS=morphing_arguments(args), OPTIONS=morphing_options(args))
+    results["stages"]["morphing"] = timed("morphing", command, args.workdir)
+
+    # Collect the datacards of all categories in one directory, as done in the run_*.sh scripts
+    combined = os.path.join(args.workdir, "combined", "cmb")
+    if os.path.exists(combined):
+        shutil.rmtree(combined)
+    os.makedirs(os.path.join(combined, "common"))
+    for directory in glob.glob(os.path.join("{}_{}".format(output, args.analysis), args.era, "htt_*")):
+        for card in glob.glob(os.path.join(directory, "*.txt")):
+            shutil.copy(card, combined)
+        for shapes in glob.glob(os.path.join(directory, "common", "*.root")):
+            shutil.copy(shapes, os.path.join(combined, "common"))
+    results["sizes"]["datacards"] = len(glob.glob(os.path.join(combined, "*.txt")))
+
+
+def physics_options(model, args):
+    masses = [float(m) for m in mass_points(args.mass_points)]
+    return " ".join(PHYSICS_MODELS[model]).format(
+        PACKAGE=PACKAGE, HSM_TREATMENT=args.hSM_treatment, MODEL_FILE=args.model_file, THDM_MODEL_FILE=args.thdm_model_file,
+        MIN_MASS=int(min(masses)), MAX_MASS=int(max(masses)))
+
+
+def t2w(args, results, model):
+    combined = os.path.join(args.workdir, "combined", "cmb")
+    command = "combineTool.py -M T2W -o ws_{MODEL}.root {OPTIONS} -i {CARDS}/".format(
+        MODEL=model, OPTIONS=physics_options(model, args), CARDS=combined)
+    results["stages"]["t2w_{}".format(model)] = timed("t2w_{}".format(model), command, args.workdir)
+    workspace = os.path.join(combined, "ws_{}.root".format(model))
+    if os.path.exists(workspace):
+        results["sizes"]["workspace_bytes_{}".format(model)] = os.path.getsize(workspace)
+
+
+def asymptotic(args, results, model):
+    if model not in MODEL_POINTS:
+        print("[WARNING] No AsymptoticGrid point defined for {}, skipped".format(model))
+        return
+    rundir = os.path.join(args.workdir, "asymptotic_{}".format(model))
+    if os.path.exists(rundir):
+        shutil.rmtree(rundir)
+    os.makedirs(rundir)
+    x, y = args.point.split(",")
+    with open(os.path.join(rundir, "grid.json"), "w") as f:
+        json.dump({"opts" : "--singlePoint 1.0", "POIs" : list(MODEL_POINTS[model]), "grids" : [[x, y, ""]]}, f, indent=2)
+    command = "combineTool.py -M AsymptoticGrid grid.json -d {WORKSPACE} {OPTIONS}".format(
+        WORKSPACE=os.path.join(args.workdir, "combined", "cmb", "ws_{}.root".format(model)), OPTIONS=ASYMPTOTIC_OPTIONS)
+    results["stages"]["asymptotic_{}".format(model)] = timed("asymptotic_{}".format(model), command, args.workdir, cwd=rundir)
+
+
+def postfit(args, results, model):
+    combined = os.path.join(args.workdir, "combined", "cmb")
+    freeze = ""
+    if model in MODEL_POINTS:
+        x, y = args.point.split(",")
+        freeze = "--freeze {X}={XVAL},{Y}={YVAL}".format(X=MODEL_POINTS[model][0], XVAL=x, Y=MODEL_POINTS[model][1], YVAL=y)
+    command = "PostFitShapesFromWorkspace -w {WORKSPACE} -o {OUTPUT} -d {CARD} {FREEZE}".format(
+        WORKSPACE=os.path.join(combined, "ws_{}.root".format(model)), OUTPUT=os.path.join(args.workdir, "prefit_shapes_{}.root".format(model)),
+        CARD=os.path.join(combined, "combined.txt.cmb"), FREEZE=freeze)
+    results["stages"]["postfit_{}".format(model)] = timed("postfit_{}".format(model), command, args.workdir)
+
+
+def compare(reference_file, result_file, tolerance):
+    with open(reference_file, "r") as f:
+        reference = json.load(f)
+    with open(result_file, "r") as f:
+        result = json.load(f)
+    if reference.get("config") != result.get("config") or reference.get("sizes") != result.get("sizes"):
+        print("[WARNING] The benchmarks were run with different configurations or input sizes")
+    print("{:<30} {:>12} {:>12} {:>8} {:>12} {:>12}".format("stage", "ref. time/s", "time/s", "ratio", "ref. MB", "MB"))
+    regressions = []
+    for stage in sorted(set(reference["stages"]) | set(result["stages"])):
+        ref, new = reference["stages"].get(stage), result["stages"].get(stage)
+        if ref is None or new is None:
+            print("{:<30} only in {}".format(stage, reference_file if new is None else result_file))
+            continue
+        if ref["returncode"] != 0 or new["returncode"] != 0:
+            print("{:<30} failed in {}".format(stage, reference_file if ref["returncode"] != 0 else result_file))
+            continue
+        ratio = new["wall_time"] / ref["wall_time"] if ref["wall_time"] > 0 else float("nan")
+        print("{:<30} {:>12.1f} {:>12.1f} {:>8.2f} {:>12.0f} {:>12.0f}{}".format(
+            stage, ref["wall_time"], new["wall_time"], ratio, ref.get("max_rss_mb", 0), new.get("max_rss_mb", 0),
+            "  <-- regression" if ratio > 1 + tolerance else ""))
+        if ratio > 1 + tolerance:
+            regressions.append(stage)
+    print("Commits: {} -> {}".format(reference.get("commit"), result.get("commit")))
+    if regressions:
+        print("[ERROR] Wall time increased by more than {:.0f}% for: {}".format(100 * tolerance, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+def main():
+    args = parse_arguments()
+    if args.compare:
+        return compare(args.compare[0], args.compare[1], args.tolerance)
+
+    args.workdir = os.path.abspath(args.workdir)
+    if not os.path.exists(os.path.join(args.workdir, "logs")):
+        os.makedirs(os.path.join(args.workdir, "logs"))
+    stages = args.stages.split(",")
+    models = args.models.split(",")
+    for model in models:
+        if model not in PHYSICS_MODELS:
+            raise ValueError("Unknown physics model {}, please choose from {}".format(model, ", ".join(sorted(PHYSICS_MODELS))))
+
+    commit, dirty = git_commit()
+    config = dict((k, v) for k, v in vars(args).items() if k not in ["workdir", "output", "stages", "compare", "tolerance"])
+    results = {
+        "commit" : commit,
+        "dirty" : dirty,
+        "host" : platform.node(),
+        "date" : time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config" : config,
+        "sizes" : {"bins" : args.bins, "mass_points" : len(mass_points(args.mass_points))},
+        "stages" : {},
+    }
+    if "generate" in stages:
+        generate(args, results)
+    if "morphing" in stages:
+        morphing(args, results)
+    for model in models:
+        if "t2w" in stages:
+            t2w(args, results, model)
+        if "asymptotic" in stages:
+            asymptotic(args, results, model)
+        if "postfit" in stages:
+            postfit(args, results, model)
+
+    output = args.output or os.path.join(args.workdir, "benchmark_{}.json".format(commit[:10]))
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("[INFO] Benchmark results written to {}".format(output))
+    return 1 if any(stage["returncode"] != 0 for stage in results["stages"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,18 @@
 #!/usr/bin/env python
 
 import argparse
+import copy
+import glob
 import itertools
+import json
 import operator
 import logging
+import os
+import re
+import sys
 from array import array
 
+import numpy as np
 import pandas as pd
 
 import ROOT
@@ -13,6 +20,7 @@ ROOT.gROOT.SetBatch()
 ROOT.PyConfig.IgnoreCommandLineOptions = True
 
 import CombineHarvester.CombineTools.plotting as plot
+from CombineHarvester.MSSMvsSMRun2Legacy.local_executor import Task, run_tasks
 
 
 logger = logging.getLogger("")
@@ -21,7 +29,7 @@ logger = logging.getLogger("")
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("files",
-                        nargs="+",
+                        nargs="*",
                         help="Input files")
     parser.add_argument("--output", "-o",
                         default="limit",
@@ -36,7 +44,29 @@ def parse_args():
                         type=int,
                         default=1000,
                         help="Maximum value of deltaNLL when reading the input tree")
-    return parser.parse_args()
+    parser.add_argument("--streaming",
+                        action="store_true",
+                        help="Read the scan file by file into column arrays and process them vectorized. "
+                             "Missing points are interpolated linearly with scipy instead of TGraph2D::Interpolate.")
+    parser.add_argument("--batch-pattern",
+                        default=None,
+                        help="Glob pattern of the input files with a {MASS} placeholder, e.g. 'scans/higgsCombine*.mH{MASS}.root'. "
+                             "Processes all masses in one go and writes one database per mass. "
+                             "The output name should contain the {MASS} placeholder as well, otherwise '_mH{MASS}' is appended to it.")
+    parser.add_argument("--masses",
+                        default=None,
+                        help="Comma separated list of masses to be processed in batch mode. By default all masses matching the batch pattern")
+    parser.add_argument("--parallel",
+                        type=int,
+                        default=1,
+                        help="Number of masses processed in parallel in batch mode")
+    parser.add_argument("--index",
+                        default=None,
+                        help="JSON index of the databases written in batch mode. By default placed next to the outputs")
+    args = parser.parse_args()
+    if not args.files and not args.batch_pattern:
+        parser.error("Either input files or --batch-pattern are required")
+    return args
 
 
 def setup_logging(level=logging.INFO):
@@ -165,6 +195,134 @@ def convert_dataframe_to_tree(df, best_fit, offset=0.):
     return tree
 
 
+def buffer_to_array(buf, n):
+    # Copy of a ROOT array buffer, e.g. from TTree::GetV1
+    if hasattr(buf, "reshape"):
+        buf.reshape((n,))
+    else:
+        buf.SetSize(n)
+    return np.frombuffer(buf, dtype=np.float64, count=n).copy()
+
+
+def read_scan_columns(files):
+    # Read the scan file by file, each as one batch of column arrays
+    columns = [args.x_var, args.y_var, "deltaNLL", "quantileExpected"]
+    batches = []
+    for filename in files:
+        f = ROOT.TFile.Open(filename, "read")
+        tree = f.Get("limit") if f and not f.IsZombie() else None
+        if not tree:
+            logger.warning("No limit tree found in %s, skipping it", filename)
+            continue
+        tree.SetEstimate(tree.GetEntries() + 1)
+        n = tree.Draw(":".join(columns), "", "goff")
+        if n > 0:
+            buffers = [tree.GetV1(), tree.GetV2(), tree.GetV3(), tree.GetV4()]
+            batches.append([buffer_to_array(b, n) for b in buffers])
+        f.Close()
+    logger.info("Read %d entries from %d files", sum(len(b[0]) for b in batches), len(batches))
+    return [np.concatenate([b[i] for b in batches]) for i in range(len(columns))]
+
+
+def rezero_arrays(z):
+    # Array version of rezero_tgraph2d: the minimum is shifted to zero if it is below the fit minimum
+    min_z = min(0., z.min()) if len(z) else 0.
+    if min_z < 0.:
+        logging.info('[ReZeroTGraph] Better minimum was %f' % min_z)
+        z = z - min_z
+    return z, min_z
+
+
+def fill_missing_points(x, y, z):
+    # Grid points not contained in the scan, ignoring the upper edges as in convert_graph_to_dataframe
+    from scipy.interpolate import griddata
+    x_vals, x_index = np.unique(x, return_inverse=True)
+    y_vals, y_index = np.unique(y, return_inverse=True)
+    scanned = np.zeros((len(x_vals), len(y_vals)), dtype=bool)
+    scanned[x_index, y_index] = True
+    missing_x, missing_y = np.nonzero(~scanned[:-1, :-1])
+    logger.info("Found {} missing entries in scan".format(len(missing_x)))
+    if len(missing_x) == 0:
+        return x, y, z
+    logger.info("Will set their values to the interpolated ones...")
+    points = np.stack([x, y], axis=1)
+    missing = np.stack([x_vals[missing_x], y_vals[missing_y]], axis=1)
+    # Linear interpolation on the Delaunay triangulation in normalised coordinates, as done by TGraph2D.
+    # Where it fails, the nearest scanned point is used instead.
+    interpolated = griddata(points, z, missing, method="linear", rescale=True)
+    failed = ~(interpolated > 0)
+    if failed.any():
+        interpolated[failed] = griddata(points, z, missing[failed], method="nearest", rescale=True)
+    return np.concatenate([x, missing[:, 0]]), np.concatenate([y, missing[:, 1]]), np.concatenate([z, interpolated])
+
+
+FILL_TREE_CODE = """
+void FillLikelihoodTreeFromArrays(TTree* tree, Long64_t n, const float* x, const float* y, const float* nll, const float* quantile,
+                                  const char* x_name, const char* y_name) {
+    float vx, vy, vnll, vquantile;
+    tree->SetBranchAddress(x_name, &vx);
+    tree->SetBranchAddress(y_name, &vy);
+    tree->SetBranchAddress("deltaNLL", &vnll);
+    tree->SetBranchAddress("quantileExpected", &vquantile);
+    for (Long64_t i = 0; i < n; ++i) {
+        vx = x[i]; vy = y[i]; vnll = nll[i]; vquantile = quantile[i];
+        tree->Fill();
+    }
+    tree->ResetBranchAddresses();
+}
+"""
+
+
+def convert_arrays_to_tree(x, y, z, best_fit, offset=0.):
+    # Same structure as convert_dataframe_to_tree, the scan points are filled by a compiled loop
+    tree = ROOT.TTree("limit", "limit")
+    ggh = array("f", [0.])
+    tree.Branch(args.x_var, ggh, "%s/F" % args.x_var)
+    bbh = array("f", [0.])
+    tree.Branch(args.y_var, bbh, "%s/F" % args.y_var)
+    deltaNLL = array("f", [0.])
+    tree.Branch("deltaNLL", deltaNLL, "deltaNLL/F")
+    quantileExp = array("f", [0.])
+    tree.Branch("quantileExpected", quantileExp, "quantileExpected/F")
+    ggh[0] = best_fit[0]
+    bbh[0] = best_fit[1]
+    deltaNLL[0] = 0. - offset
+    quantileExp[0] = -1
+    tree.Fill()
+    if not hasattr(ROOT, "FillLikelihoodTreeFromArrays"):
+        ROOT.gInterpreter.Declare(FILL_TREE_CODE)
+    # chisquared_cdf_c(2 * deltaNLL, 2) = exp(-deltaNLL)
+    columns = [np.ascontiguousarray(c, dtype=np.float32) for c in (x, y, z, np.exp(-z))]
+    ROOT.FillLikelihoodTreeFromArrays(tree, len(x), columns[0], columns[1], columns[2], columns[3], args.x_var, args.y_var)
+    return tree
+
+
+def main_streaming(args):
+    x, y, z, quantile = read_scan_columns(args.files)
+    best = np.nonzero(z == 0.)[0]
+    if len(best) == 0:
+        raise RuntimeError("No best fit point with deltaNLL == 0 found in the input files")
+    best_fit = (x[best[0]], y[best[0]])
+
+    selected = (quantile > -0.5) & (z < args.max_value)
+    x, y, z = x[selected], y[selected], z[selected]
+    z, min_delta_nll = rezero_arrays(z)
+    x, y, z = fill_missing_points(x, y, z)
+    order = np.lexsort((y, x))
+    x, y, z = x[order], y[order], z[order]
+
+    df = pd.DataFrame({args.x_var: x, args.y_var: y, "deltaNLL": z})
+    df.to_csv(args.output, sep=" ",
+              float_format="%.6f",
+              header=False, index=False,
+              na_rep="NaN",
+              columns=[args.x_var, args.y_var, "deltaNLL"])
+    outfile = ROOT.TFile(args.output.replace(".txt", ".root"), "recreate")
+    tree = convert_arrays_to_tree(x, y, z, best_fit, offset=min_delta_nll)
+    outfile.Write()
+    return
+
+
 def main(args):
     # Get tree with scan values from all input files
     limit = plot.MakeTChain(args.files, 'limit')
@@ -195,7 +353,59 @@ def main(args):
     return
 
 
+def find_masses(pattern):
+    # Masses for which input files matching the pattern exist
+    regex = re.compile(re.escape(pattern).replace(re.escape("{MASS}"), r"(?P<mass>[0-9.]+)").replace(r"\*", ".*").replace(r"\?", ".") + "$")
+    masses = set()
+    for filename in glob.glob(pattern.replace("{MASS}", "*")):
+        match = regex.match(filename)
+        if match:
+            masses.add(match.group("mass"))
+    return sorted(masses, key=float)
+
+
+def process_mass(mass_args):
+    if mass_args.streaming:
+        main_streaming(mass_args)
+    else:
+        main(mass_args)
+    return 0
+
+
+def main_batch(args):
+    masses = args.masses.split(",") if args.masses else find_masses(args.batch_pattern)
+    output = args.output if "{MASS}" in args.output else "{}_mH{{MASS}}{}".format(*os.path.splitext(args.output))
+    tasks = []
+    index = []
+    for mass in masses:
+        mass_args = copy.copy(args)
+        mass_args.files = sorted(glob.glob(args.batch_pattern.replace("{MASS}", mass)))
+        mass_args.output = output.replace("{MASS}", mass)
+        if not mass_args.files:
+            logger.warning("No input files found for mass %s, skipping it", mass)
+            continue
+        tasks.append(Task(mass, function=process_mass, args=(mass_args,), cost=len(mass_args.files)))
+        index.append({"mass": float(mass), "files": len(mass_args.files),
+                      "database": mass_args.output, "tree": mass_args.output.replace(".txt", ".root")})
+    logger.info("Processing %d masses with %d workers", len(tasks), args.parallel)
+    failures = run_tasks(tasks, parallel=args.parallel)
+    failed = set(f["name"] for f in failures)
+    for entry, task in zip(index, tasks):
+        entry["status"] = "failed" if task.name in failed else "done"
+
+    index_file = args.index or os.path.join(os.path.dirname(output) or ".", "likelihood_database_index.json")
+    with open(index_file, "w") as f:
+        json.dump({"x_var": args.x_var, "y_var": args.y_var, "databases": index}, f, indent=2)
+    logger.info("Index of the likelihood databases written to %s", index_file)
+    return 1 if failures else 0
+
+
 if __name__ == "__main__":
     args = parse_args()
     setup_logging(level=logging.INFO)
-    main(args)
+    if args.batch_pattern:
+        sys.exit(main_batch(args))
+    elif args.streaming:
+        main_streaming(args)
+    else:
+        main(args)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Run a command of the run_*.sh pipelines and append its resource usage to a run log.
+
+Each call appends one JSON line with wall time, user and system CPU time, peak resident
+memory, return code and the sizes of the given outputs before and after the command.
+CPU times include all child processes of the command; the peak memory is the one of the
+largest single process, not the sum over parallel processes.
+
+    instrument_stage.py --log analysis/cmb/logs/run_log.jsonl --mode ws --step T2W \\
+        --outputs analysis/cmb/datacards_bsm-model-indep/combined/cmb/ws.root -- combineTool.py -M T2W ...
+    instrument_stage.py --report analysis/cmb/logs/run_log.jsonl
+"""
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import json
+import time
+import socket
+import signal
+import argparse
+import datetime
+import subprocess
+
+
+def output_size(pattern):
+    # Number of files and bytes below all paths matching the pattern
+    files, size = 0, 0
+    for path in glob.glob(pattern):
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in names:
+                    full = os.path.join(root, name)
+                    if os.path.isfile(full):
+                        files += 1
+                        size += os.path.getsize(full)
+        elif os.path.isfile(path):
+            files += 1
+            size += os.path.getsize(path)
+    return files, size
+
+
+def run(args):
+    outputs_before = dict((pattern, output_size(pattern)) for pattern in args.outputs)
+    date = datetime.datetime.now().isoformat()
+    start = time.time()
+    process = subprocess.Popen(args.command)
+    # The command handles Ctrl-C on its own, the record is written anyway
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.time() - start
+    returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    outputs = []
+    for pattern in args.outputs:
+        files, size = output_size(pattern)
+        outputs.append({
+            "path" : pattern,
+            "files" : files,
+            "bytes" : size,
+            "delta_bytes" : size - outputs_before[pattern][1],
+        })
+    record = {
+        "date" : date,
+        "host" : socket.gethostname(),
+        "script" : args.script,
+        "mode" : args.mode,
+        "step" : args.step,
+        "cwd" : os.getcwd(),
+        "command" : " ".join(args.command),
+        "returncode" : returncode,
+        "wall_time" : wall_time,
+        "cpu_user" : usage.ru_utime,
+        "cpu_system" : usage.ru_stime,
+        "max_rss_mb" : usage.ru_maxrss / 1024.,
+        "outputs" : outputs,
+    }
+    if not os.path.exists(os.path.dirname(os.path.abspath(args.log))):
+        os.makedirs(os.path.dirname(os.path.abspath(args.log)))
+    # a single write per record, such that parallel calls do not interleave within a line
+    with open(args.log, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+    return returncode
+
+
+def report(log):
+    with open(log, "r") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    row = "{:<20} {:<28} {:<28} {:>10} {:>10} {:>10} {:>12} {:>4}"
+    print(row.format("date", "mode", "step", "wall [s]", "cpu [s]", "rss [MB]", "output [MB]", "rc"))
+    for record in records:
+        print(row.format(record["date"][:19], record["mode"], record["step"] or "-",
+                         "%.1f" % record["wall_time"], "%.1f" % (record["cpu_user"] + record["cpu_system"]),
+                         "%.0f" % record["max_rss_mb"], "%.1f" % (sum(o["bytes"] for o in record["outputs"]) / 1024.**2),
+                         record["returncode"]))
+
+
+def main(argv):
+    if "--" in argv:
+        command = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    else:
+        command = []
+    parser = argparse.ArgumentParser(description="Run a command and append wall time, CPU time, peak memory and output sizes to a run log. The command follows after '--'.")
+    parser.add_argument("--log", help="JSON lines file the record is appended to, usually <analysis directory>/logs/run_log.jsonl")
+    parser.add_argument("--script", default=None, help="Name of the calling pipeline script")
+    parser.add_argument("--mode", default=None, help="Mode of the pipeline script")
+    parser.add_argument("--step", default=None, help="Name of the sub-command within the mode. Not set for the mode as a whole")
+    parser.add_argument("--outputs", nargs="*", default=[], help="Output files or directories, glob patterns allowed, whose sizes are recorded")
+    parser.add_argument("--report", default=None, help="Print the records of the given run log instead of running a command")
+    args = parser.parse_args(argv)
+    args.command = command
+
+    if args.report:
+        report(args.report)
+        return 0
+    if not args.log or not args.command:
+        parser.error("--log and a command after '--' are required")
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+# Mapping of quantileExpected values in the combine output to the names of the CLs graphs in asymptotic_grid.root
+LEVELS = [
+    ("exp-2", 0.025),
+    ("exp-1", 0.16),
+    ("exp0", 0.5),
+    ("exp+1", 0.84),
+    ("exp+2", 0.975),
+    ("obs", -1.0),
+]
+
+# Methods of which the outputs are ingested, with one file per grid point
+INGESTED_METHODS = ["AsymptoticLimits"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    entries INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    model TEXT,
+    method TEXT,
+    x REAL,
+    y REAL,
+    quantile REAL,
+    cls REAL,
+    path TEXT,
+    PRIMARY KEY (model, method, x, y, quantile)
+);
+CREATE INDEX IF NOT EXISTS results_by_quantile ON results (model, method, quantile);
+CREATE TABLE IF NOT EXISTS timings (
+    model TEXT,
+    method TEXT,
+    x REAL,
+    y REAL,
+    t_real REAL,
+    PRIMARY KEY (model, method, x, y)
+);
+"""
+
+
+def open_database(path):
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def parse_point(filename, pois):
+    # Point of the grid from the output file name, e.g. higgsCombine.mA.130.tanb.1.5.AsymptoticLimits.mH120.root
+    match = re.search(r"{X}[._](?P<x>-?[0-9.]+?)[._]{Y}[._](?P<y>-?[0-9.]+?)\.(?P<method>[A-Za-z]+)\.".format(
+        X=re.escape(pois[0]), Y=re.escape(pois[1])), os.path.basename(filename))
+    if not match:
+        return None
+    return float(match.group("x")), float(match.group("y")), match.group("method")
+
+
+def read_output(info):
+    # Read all rows of the limit tree of a single job output. Returns (path, rows, error).
+    path, pois = info
+    import ROOT
+    ROOT.gROOT.SetBatch()
+    point = parse_point(path, pois)
+    f = ROOT.TFile.Open(path, "read")
+    if not f or f.IsZombie():
+        return path, [], "cannot open file"
+    tree = f.Get("limit")
+    if not tree:
+        f.Close()
+        return path, [], "no limit tree"
+    tracked = ["trackedParam_%s" % poi for poi in pois]
+    has_tracked = all(tree.GetBranch(branch) for branch in tracked)
+    has_time = bool(tree.GetBranch("t_real"))
+    if not has_tracked and point is None:
+        f.Close()
+        return path, [], "cannot determine grid point"
+    method = point[2] if point else ""
+    rows = []
+    for entry in tree:
+        if has_tracked:
+            x, y = getattr(entry, tracked[0]), getattr(entry, tracked[1])
+        else:
+            x, y = point[0], point[1]
+        t_real = float(entry.t_real) if has_time else -1.0
+        rows.append((method, float(x), float(y), round(float(entry.quantileExpected), 4), float(entry.limit), t_real))
+    f.Close()
+    return path, rows, None
+
+
+def ingest(args):
+    connection = open_database(args.database)
+    known = dict((path, (size, mtime)) for path, size, mtime in connection.execute("SELECT path, size, mtime FROM files"))
+
+    pois = args.pois.split(",")
+    files = sorted(set(f for pattern in args.inputs for f in glob.glob(pattern)))
+    new_files = []
+    other_methods = []
+    for path in files:
+        path = os.path.abspath(path)
+        # Results are keyed by grid point and quantile. The toys of a HybridNew point are spread over several
+        # files and can't be stored this way, therefore only AsymptoticLimits outputs are ingested.
+        point = parse_point(path, pois)
+        if point and point[2] not in INGESTED_METHODS:
+            other_methods.append(path)
+            continue
+        stat = os.stat(path)
+        if known.get(path) == (stat.st_size, stat.st_mtime):
+            continue
+        new_files.append(path)
+    print("Found {NFILES} output files, {NNEW} of them new or modified since the last collection".format(NFILES=len(files), NNEW=len(new_files)))
+    if other_methods:
+        print("[WARNING] Skipped {NFILES} outputs of methods other than {METHODS}, e.g. {PATH}".format(
+            NFILES=len(other_methods), METHODS=", ".join(INGESTED_METHODS), PATH=other_methods[0]))
+
+    infos = [(path, pois) for path in new_files]
+    if args.parallel > 1:
+        pool = Pool(args.parallel)
+        outputs = pool.imap_unordered(read_output, infos, chunksize=16)
+    else:
+        outputs = (read_output(info) for info in infos)
+
+    n_rows = 0
+    failures = []
+    for path, rows, error in outputs:
+        if error:
+            failures.append((path, error))
+            continue
+        stat = os.stat(path)
+        connection.executemany(
+            "INSERT OR REPLACE INTO results (model, method, x, y, quantile, cls, path) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(args.model, method, x, y, quantile, cls, path) for method, x, y, quantile, cls, _ in rows])
+        # Fit time per grid point, the longest entry of the point being representative
+        timings = {}
+        for method, x, y, _, _, t_real in rows:
+            if t_real >= 0:
+                timings[(method, x, y)] = max(t_real, timings.get((method, x, y), 0.))
+        connection.executemany(
+            "INSERT OR REPLACE INTO timings (model, method, x, y, t_real) VALUES (?, ?, ?, ?, ?)",
+            [(args.model, method, x, y, t_real) for (method, x, y), t_real in timings.items()])
+        connection.execute("INSERT OR REPLACE INTO files (path, size, mtime, entries) VALUES (?, ?, ?, ?)",
+                           (path, stat.st_size, stat.st_mtime, len(rows)))
+        n_rows += len(rows)
+    connection.commit()
+    if args.parallel > 1:
+        pool.close()
+        pool.join()
+
+    print("Ingested {NROWS} results into {DB}".format(NROWS=n_rows, DB=args.database))
+    for path, error in failures:
+        print("[WARNING] Skipped {PATH}: {ERROR}".format(PATH=path, ERROR=error))
+    return 1 if failures else 0
+
+
+def read_levels(database, model, method=None):
+    # CLs values per level as (x, y, CLs) NumPy arrays, e.g. to be used instead of the graphs in asymptotic_grid.root
+    connection = open_database(database)
+    levels = {}
+    for name, quantile in LEVELS:
+        query = "SELECT x, y, cls FROM results WHERE model = ? AND abs(quantile - ?) < 1e-3"
+        parameters = [model, quantile]
+        if method:
+            query += " AND method = ?"
+            parameters.append(method)
+        rows = connection.execute(query + " ORDER BY x, y", parameters).fetchall()
+        if rows:
+            values = np.array(rows, dtype=np.float64)
+            levels[name] = (values[:, 0], values[:, 1], values[:, 2])
+    connection.close()
+    return levels
+
+
+def read_timings(database, model, method=None):
+    # Recorded fit times as (x, y, t_real) NumPy arrays
+    connection = open_database(database)
+    query = "SELECT x, y, t_real FROM timings WHERE model = ?"
+    parameters = [model]
+    if method:
+        query += " AND method = ?"
+        parameters.append(method)
+    rows = connection.execute(query, parameters).fetchall()
+    connection.close()
+    values = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return values[:, 0], values[:, 1], values[:, 2]
+
+
+def export(args):
+    import ROOT
+    ROOT.gROOT.SetBatch()
+    levels = read_levels(args.database, args.model, args.method)
+    out = ROOT.TFile.Open(args.output, "recreate")
+    for name, (x, y, cls) in levels.items():
+        graph = ROOT.TGraph2D(name, name, len(x), x, y, cls)
+        graph.Write()
+        print("Level {LEVEL} with {NPOINTS} points".format(LEVEL=name, NPOINTS=len(x)))
+    out.Close()
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Indexed result store for AsymptoticGrid job outputs, keyed by (model, method, mass, tanb, quantile). "
+                    "Outputs of HybridNewGrid are not supported, as the toys of a point are spread over several files.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+
+    ingest_parser = subparsers.add_parser("ingest", help="Add new or modified higgsCombine*.root job outputs to the database")
+    ingest_parser.add_argument("inputs", nargs="+", help="glob patterns of the job outputs")
+    ingest_parser.add_argument("--database", required=True, help="SQLite database file, e.g. next to the workspace")
+    ingest_parser.add_argument("--model", required=True, help="Name of the benchmark scenario, e.g. mh125")
+    ingest_parser.add_argument("--pois", default="mA,tanb", help="Names of the grid parameters")
+    ingest_parser.add_argument("--parallel", type=int, default=1, help="Number of processes used to read the job outputs")
+
+    export_parser = subparsers.add_parser("export", help="Write the CLs graphs of a model in the format of asymptotic_grid.root")
+    export_parser.add_argument("--database", required=True, help="SQLite database file")
+    export_parser.add_argument("--model", required=True, help="Name of the benchmark scenario, e.g. mh125")
+    export_parser.add_argument("--method", default=None, help="Restrict to outputs of a given method, e.g. AsymptoticLimits")
+    export_parser.add_argument("--output", default="asymptotic_grid.root", help="Output ROOT file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "ingest":
+        return ingest(args)
+    elif args.command == "export":
+        return export(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,33 +1,34 @@
 #! /usr/bin/env python
 
 from argparse import ArgumentParser
-from multiprocessing import Pool
 import yaml
 import os
-import subprocess
-import shlex
-
-def execute_command(command):
-  print("Processing:",command)
-  returncode = subprocess.check_call(shlex.split(command), stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
-  return returncode
+from CombineHarvester.MSSMvsSMRun2Legacy.local_executor import Task, run_tasks, add_executor_arguments, exit_status
 
 parser = ArgumentParser(description="Script to create postfit shapes for HEP Data using PostFitShapesForHEPData")
 parser.add_argument("--analysis-configuration", required=True, help="Path to a .yaml file containing all information for an analysis.")
 parser.add_argument("--output-directory", required=True, help="Directory where to put the ROOT file outputs")
+parser.add_argument("--parallel", type=int, default=10, help="Cores provided for parallel processing")
+parser.add_argument("--batched", action="store_true", help="Write the variations of each process only for the parameters it depends on, see the --batched option of PostFitShapesForHEPData")
+parser.add_argument("--group-categories", action="store_true", help="Process all categories of a workspace within one PostFitShapesForHEPData call, such that the workspace and the fit result are loaded only once. The workspaces are processed in parallel")
+parser.add_argument("--cache-dir", default=None, help="Directory for snapshots of the workspaces reduced to the categories of each task. They are built with BuildWorkspaceCache once per workspace before the shapes are made, such that the full workspace is read only once per workspace")
+add_executor_arguments(parser)
 
 args = parser.parse_args()
 
 command_template = ("PostFitShapesForHEPData"
   " -w {WORKSPACE}"
-  " -d {RESTORE_BINNING_DATACARD}"
-  " -c {CATEGORY} -o {OUTPUTDIR}"
+  " {CATEGORIES} -o {OUTPUTDIR}"
   " -f {FITFILE} -F {FITNAME}"
   " {POI_CONFIG}"
   " -m {MASSNAME} {MASSES}"
 )
 
-commands = []
+tasks = []
+cache_tasks = []
+
+if not os.path.exists(args.output_directory):
+  os.makedirs(args.output_directory)
 
 analysis_configuration = yaml.load(open(args.analysis_configuration, "r"))
 
@@ -37,13 +38,19 @@ masses = " ".join(["-M {m}".format(m=m) for m in analysis_configuration["masses"
 for era in analysis_configuration["eras"]:
   for fs in analysis_configuration["final_states"]:
     workspace = analysis_configuration["{fs}_{era}_workspace".format(fs=fs, era=era)]
-    for c in analysis_configuration["{fs}_categories".format(fs=fs)]:
-      cname = "_".join(["htt",fs,str(c),str(era)])
-      restore_datacard = os.path.join(analysis_configuration["restore_directory"], cname+".txt")
-      commands.append(command_template.format(
+    cnames = ["_".join(["htt",fs,str(c),str(era)]) for c in analysis_configuration["{fs}_categories".format(fs=fs)]]
+    # Either one task per workspace with all its categories, or one task per category
+    groups = [("_".join([fs,str(era)]), cnames)] if args.group_categories else [(cname, [cname]) for cname in cnames]
+    if args.cache_dir:
+      snapshots = " ".join("-c {}".format(",".join(group)) for _, group in groups)
+      cache_name = "cache_{}_{}".format(fs, era)
+      cache_command = "BuildWorkspaceCache -w {} --cache-dir {} {} > {} 2>&1".format(workspace, args.cache_dir, snapshots, os.path.join(args.output_directory, cache_name+".log"))
+      cache_tasks.append(Task(cache_name, command=cache_command, cost=os.path.getsize(workspace) if os.path.exists(workspace) else 0))
+    for name, group in groups:
+      categories = " ".join("-d {} -c {}".format(os.path.join(analysis_configuration["restore_directory"], cname+".txt"), cname) for cname in group)
+      command = command_template.format(
           WORKSPACE=workspace,
-          RESTORE_BINNING_DATACARD=restore_datacard,
-          CATEGORY=cname,
+          CATEGORIES=categories,
           OUTPUTDIR=args.output_directory,
           FITFILE=analysis_configuration["fitfile"],
           FITNAME=analysis_configuration["fitname"],
@@ -51,8 +58,18 @@ for era in analysis_configuration["eras"]:
           MASSNAME=analysis_configuration["massname"],
           MASSES=masses
         )
-      )
+      if args.batched:
+        command += " --batched"
+      if args.cache_dir:
+        command += " --cache-dir {}".format(args.cache_dir)
+      # Output of each task written to its own log file instead of an unread pipe
+      log = os.path.join(args.output_directory, name+".log")
+      tasks.append(Task(name, command="{} > {} 2>&1".format(command, log), cost=len(group)*os.path.getsize(workspace) if os.path.exists(workspace) else 0))
 
-p = Pool(10)
-returncodes = p.map(execute_command, commands)
-print("Sum of returncodes:",sum(returncodes))
+failures = []
+if cache_tasks:
+  # The summary is kept for the shape tasks. Missing snapshots are built by the shape tasks themselves
+  failures += run_tasks(cache_tasks, parallel=args.parallel, retries=args.retries)
+failures += run_tasks(tasks, parallel=args.parallel, retries=args.retries, summary=args.summary)
+print("Sum of returncodes:",sum(f["returncode"] for f in failures))
+exit_status(failures)
@@ -3,16 +3,16 @@
 
 
 import os
+import re
 import sys
 import glob
+import json
+import hashlib
 import argparse
-from multiprocessing import Pool
-
-def execute(cmd):
-    try:
-        os.system(cmd)
-    except:
-        print "[WARNING] Command failed:",cmd
+import tempfile
+import subprocess
+from distutils.spawn import find_executable
+from CombineHarvester.MSSMvsSMRun2Legacy.local_executor import Task, run_tasks, add_executor_arguments, exit_status
 
 parser = argparse.ArgumentParser( description = "Compare Integrals of Processes between ML and Cutbased shapes")
 parser.add_argument('--output-folder', required = True, help = "Main folder, where the datacards should be created")
@@ -31,15 +31,130 @@ parser.add_argument('--sm-gg-fractions',
                     default = '${CMSSW_BASE}/src/CombineHarvester/MSSMvsSMRun2Legacy/data/higgs_pt_reweighting_fullRun2_v2.root',
                     help = "sm-gg-fractions file to use")
 parser.add_argument('--sm',action='store_true', help = "If set to true, sm categories are used")
+parser.add_argument('--incremental',action='store_true',
+                    help = "Skip era and category combinations, for which the Morphing command, the input shape files and the Morphing executable did not change since their last successful run")
+parser.add_argument('--group-categories',action='store_true',
+                    help = "Process all categories of a channel and era within a single Morphing command, such that the input shapes and ggH fractions are loaded only once. The channels and eras are still run in parallel")
+add_executor_arguments(parser)
 args = parser.parse_args()
 
+
+hashes = {}
+
+
+def file_hash(path, known):
+    # Content hash of a file, reused from the previous state as long as size and modification time are unchanged
+    stat = os.stat(path)
+    previous = known.get(path)
+    if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+        return previous
+    if path not in hashes:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 24), b""):
+                sha1.update(chunk)
+        hashes[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha1": sha1.hexdigest()}
+    return hashes[path]
+
+
+def morphing_inputs(era, category):
+    # Shape files read by MorphingMSSMvsSM for the channel of the category, the ggH fractions, the executable itself
+    # and the libraries it is linked against from this area
+    match = re.search(r"--base[-_]path[= ](\S+)", args.additional_arguments)
+    base_path = match.group(1) if match else os.path.join(os.environ.get("CMSSW_BASE", ""), "src/CombineHarvester/MSSMvsSMRun2Legacy/shapes")
+    channels = ["mt", "et", "tt", "em"] if category == "all" else [category.split("_")[0]]
+    inputs = []
+    for channel in channels:
+        inputs += glob.glob(os.path.join(os.path.expandvars(base_path), era, channel, "*-{}.root".format(args.variable)))
+    inputs.append(os.path.expandvars(args.sm_gg_fractions))
+    executable = find_executable("MorphingMSSMvsSM")
+    if executable:
+        inputs.append(executable)
+    library_dir = os.path.join(os.environ.get("CMSSW_BASE", ""), "lib", os.environ.get("SCRAM_ARCH", ""))
+    for library in ["libCombineHarvesterMSSMvsSMRun2Legacy.so", "libCombineHarvesterCombineTools.so", "libCombineHarvesterCombinePdfs.so"]:
+        inputs.append(os.path.join(library_dir, library))
+    return sorted(p for p in inputs if os.path.exists(p))
+
+
+def morphing_outputs(era, category):
+    # Datacards and shape files written by MorphingMSSMvsSM for the category or comma separated list of categories
+    output = "{}_{}".format(args.output_folder, args.analysis)
+    if category == "all":
+        return sorted(glob.glob(os.path.join(output, era, "*", "*.txt")) + glob.glob(os.path.join(output, era, "*", "common", "htt_input_{}.root".format(era))))
+    outputs = []
+    for c in category.split(","):
+        outputs += [os.path.join(output, era, c, "{}.txt".format(c)), os.path.join(output, era, c, "common", "{}_input.root".format(c)),
+                    os.path.join(output, "restore_binning", "{}.txt".format(c)), os.path.join(output, "restore_binning", "common", "{}_input.root".format(c))]
+    return outputs
+
+
+def morphing_state(task, known):
+    era, category = task.name.split("_", 1)
+    return {"command": task.command, "inputs": dict((p, file_hash(p, known)) for p in morphing_inputs(era, category))}
+
+
+def state_file(task):
+    return os.path.join("{}_{}".format(args.output_folder, args.analysis), ".morphing_state", "{}.json".format(task.name))
+
+
+def load_state(task):
+    if not os.path.exists(state_file(task)):
+        return None
+    with open(state_file(task), "r") as f:
+        return json.load(f)
+
+
+def save_state(task):
+    if not os.path.exists(os.path.dirname(state_file(task))):
+        os.makedirs(os.path.dirname(state_file(task)))
+    with open(state_file(task), "w") as f:
+        json.dump(states[task.name], f, indent=2, sort_keys=True)
+
+
+def unchanged(previous, current):
+    # Only the command and the file contents matter, not the modification times. The outputs of the previous run have to be still there
+    if previous is None or not previous.get("outputs") or not all(os.path.exists(p) for p in previous["outputs"]):
+        return False
+    signature = lambda state: (state["command"], dict((p, h["sha1"]) for p, h in state["inputs"].items()))
+    return signature(previous) == signature(current)
+
+
 categories = []
 with open(args.category_list, "r") as f:
     categories = [l.strip() for l in f.readlines()]
 
 eras = args.eras.split(',')
 
-commands = []
+if args.group_categories:
+    # The groups of categories which can be processed together are given by MorphingMSSMvsSM itself,
+    # SM categories need to be processed on their own
+    listing = tempfile.NamedTemporaryFile(suffix=".txt", delete=False)
+    listing.close()
+    list_command = "MorphingMSSMvsSM --era={ERA} --channel=mt,et,tt,em --category=all --output_folder={OUTPUT}" \
+                   " --analysis={ANALYSIS} --sub-analysis={SUB_ANALYSIS} --hSM-treatment={HSM_TREATMENT} --categorization={CATEGORIZATION}" \
+                   " --sm-like-hists={SM_LIKE_HISTS} --variable={VARIABLE} --list-categories={LISTING}".format(
+                       ERA=eras[0], OUTPUT=args.output_folder, ANALYSIS=args.analysis, SUB_ANALYSIS=args.sub_analysis, HSM_TREATMENT=args.hSM_treatment,
+                       CATEGORIZATION=args.categorization, SM_LIKE_HISTS=args.sm_like_hists, VARIABLE=args.variable, LISTING=listing.name)
+    if subprocess.call(list_command, shell=True) != 0:
+        print "[ERROR] Listing the categories failed: {}".format(list_command)
+        sys.exit(1)
+    with open(listing.name, "r") as f:
+        known_groups = [l.strip().split(",") for l in f if l.strip()]
+    os.remove(listing.name)
+    groups = []
+    for category in categories:
+        # 'all' and categories unknown to the categorization are passed on unchanged
+        group = [category]
+        for known_group in known_groups:
+            if category in known_group:
+                group = [c for c in categories if c in known_group]
+        if group not in groups:
+            groups.append(group)
+    categories = [",".join(group) for group in groups]
+
+tasks = []
+states = {}
+task_categories = {}
 
 command_template = "MorphingMSSMvsSM --era={ERA} --category={CATEGORY} --output_folder={OUTPUT}" \
                    " --analysis={ANALYSIS} --sub-analysis={SUB_ANALYSIS} --hSM-treatment={HSM_TREATMENT} --categorization={CATEGORIZATION} --sm-like-hists={SM_LIKE_HISTS}" \
@@ -51,19 +166,37 @@ for era in eras:
                                           ADDITIONALARGS=args.additional_arguments, OUTPUT=args.output_folder,
                                           VARIABLE=args.variable, SM_GG_FRACTIONS=args.sm_gg_fractions, HSM_TREATMENT=args.hSM_treatment,
                                           SUB_ANALYSIS=args.sub_analysis, CATEGORIZATION=args.categorization, SM_LIKE_HISTS=args.sm_like_hists)
-        commands.append(command)
+        if args.sm:
+            command = "{} --sm=true".format(command)
+        name = "{}_{}".format(era, category) if "," not in category else "{}_{}_group".format(era, category.split("_")[0])
+        tasks.append(Task(name, command=command))
+        task_categories[name] = (era, category)
 
-if args.sm:
-    commands = ["{} --sm=true".format(command) for command in commands]
+if args.incremental:
+    outdated = []
+    for task in tasks:
+        previous = load_state(task)
+        states[task.name] = morphing_state(task, previous["inputs"] if previous else {})
+        if not unchanged(previous, states[task.name]):
+            outdated.append(task)
+        else:
+            states[task.name]["outputs"] = previous["outputs"]
+            if previous != states[task.name] and not args.dry_run:
+                # refresh modification times of files with unchanged content
+                save_state(task)
+    print "[INFO] {} of {} era and category combinations are up to date and skipped".format(len(tasks) - len(outdated), len(tasks))
+    tasks = outdated
 
 if args.dry_run:
-    for command in commands:
-        print command
+    for task in tasks:
+        print task.command
 
 else:
-    if args.parallel < 2:
-        for command in commands:
-            execute(command)
-    else:
-        p = Pool(args.parallel)
-        p.map(execute, commands)
+    failures = run_tasks(tasks, parallel=args.parallel, retries=args.retries, summary=args.summary)
+    # Record the state of the successful runs only, such that failed ones are repeated
+    failed = set(f["name"] for f in failures)
+    for task in tasks:
+        if task.name in states and task.name not in failed:
+            states[task.name]["outputs"] = morphing_outputs(*task_categories[task.name])
+            save_state(task)
+    exit_status(failures)
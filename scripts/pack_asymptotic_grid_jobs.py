@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import argparse
+import heapq
+import math
+import os
+import re
+import sys
+
+import numpy as np
+
+from limit_result_database import read_timings
+
+parser = argparse.ArgumentParser(
+    description="Repack the points of an AsymptoticGrid condor task into jobs of roughly equal wall time. "
+                "The fit time per point is taken from earlier runs recorded in the result database, "
+                "with a cost model in (log(mass), tanb) fitted to these times for points not yet computed.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--task-script", required=True, help="condor_<taskname>.sh created by 'combineTool.py -M AsymptoticGrid --dry-run'")
+parser.add_argument("--submit-file", default=None, help="condor_<taskname>.sub to be updated with the new number of jobs. Derived from --task-script if not given")
+parser.add_argument("--database", default=None, help="SQLite result database with the recorded fit times, see limit_result_database.py")
+parser.add_argument("--model", default=None, help="Name of the benchmark scenario in the database, e.g. mh125")
+parser.add_argument("--pois", default="mA,tanb", help="Names of the grid parameters")
+parser.add_argument("--target-time", type=float, default=3600., help="Targeted wall time per job in seconds")
+parser.add_argument("--jobs", type=int, default=None, help="Fixed number of jobs, overrides --target-time")
+parser.add_argument("--dry-run", action="store_true", help="Only print the predicted job times, don't rewrite the task")
+
+args = parser.parse_args()
+
+JOB_START = re.compile(r"^if \[ \$1 -eq (\d+) \]; then\s*$")
+
+
+def read_task(filename):
+    # Split the task script into the common prefix and the commands of the individual jobs
+    prefix = []
+    commands = []
+    in_job = False
+    with open(filename, "r") as f:
+        for line in f:
+            if JOB_START.match(line):
+                in_job = True
+            elif in_job and line.strip() == "fi":
+                in_job = False
+            elif in_job:
+                if line.strip():
+                    commands.append(line.strip())
+            elif not commands:
+                prefix.append(line)
+    return "".join(prefix), commands
+
+
+def parse_point(command, pois):
+    match = re.search(r"\.{X}\.(?P<x>-?[0-9.]+?)\.{Y}\.(?P<y>-?[0-9.]+?)(\s|$)".format(
+        X=re.escape(pois[0]), Y=re.escape(pois[1])), command)
+    if not match:
+        return None
+    return float(match.group("x")), float(match.group("y"))
+
+
+def features(x, y):
+    logx = np.log(x)
+    return np.stack([np.ones_like(logx), logx, logx**2, y, y**2, logx * y], axis=1)
+
+
+def estimate_costs(points, timings):
+    # Recorded fit times where available, otherwise the prediction of a quadratic fit of log(time).
+    # Returns None without recorded times, there is nothing to base the packing on then
+    x_rec, y_rec, t_rec = timings
+    points = np.array(points, dtype=np.float64).reshape(-1, 2)
+    valid = (t_rec > 0) & (x_rec > 0)
+    x_rec, y_rec, t_rec = x_rec[valid], y_rec[valid], t_rec[valid]
+    if len(t_rec) == 0:
+        return None
+    costs = np.full(len(points), np.median(t_rec))
+    n_features = features(np.ones(1), np.ones(1)).shape[1]
+    if len(t_rec) > 2 * n_features:
+        coefficients = np.linalg.lstsq(features(x_rec, y_rec), np.log(t_rec), rcond=None)[0]
+        # Extrapolation outside of the recorded range is limited to the recorded extremes
+        costs = np.clip(np.exp(features(points[:, 0], points[:, 1]).dot(coefficients)), t_rec.min(), t_rec.max())
+    recorded = dict(((round(x, 6), round(y, 6)), t) for x, y, t in zip(x_rec, y_rec, t_rec))
+    n_recorded = 0
+    for i, (x, y) in enumerate(points):
+        t = recorded.get((round(x, 6), round(y, 6)))
+        if t is not None:
+            costs[i] = t
+            n_recorded += 1
+    print("Using recorded fit times for {NREC} of {NPOINTS} points".format(NREC=n_recorded, NPOINTS=len(points)))
+    return costs
+
+
+def pack(costs, n_jobs):
+    # Longest processing time first: assign each point to the job with the lowest predicted time so far
+    jobs = [(0., i, []) for i in range(n_jobs)]
+    for index in np.argsort(-costs, kind="mergesort"):
+        load, i, members = heapq.heappop(jobs)
+        members.append(index)
+        heapq.heappush(jobs, (load + costs[index], i, members))
+    jobs = sorted(jobs, key=lambda job: -job[0])
+    return [(load, sorted(members)) for load, _, members in jobs if members]
+
+
+def main():
+    prefix, commands = read_task(args.task_script)
+    if not commands:
+        raise RuntimeError("No jobs found in {FILE}".format(FILE=args.task_script))
+    pois = args.pois.split(",")
+    points = [parse_point(command, pois) for command in commands]
+    unparsed = [command for command, point in zip(commands, points) if point is None]
+    if unparsed:
+        raise RuntimeError("Cannot determine the grid point of {N} commands, e.g. '{CMD}'".format(N=len(unparsed), CMD=unparsed[0]))
+
+    if args.database and args.model and os.path.exists(args.database):
+        timings = read_timings(args.database, args.model, "AsymptoticLimits")
+    else:
+        timings = (np.zeros(0), np.zeros(0), np.zeros(0))
+    costs = estimate_costs(points, timings)
+    if costs is None:
+        print("[WARNING] No recorded fit times for model {MODEL} in {DB}, the task {FILE} is left unchanged".format(
+            MODEL=args.model, DB=args.database, FILE=args.task_script))
+        return 0
+
+    if args.jobs:
+        n_jobs = args.jobs
+    else:
+        n_jobs = int(math.ceil(costs.sum() / max(args.target_time, costs.max())))
+    n_jobs = max(1, min(n_jobs, len(commands)))
+    jobs = pack(costs, n_jobs)
+    loads = np.array([load for load, _ in jobs])
+    print("Packed {NPOINTS} points into {NJOBS} jobs, predicted wall time per job: mean {MEAN:.0f} s, max {MAX:.0f} s".format(
+        NPOINTS=len(commands), NJOBS=len(jobs), MEAN=loads.mean(), MAX=loads.max()))
+    if args.dry_run:
+        return 0
+
+    with open(args.task_script, "w") as out:
+        out.write(prefix)
+        for i, (_, members) in enumerate(jobs):
+            out.write("if [ $1 -eq {INDEX} ]; then\n".format(INDEX=i))
+            for index in members:
+                out.write("  {CMD}\n".format(CMD=commands[index]))
+            out.write("fi\n")
+    print("Task script {FILE} rewritten".format(FILE=args.task_script))
+
+    submit_file = args.submit_file or os.path.splitext(args.task_script)[0] + ".sub"
+    if os.path.exists(submit_file):
+        with open(submit_file, "r") as f:
+            content = f.read()
+        with open(submit_file, "w") as f:
+            f.write(re.sub(r"^queue[ \t]+\d+[ \t]*$", "queue {NJOBS}".format(NJOBS=len(jobs)), content, flags=re.MULTILINE))
+        print("Number of jobs in {FILE} set to {NJOBS}".format(FILE=submit_file, NJOBS=len(jobs)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
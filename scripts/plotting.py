@@ -1,12 +1,24 @@
 import ROOT as R
+import os
 import math
 from array import array
 import re
 import json
 import types
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 COL_STORE = []
 
+# The NumPy implementations of the bin-by-bin histogram operations below are used only on request, by setting
+# plotting.USE_NUMPY = True or PLOTTING_USE_NUMPY=1 in the environment. The ROOT implementations are the default
+USE_NUMPY = np is not None and os.environ.get('PLOTTING_USE_NUMPY', '0') == '1'
+# The marching squares contours in contourFromTH2 are a different algorithm than the 'CONT LIST' contours of
+# ROOT, they are switched on separately with plotting.USE_NUMPY_CONTOURS = True or PLOTTING_NUMPY_CONTOURS=1
+USE_NUMPY_CONTOURS = np is not None and os.environ.get('PLOTTING_NUMPY_CONTOURS', '0') == '1'
+
 ## @name Global Style
 ##
 ## @details Set the properties of the global gStyle object and create colours
@@ -1626,6 +1638,8 @@ def DrawLimitBand(pad, graph_dict, draw=['exp2', 'exp1', 'exp0', 'obs'], draw_le
 #  @details Creating contour TGraphs using TH2s and TGraph2Ds
 ##@{
 def contourFromTH2(h2in, threshold, minPoints=10, frameValue=1000.):
+    if USE_NUMPY_CONTOURS:
+        return contourFromTH2Numpy(h2in, threshold, minPoints, frameValue)
     # // http://root.cern.ch/root/html/tutorials/hist/ContourList.C.html
     contoursList = [threshold]
     contours = array('d', contoursList)
@@ -1665,6 +1679,8 @@ def contourFromTH2(h2in, threshold, minPoints=10, frameValue=1000.):
 
 
 def frameTH2D(hist, threshold, frameValue=1000):
+    if USE_NUMPY:
+        return frameTH2DNumpy(hist, threshold, frameValue)
     # Now supports variable-binned histograms First adds a narrow frame (1% of
     # of bin widths) around the outside with same values as the real edge. Then
     # adds another frame another frame around this one filled with some chosen
@@ -1732,6 +1748,8 @@ def frameTH2D(hist, threshold, frameValue=1000):
     return framed
 
 def fastFillTH2(hist2d, graph, initalValue=99999, interpolateMissing=False):
+    if USE_NUMPY:
+        return fastFillTH2Numpy(hist2d, graph, initalValue, interpolateMissing)
     for x in range(1,hist2d.GetNbinsX()+1):
         for y in range(1,hist2d.GetNbinsY()+1):
             hist2d.SetBinContent(x,y,initalValue)
@@ -1751,6 +1769,8 @@ def fastFillTH2(hist2d, graph, initalValue=99999, interpolateMissing=False):
                     hist2d.SetBinContent(x, y, graph.Interpolate(hist2d.GetXaxis().GetBinCenter(x),hist2d.GetYaxis().GetBinCenter(y)))
 
 def fillTH2(hist2d, graph):
+    if USE_NUMPY:
+        return fillTH2Numpy(hist2d, graph)
     for x in range(1, hist2d.GetNbinsX() + 1):
         for y in range(1, hist2d.GetNbinsY() + 1):
             xc = hist2d.GetXaxis().GetBinCenter(x)
@@ -1759,6 +1779,8 @@ def fillTH2(hist2d, graph):
             hist2d.SetBinContent(x, y, val)
 
 def fillInvertedTH2(hist2d, graph):
+    if USE_NUMPY:
+        return fillInvertedTH2Numpy(hist2d, graph)
     for x in range(1, hist2d.GetNbinsX() + 1):
         for y in range(1, hist2d.GetNbinsY() + 1):
             xc = hist2d.GetXaxis().GetBinCenter(x)
@@ -1772,6 +1794,8 @@ def fillInvertedTH2(hist2d, graph):
 # https://indico.cern.ch/event/256523/contribution/2/attachments/450198/624259/07JUN2013_cawest.pdf
 # http://hep.ucsb.edu/people/cawest/interpolation/interpolate.h
 def NewInterpolate(hist):
+    if USE_NUMPY:
+        return NewInterpolateNumpy(hist)
     histCopy = hist.Clone()
 
     # make temporary histograms to store the results of both steps
@@ -1861,6 +1885,8 @@ def NewInterpolate(hist):
 
 
 def rebin(hist):
+    if USE_NUMPY:
+        return rebinNumpy(hist)
     histName = hist.GetName()
     histName += "_rebin"
 
@@ -1887,6 +1913,268 @@ def rebin(hist):
     return histRebinnedInterpolated
 
 
+# NumPy versions of the functions above. The bin contents are read once from the
+# histogram buffer, processed as arrays indexed [x, y] including under- and overflow
+# bins, and written back with a single SetContent call.
+def BufferToArray(buf, size, dtype='float64'):
+    # Copy of a ROOT array buffer, e.g. from TH1::GetArray or TGraph2D::GetX
+    if hasattr(buf, 'reshape'):
+        buf.reshape((size,))
+    else:
+        buf.SetSize(size)
+    return np.frombuffer(buf, dtype=dtype, count=size).copy()
+
+
+# Element type of the bin content buffer, by the array class a histogram class inherits from
+ARRAY_DTYPES = [('TArrayD', 'float64'), ('TArrayF', 'float32'), ('TArrayI', 'int32'), ('TArrayS', 'int16'), ('TArrayC', 'int8')]
+
+
+def TH2ToArray(hist):
+    dtypes = [dtype for array_class, dtype in ARRAY_DTYPES if hist.InheritsFrom(array_class)]
+    if not dtypes:
+        raise TypeError('Unsupported bin content type of histogram %s of class %s' % (hist.GetName(), hist.ClassName()))
+    dtype = np.dtype(dtypes[0])
+    values = BufferToArray(hist.GetArray(), hist.GetSize(), dtype)
+    return values.reshape(hist.GetNbinsY() + 2, hist.GetNbinsX() + 2).T
+
+
+def ArrayToTH2(hist, values):
+    hist.SetContent(np.ascontiguousarray(values.T, dtype=np.float64).ravel())
+
+
+def AxisEdges(axis):
+    return np.array([axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins() + 2)])
+
+
+def AxisCenters(axis):
+    # Bin centers as given by TAxis::GetBinCenter, including under- and overflow
+    nbins, xmin, xmax = axis.GetNbins(), axis.GetXmin(), axis.GetXmax()
+    binwidth = (xmax - xmin) / float(nbins)
+    centers = xmin + (np.arange(nbins + 2) - 1) * binwidth + 0.5 * binwidth
+    if axis.IsVariableBinSize():
+        edges = AxisEdges(axis)
+        centers[1:-1] = edges[:-1] + 0.5 * (edges[1:] - edges[:-1])
+    return centers
+
+
+def AxisFindBin(axis, x):
+    # Bin numbers as given by TAxis::FindBin for axes, which cannot be extended
+    nbins, xmin, xmax = axis.GetNbins(), axis.GetXmin(), axis.GetXmax()
+    inside = (x >= xmin) & (x < xmax)
+    if axis.IsVariableBinSize():
+        bins = np.searchsorted(AxisEdges(axis), x, side='right')
+    else:
+        bins = 1 + np.floor(nbins * (np.where(inside, x, xmin) - xmin) / (xmax - xmin)).astype(int)
+    return np.where(x < xmin, 0, np.where(inside, bins, nbins + 1))
+
+
+def frameGrid(x_bins, y_bins, values, frameValue=1000):
+    # Array version of the framing in frameTH2D: returns the new bin edges and the framed
+    # values of the bins within the histogram range, indexed [x, y]
+    xw1, xw2 = x_bins[1] - x_bins[0], x_bins[-1] - x_bins[-2]
+    yw1, yw2 = y_bins[1] - y_bins[0], y_bins[-1] - y_bins[-2]
+    x_new = np.concatenate([[x_bins[0] - 2 * xw1 * 0.02, x_bins[0] - 1 * xw1 * 0.02], x_bins,
+                            [x_bins[-1] + 1 * xw2 * 0.02, x_bins[-1] + 2 * xw2 * 0.02]])
+    y_new = np.concatenate([[y_bins[0] - 2 * yw1 * 0.02, y_bins[0] - 1 * yw1 * 0.02], y_bins,
+                            [y_bins[-1] + 1 * yw2 * 0.02, y_bins[-1] + 2 * yw2 * 0.02]])
+    # The narrow frame repeats the edge values of the histogram, the outer frame is set to frameValue
+    framed = np.pad(np.asarray(values, dtype=np.float64), 1, mode='edge')
+    framed = np.pad(framed, 1, mode='constant', constant_values=frameValue)
+    return x_new, y_new, framed
+
+
+def frameTH2DNumpy(hist, threshold, frameValue=1000):
+    x_new, y_new, content = frameGrid(AxisEdges(hist.GetXaxis()), AxisEdges(hist.GetYaxis()),
+                                      TH2ToArray(hist)[1:-1, 1:-1], frameValue)
+    framed = R.TH2D('%s framed' % hist.GetName(), '%s framed' % hist.GetTitle(), len(
+        x_new) - 1, array('d', x_new), len(y_new) - 1, array('d', y_new))
+    framed.SetDirectory(0)
+    ArrayToTH2(framed, np.pad(content, 1, mode='constant'))
+    return framed
+
+
+def fastFillTH2Numpy(hist2d, graph, initalValue=99999, interpolateMissing=False):
+    content = TH2ToArray(hist2d)
+    content[1:-1, 1:-1] = initalValue
+    n = graph.GetN()
+    x = BufferToArray(graph.GetX(), n)
+    y = BufferToArray(graph.GetY(), n)
+    z = BufferToArray(graph.GetZ(), n)
+    xbin = AxisFindBin(hist2d.GetXaxis(), x)
+    ybin = AxisFindBin(hist2d.GetYaxis(), y)
+    xc = AxisCenters(hist2d.GetXaxis())[xbin]
+    yc = AxisCenters(hist2d.GetYaxis())[ybin]
+    # Vectorized version of isclose(..., rel_tol=1e-2)
+    close = (np.abs(xc - x) <= 1e-2 * np.maximum(np.abs(xc), np.abs(x))) & (np.abs(yc - y) <= 1e-2 * np.maximum(np.abs(yc), np.abs(y)))
+    content[xbin[close], ybin[close]] = z[close]
+    if interpolateMissing:
+        xc = AxisCenters(hist2d.GetXaxis())
+        yc = AxisCenters(hist2d.GetYaxis())
+        inner = np.zeros(content.shape, dtype=bool)
+        inner[1:-1, 1:-1] = True
+        for ix, iy in zip(*np.nonzero(inner & (content == initalValue))):
+            content[ix, iy] = graph.Interpolate(xc[ix], yc[iy])
+    ArrayToTH2(hist2d, content)
+
+
+def fillTH2Numpy(hist2d, graph, invert=False):
+    # TGraph2D::Interpolate has no vectorized interface, only the histogram access is done in one go
+    content = TH2ToArray(hist2d)
+    xc = AxisCenters(hist2d.GetXaxis())
+    yc = AxisCenters(hist2d.GetYaxis())
+    for ix in range(1, hist2d.GetNbinsX() + 1):
+        for iy in range(1, hist2d.GetNbinsY() + 1):
+            val = graph.Interpolate(xc[ix], yc[iy])
+            content[ix, iy] = 1-val if invert else val
+    ArrayToTH2(hist2d, content)
+
+
+def fillInvertedTH2Numpy(hist2d, graph):
+    fillTH2Numpy(hist2d, graph, invert=True)
+
+
+def NewInterpolateNumpy(hist):
+    histCopy = hist.Clone()
+
+    # make temporary histograms to store the results of both steps
+    hist_step1 = histCopy.Clone()
+    hist_step1.Reset()
+    hist_step2 = histCopy.Clone()
+    hist_step2.Reset()
+
+    c = TH2ToArray(histCopy).astype(np.float64)
+    # neighbours of all bins within the scan, taken from shifted views of the contents
+    centre = c[1:-1, 1:-1]
+    nw, se, ne, sw = c[2:, 2:], c[:-2, :-2], c[2:, :-2], c[:-2, 2:]
+    up, down, left, right = c[1:-1, 2:], c[1:-1, :-2], c[:-2, 1:-1], c[2:, 1:-1]
+    nFilled = sum((n > 0).astype(int) for n in [nw, se, ne, sw, up, down, right, left])
+    # if we are at an empty bin and there are neighbours with non-zero entries, average over them
+    fill = (centre == 0) & (nFilled > 1)
+    step1 = np.zeros(c.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step1[1:-1, 1:-1] = np.where(fill, (nw + se + ne + sw + up + down + right + left) / nFilled, 0.)
+    ArrayToTH2(hist_step1, step1)
+    histCopy.Add(hist_step1)
+
+    # "Swiss Cross" average, not applied to the last bin in each direction
+    c = TH2ToArray(histCopy).astype(np.float64)
+    centre = c[1:-2, 1:-2]
+    up, down, left, right = c[1:-2, 2:-1], c[1:-2, :-3], c[:-3, 1:-2], c[2:-1, 1:-2]
+    nFilled = sum((n > 0).astype(int) for n in [up, down, right, left])
+    fill = (centre == 0) & (nFilled > 0)
+    step2 = np.zeros(c.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step2[1:-2, 1:-2] = np.where(fill, (up + down + right + left) / nFilled, 0.)
+    ArrayToTH2(hist_step2, step2)
+    histCopy.Add(hist_step2)
+
+    return histCopy
+
+
+def rebinNumpy(hist):
+    histName = hist.GetName()
+    histName += "_rebin"
+    nx, ny = hist.GetNbinsX(), hist.GetNbinsY()
+    histRebinned = R.TH2F(histName, histName, 2 * nx - 1, hist.GetXaxis().GetXmin(),
+                          hist.GetXaxis().GetXmax(), 2 * ny - 1, hist.GetYaxis().GetXmin(), hist.GetYaxis().GetXmax())
+
+    # copy results from previous histogram into every second bin
+    content = np.zeros((2 * nx + 1, 2 * ny + 1))
+    content[1:2 * nx:2, 1:2 * ny:2] = TH2ToArray(hist)[1:-1, 1:-1]
+    ArrayToTH2(histRebinned, content)
+    histRebinned.SetMaximum(hist.GetMaximum())
+    histRebinned.SetMinimum(hist.GetMinimum())
+
+    # use interpolation to re-fill histogram
+    return NewInterpolateNumpy(histRebinned)
+
+
+# Marching squares: the segments of each cell case, given as pairs of crossed cell edges
+# (0: bottom, 1: right, 2: top, 3: left). The bits of the case are set for corners above
+# the threshold (1: (i, j), 2: (i+1, j), 4: (i+1, j+1), 8: (i, j+1)). For the ambiguous
+# cases 5 and 10 the first entry is used if the cell centre is above the threshold.
+MARCHING_SQUARES_SEGMENTS = {
+    1: [(3, 0)], 2: [(0, 1)], 3: [(3, 1)], 4: [(1, 2)], 6: [(0, 2)], 7: [(3, 2)],
+    8: [(2, 3)], 9: [(2, 0)], 11: [(2, 1)], 12: [(1, 3)], 13: [(1, 0)], 14: [(0, 3)],
+    5: ([(0, 1), (2, 3)], [(3, 0), (1, 2)]),
+    10: ([(3, 0), (1, 2)], [(0, 1), (2, 3)]),
+}
+
+
+def contourArraysFromGrid(x, y, z, threshold):
+    # Contour lines of z[i, j] given at the points (x[i], y[j]) as list of (x, y) arrays.
+    # No ROOT objects are involved, such that this can be used in worker processes.
+    z = np.asarray(z, dtype=np.float64)
+    above = z > threshold
+    cases = (above[:-1, :-1] * 1 + above[1:, :-1] * 2 + above[1:, 1:] * 4 + above[:-1, 1:] * 8)
+    centre_above = 0.25 * (z[:-1, :-1] + z[1:, :-1] + z[1:, 1:] + z[:-1, 1:]) > threshold
+
+    # Crossing points on all horizontal edges (i, j)-(i+1, j) and vertical edges (i, j)-(i, j+1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_x = x[:-1, None] + (threshold - z[:-1, :]) / (z[1:, :] - z[:-1, :]) * (x[1:] - x[:-1])[:, None]
+        v_y = y[None, :-1] + (threshold - z[:, :-1]) / (z[:, 1:] - z[:, :-1]) * (y[1:] - y[:-1])[None, :]
+
+    def edge(i, j, e):
+        return [('h', i, j), ('v', i + 1, j), ('h', i, j + 1), ('v', i, j)][e]
+
+    def point(key):
+        kind, i, j = key
+        return (h_x[i, j], y[j]) if kind == 'h' else (x[i], v_y[i, j])
+
+    neighbours = {}
+    for i, j in zip(*np.nonzero((cases > 0) & (cases < 15))):
+        segments = MARCHING_SQUARES_SEGMENTS[cases[i, j]]
+        if cases[i, j] in (5, 10):
+            segments = segments[0] if centre_above[i, j] else segments[1]
+        for e1, e2 in segments:
+            k1, k2 = edge(i, j, e1), edge(i, j, e2)
+            neighbours.setdefault(k1, []).append(k2)
+            neighbours.setdefault(k2, []).append(k1)
+
+    def walk(start):
+        line = [start]
+        current = start
+        while neighbours.get(current):
+            following = neighbours[current].pop()
+            neighbours[following].remove(current)
+            line.append(following)
+            current = following
+        return line
+
+    # Chain the segments, starting with the open lines ending at the border of the grid.
+    # Closed lines end with their starting point.
+    contours = []
+    for start in [k for k, n in neighbours.items() if len(n) == 1] + list(neighbours.keys()):
+        if neighbours.get(start):
+            points = np.array([point(k) for k in walk(start)])
+            contours.append((points[:, 0], points[:, 1]))
+    return contours
+
+
+def contourArraysFromTH2(h2in, threshold, minPoints=10, frameValue=1000.):
+    # Contours of a TH2 as (x, y) arrays, using the bin centres of the framed histogram as grid points
+    x_new, y_new, framed = frameGrid(AxisEdges(h2in.GetXaxis()), AxisEdges(h2in.GetYaxis()),
+                                     TH2ToArray(h2in)[1:-1, 1:-1], frameValue)
+    x = x_new[:-1] + 0.5 * (x_new[1:] - x_new[:-1])
+    y = y_new[:-1] + 0.5 * (y_new[1:] - y_new[:-1])
+    contours = contourArraysFromGrid(x, y, framed, threshold)
+    print('>> Contour %d has %d Graphs' % (0, len(contours)))
+    for j, (cx, cy) in enumerate(contours):
+        print('\t Graph %d has %d points' % (j, len(cx)))
+    return [(cx, cy) for cx, cy in contours if len(cx) > minPoints]
+
+
+def contourFromTH2Numpy(h2in, threshold, minPoints=10, frameValue=1000.):
+    contours = contourArraysFromTH2(h2in, threshold, minPoints, frameValue)
+    if not contours:
+        print('*** No Contours Were Extracted!')
+        return None
+    ret = R.TList()
+    for cx, cy in contours:
+        ret.Add(R.TGraph(len(cx), array('d', cx), array('d', cy)))
+    return ret
+
+
 def higgsConstraint(model, higgstype):
     higgsBand = R.TGraph2D()
     masslow = 150
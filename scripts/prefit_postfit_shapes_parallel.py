@@ -4,13 +4,7 @@ import os
 import glob
 import sys
 import argparse
-from multiprocessing import Pool
-
-def execute(cmd):
-    try:
-        os.system(cmd)
-    except:
-        print "[WARNING] Command failed:",cmd
+from CombineHarvester.MSSMvsSMRun2Legacy.local_executor import Task, run_tasks, add_executor_arguments, exit_status
 
 parser = argparse.ArgumentParser( description = "Script to run 'PostFitShapesFromWorkspace' in parallel for each category.")
 parser.add_argument('--datacard_pattern', required = True, help = "Path pattern to the 'combined.txt.cmb' datacards to be used for the histograms")
@@ -21,20 +15,28 @@ parser.add_argument('--fit_arguments', default="",
                     help = "Arguments to be used to apply fit result(s). Use with needed options, e.g. '-f <path-pattern-to-fitDiagnostics.root>:<fit-to-be-used> --sampling --postfit'")
 parser.add_argument('--parallel', type=int, default=5, help = "Cores provided for parallel processing")
 parser.add_argument('--dry_run',action='store_true', help = "Don't execute, only list commands")
+add_executor_arguments(parser)
 
 args = parser.parse_args()
 
 datacards = [d for d in glob.glob(args.datacard_pattern) if "/cmb/" not in d]
 
+# Each task reads the workspace built from the datacard of its own category. A snapshot of the workspace cache
+# (BuildWorkspaceCache) would not reduce it any further, so none is used here.
+
 cmds = ['card=DATACARD;'
         'basedir=$(dirname $(dirname ${card}));'
         'category=$(basename $(dirname ${card}));'
         'echo $card; echo ${card/combined.txt.cmb/WSNAME}; echo ${card/combined.txt.cmb/OUTPUT};'
         'PostFitShapesFromWorkspace -w ${card/combined.txt.cmb/WSNAME} -o ${card/combined.txt.cmb/OUTPUT} -d $(dirname ${basedir})/restore_binning/${category}.txt FREEZEARGS FITARGS'.replace("DATACARD",d).replace("FREEZEARGS",args.freeze_arguments).replace("FITARGS",args.fit_arguments).replace("WSNAME",args.workspace_name).replace("OUTPUT",args.output_name) for d in datacards]
 
-p = Pool(args.parallel)
+# Categories with the largest workspaces first
+workspaces = [d.replace("combined.txt.cmb", args.workspace_name) for d in datacards]
+tasks = [Task(d, command=cmd, cost=os.path.getsize(ws) if os.path.exists(ws) else 0) for d, ws, cmd in zip(datacards, workspaces, cmds)]
+
 if args.dry_run:
     for cmd in cmds:
         print cmd
 else:
-    p.map(execute, cmds)
+    failures = run_tasks(tasks, parallel=args.parallel, retries=args.retries, summary=args.summary)
+    exit_status(failures)
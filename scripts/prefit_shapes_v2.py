@@ -4,14 +4,7 @@ import os
 import glob
 import sys
 import argparse
-from multiprocessing import Pool
-
-
-def execute(cmd):
-    try:
-        os.system(cmd)
-    except:
-        print "[WARNING] Command failed:", cmd
+from CombineHarvester.MSSMvsSMRun2Legacy.local_executor import Task, run_tasks, add_executor_arguments, exit_status
 
 
 parser = argparse.ArgumentParser(
@@ -45,6 +38,7 @@ parser.add_argument('--parallel',
 parser.add_argument('--dry_run',
                     action='store_true',
                     help="Don't execute, only list commands")
+add_executor_arguments(parser)
 
 args = parser.parse_args()
 
@@ -55,7 +49,7 @@ datacards = [
 print("Running prefit shapes for {} histograms".format(len(datacards)))
 
 basedir = args.basedir
-cmds = []
+tasks = []
 for datacardfile in datacards:
     datacard = datacardfile.strip(".txt")
     category = datacard.split("_")[1]
@@ -74,11 +68,18 @@ for datacardfile in datacards:
         restore_binningfile=restore_binningfile,
         freezeargs=args.freeze_arguments,
         fitargs=args.fit_arguments)
-    cmds.append(commandstring)
+    tasks.append(
+        Task(datacard,
+             command=commandstring,
+             cost=os.path.getsize(workspace)
+             if os.path.exists(workspace) else 0))
 
-p = Pool(args.parallel)
 if args.dry_run:
-    for cmd in cmds:
-        print cmd
+    for task in tasks:
+        print task.command
 else:
-    p.map(execute, cmds)
+    failures = run_tasks(tasks,
+                         parallel=args.parallel,
+                         retries=args.retries,
+                         summary=args.summary)
+    exit_status(failures)
@@ -18,14 +18,25 @@ parser.add_argument('--workspace_name', required = True, help = "Workspace name
 parser.add_argument('--freeze_arguments', default="", help = "Arguments to be frozen to a certain value. Use with options, e.g. '--freeze r=1'")
 parser.add_argument('--fit_arguments', default="",
                     help = "Arguments to be used to apply fit result(s). Use with needed options, e.g. '-f <path-pattern-to-fitDiagnostics.root>:<fit-to-be-used> --sampling --postfit'")
+parser.add_argument('--points', default="",
+                    help = "File with one (mA, tanb) point per line. The signal shapes of all points are written into the output file of each category, instead of running once per point")
+parser.add_argument('--mass_parameter', default="mA", help = "Name of the mass parameter of the points, 'mA' or 'mHp'")
+parser.add_argument('--cache_dir', default="",
+                    help = "Directory for snapshots of the workspaces reduced to the category, see BuildWorkspaceCache. Reused by later calls as long as the workspace is unchanged")
 parser.add_argument('--parallel', type=int, default=5, help = "Cores provided for parallel processing")
 parser.add_argument('--dry_run',action='store_true', help = "Don't execute, only list commands")
 
 args = parser.parse_args()
 
+extra_arguments = ""
+if args.points:
+    extra_arguments = "--points {} --mass-parameter {}".format(os.path.abspath(args.points), args.mass_parameter)
+if args.cache_dir:
+    extra_arguments += " --cache-dir {}".format(os.path.abspath(args.cache_dir))
+
 datacards = [d for d in glob.glob(args.datacard_pattern) if "/cmb/" not in d]
 
-cmds = ['card=DATACARD; basedir=$(dirname $(dirname ${card})); category=$(basename $(dirname ${card})); echo $card; echo ${card/combined.txt.cmb/WSNAME}; echo ${card/combined.txt.cmb/prefit_signal_shapes_WSNAME}; PreFitSignalShapes -w ${card/combined.txt.cmb/WSNAME}  -o ${card/combined.txt.cmb/prefit_signal_shapes_WSNAME} -d ${basedir}/restore_binning/${category}/${category}.txt -c ${category} FREEZEARGS FITARGS'.replace("DATACARD",d).replace("FREEZEARGS",args.freeze_arguments).replace("FITARGS",args.fit_arguments).replace("WSNAME",args.workspace_name) for d in datacards]
+cmds = ['card=DATACARD; basedir=$(dirname $(dirname ${card})); category=$(basename $(dirname ${card})); echo $card; echo ${card/combined.txt.cmb/WSNAME}; echo ${card/combined.txt.cmb/prefit_signal_shapes_WSNAME}; PreFitSignalShapes -w ${card/combined.txt.cmb/WSNAME}  -o ${card/combined.txt.cmb/prefit_signal_shapes_WSNAME} -d ${basedir}/restore_binning/${category}/${category}.txt -c ${category} FREEZEARGS FITARGS EXTRAARGS'.replace("DATACARD",d).replace("FREEZEARGS",args.freeze_arguments).replace("FITARGS",args.fit_arguments).replace("WSNAME",args.workspace_name).replace("EXTRAARGS",extra_arguments) for d in datacards]
 
 p = Pool(args.parallel)
 if args.dry_run:
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import argparse
+import json
+from collections import OrderedDict
+
+import numpy as np
+import ROOT
+ROOT.gROOT.SetBatch()
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+
+parser = argparse.ArgumentParser(
+    description="Adaptive refinement of model-dependent AsymptoticGrid scans. Determines the cells of the scanned (mass, tanb) grid, "
+                "in which the CLs contour is crossed, and writes out a grid configuration with finer sub-grids for these cells only. "
+                "Iterate 'setup' -> 'submit' -> 'collect' -> refinement with the refined configuration until the contour is stable.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--input-json", required=True, help="AsymptoticGrid configuration used for the current scan, e.g. input/mssm_asymptotic_grid_mh125.json")
+parser.add_argument("--grid-root", required=True, help="output of the collection of the current scan, usually asymptotic_grid.root")
+parser.add_argument("--output-json", required=True, help="refined AsymptoticGrid configuration to be written")
+parser.add_argument("--points-output", default=None, help="optional text file listing the new points to be computed, one 'mass tanb' pair per line")
+parser.add_argument("--levels", default="exp-2,exp-1,exp0,exp+1,exp+2,obs", help="comma-separated list of CLs graphs, for which the contour should be refined")
+parser.add_argument("--cls", type=float, default=0.05, help="CLs value defining the exclusion contour")
+parser.add_argument("--refine-factor", type=int, default=2, help="factor, by which the step size in a crossed cell is reduced per iteration")
+parser.add_argument("--min-step-x", type=float, default=1.0, help="minimum step size in the mass direction")
+parser.add_argument("--min-step-y", type=float, default=0.25, help="minimum step size in the tanb direction")
+
+args = parser.parse_args()
+
+
+def format_value(value):
+    return "%g" % round(value, 6)
+
+
+def read_levels(filename, levels):
+    # Read the CLs values of all requested levels into (mass, tanb, CLs) arrays
+    f = ROOT.TFile.Open(filename, "read")
+    points = OrderedDict()
+    for level in levels:
+        graph = f.Get(level)
+        if not graph:
+            print("[WARNING] Level {LEVEL} not found in {FILE}, skipping it.".format(LEVEL=level, FILE=filename))
+            continue
+        n = graph.GetN()
+        points[level] = (
+            np.array([graph.GetX()[i] for i in range(n)]),
+            np.array([graph.GetY()[i] for i in range(n)]),
+            np.array([graph.GetZ()[i] for i in range(n)]),
+        )
+    f.Close()
+    return points
+
+
+def mark_line_crossings(crossed, along_vals, across_vals, along, across, cls, threshold, transpose):
+    # Crossings between neighbouring scanned points of each line with fixed 'across' value. The cells on both
+    # sides of the line between the two points are marked, also if the line has fewer scanned values than the
+    # union grid, e.g. a coarse row next to a row refined in a previous iteration
+    cells = crossed.T if transpose else crossed
+    for value in np.unique(across):
+        on_line = across == value
+        order = np.argsort(along[on_line], kind="mergesort")
+        line_along, line_cls = along[on_line][order], cls[on_line][order]
+        above = line_cls >= threshold
+        index_across = np.searchsorted(across_vals, value)
+        for k in np.nonzero(above[:-1] != above[1:])[0]:
+            first, last = np.searchsorted(along_vals, line_along[k]), np.searchsorted(along_vals, line_along[k + 1])
+            for j in (index_across - 1, index_across):
+                if 0 <= j < cells.shape[1]:
+                    cells[first:last, j] = True
+
+
+def crossed_cells(points, threshold):
+    # Pivot the graphs onto the union of all scanned mass and tanb values (NaN for points not scanned)
+    # and mark the cells, for which the corners lie on both sides of the threshold.
+    x_vals = np.unique(np.concatenate([p[0] for p in points.values()]))
+    y_vals = np.unique(np.concatenate([p[1] for p in points.values()]))
+    crossed = np.zeros((len(x_vals) - 1, len(y_vals) - 1), dtype=bool)
+    for x, y, cls in points.values():
+        grid = np.full((len(x_vals), len(y_vals)), np.nan)
+        grid[np.searchsorted(x_vals, x), np.searchsorted(y_vals, y)] = cls
+        corners = np.stack([grid[:-1, :-1], grid[1:, :-1], grid[:-1, 1:], grid[1:, 1:]])
+        valid = ~np.isnan(corners)
+        highest = np.where(valid, corners, -np.inf).max(axis=0)
+        lowest = np.where(valid, corners, np.inf).min(axis=0)
+        crossed |= (valid.sum(axis=0) >= 2) & (highest >= threshold) & (lowest < threshold)
+        # Cells with less than two scanned corners are covered by the crossings along the rows and columns
+        mark_line_crossings(crossed, x_vals, y_vals, x, y, cls, threshold, transpose=False)
+        mark_line_crossings(crossed, y_vals, x_vals, y, x, cls, threshold, transpose=True)
+    return x_vals, y_vals, crossed
+
+
+def refined_step(width, min_step, factor):
+    # Largest step not above the target step which divides the cell exactly, such that both cell edges are grid points
+    target = max(width / factor, min_step)
+    return width / np.ceil(width / target - 1e-9)
+
+
+def refine(x_vals, y_vals, crossed):
+    # Build sub-grids for the crossed cells, merging neighbouring cells along the mass direction with identical steps
+    grids = []
+    for j in range(len(y_vals) - 1):
+        dy = y_vals[j + 1] - y_vals[j]
+        step_y = refined_step(dy, args.min_step_y, args.refine_factor)
+        current = None
+        for i in range(len(x_vals) - 1):
+            if not crossed[i, j]:
+                current = None
+                continue
+            step_x = refined_step(x_vals[i + 1] - x_vals[i], args.min_step_x, args.refine_factor)
+            if current is not None and np.isclose(current["step_x"], step_x):
+                current["x_max"] = x_vals[i + 1]
+            else:
+                current = {"x_min": x_vals[i], "x_max": x_vals[i + 1], "step_x": step_x,
+                           "y_min": y_vals[j], "y_max": y_vals[j + 1], "step_y": step_y}
+                grids.append(current)
+    return grids
+
+
+def grid_points(grid):
+    # The steps divide the sub-grids exactly, see refined_step
+    n_x = int(round((grid["x_max"] - grid["x_min"]) / grid["step_x"])) + 1
+    n_y = int(round((grid["y_max"] - grid["y_min"]) / grid["step_y"])) + 1
+    for x in np.linspace(grid["x_min"], grid["x_max"], n_x):
+        for y in np.linspace(grid["y_min"], grid["y_max"], n_y):
+            yield (round(x, 6), round(y, 6))
+
+
+def main():
+    config = json.load(open(args.input_json, "r"), object_pairs_hook=OrderedDict)
+    points = read_levels(args.grid_root, args.levels.split(","))
+    if not points:
+        raise RuntimeError("No CLs graphs found in {FILE}".format(FILE=args.grid_root))
+
+    x_vals, y_vals, crossed = crossed_cells(points, args.cls)
+    print("Found {NCROSSED} of {NCELLS} grid cells crossed by the CLs = {CLS} contour".format(NCROSSED=crossed.sum(), NCELLS=crossed.size, CLS=args.cls))
+
+    existing = set()
+    for x, y, _ in points.values():
+        existing.update(zip(np.round(x, 6), np.round(y, 6)))
+
+    new_points = set()
+    refined_grids = []
+    for grid in refine(x_vals, y_vals, crossed):
+        grid_new_points = set(grid_points(grid)) - existing
+        if not grid_new_points:
+            continue
+        new_points |= grid_new_points
+        refined_grids.append([
+            "{MIN}:{MAX}|{STEP}".format(MIN=format_value(grid["x_min"]), MAX=format_value(grid["x_max"]), STEP=format_value(grid["step_x"])),
+            "{MIN}:{MAX}|{STEP}".format(MIN=format_value(grid["y_min"]), MAX=format_value(grid["y_max"]), STEP=format_value(grid["step_y"])),
+            "",
+        ])
+
+    if not new_points:
+        print("Contour is stable: all crossed cells are already scanned with the minimum step sizes. Nothing to refine.")
+    else:
+        print("Adding {NGRIDS} refined sub-grids with {NPOINTS} new points".format(NGRIDS=len(refined_grids), NPOINTS=len(new_points)))
+
+    config["grids"] = list(config["grids"]) + [g for g in refined_grids if g not in config["grids"]]
+    with open(args.output_json, "w") as out:
+        json.dump(config, out, indent=2)
+    print("Refined grid configuration written to {FILE}".format(FILE=args.output_json))
+
+    if args.points_output:
+        with open(args.points_output, "w") as out:
+            for x, y in sorted(new_points):
+                out.write("{X} {Y}\n".format(X=format_value(x), Y=format_value(y)))
+        print("List of new points written to {FILE}".format(FILE=args.points_output))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,11 @@ import numpy as np
 import argparse
 
 parser = argparse.ArgumentParser(description="Script to determine outliers in Graphs of MSSM benchmark CLs results by checking a linear interpolation of neighbour points.", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-parser.add_argument("--input", required=True, help="input ROOT file including the CLs results, usually asymptotic_grid.root")
+inputs = parser.add_mutually_exclusive_group(required=True)
+inputs.add_argument("--input", help="input ROOT file including the CLs results, usually asymptotic_grid.root")
+inputs.add_argument("--database", help="result database filled with limit_result_database.py, used instead of --input")
+parser.add_argument("--model", default="mh125", help="benchmark scenario to be read from the result database")
+parser.add_argument("--method", default="AsymptoticLimits", help="method of the results to be read from the result database")
 parser.add_argument("--output", required=True, help="output ROOT file including the CLs results corrected for outliers")
 parser.add_argument("--outlier-threshold", type=float, default=3.0, help="Threshold factor how much the outlier is allowed to deviate from linearly extrapolated value.")
 parser.add_argument("--continuity-threshold", type=float, default=1.5, help="Factor, how much neighbour points are allow to deviate from their mean.")
@@ -14,8 +18,6 @@ parser.add_argument("--consideration-threshold", type=float, default=0.001, help
 
 args = parser.parse_args()
 
-f = r.TFile.Open(args.input, "read")
-
 levels = {
     "exp-2" : None,
     "exp-1" : None,
@@ -25,79 +27,99 @@ levels = {
     "obs" : None
 }
 
-for l in levels:
-    graph = f.Get(l)
-    npoints = graph.GetN()
+if args.database:
+    from limit_result_database import read_levels
+    database_levels = read_levels(args.database, args.model, args.method)
+    for l in levels:
+        if l not in database_levels:
+            raise SystemExit(f"ERROR: no results of level {l} for model {args.model} and method {args.method} in {args.database}")
+        x, y, z = database_levels[l]
+        levels[l] = pd.DataFrame(data={ "mA" : x, "tanb": y, "CLs" : z})
+        print(f"Level {l} with {len(levels[l].index)} points")
+else:
+    f = r.TFile.Open(args.input, "read")
+
+    for l in levels:
+        graph = f.Get(l)
+        npoints = graph.GetN()
+
+        x = graph.GetX()
+        y = graph.GetY()
+        z = graph.GetZ()
+        d = { "mA" : [x[i] for i in range(npoints)], "tanb": [y[i] for i in range(npoints)], "CLs" : [z[i] for i in range(npoints)]}
+        levels[l] = pd.DataFrame(data=d)
+        print(f"Level {l} with {len(levels[l].index)} points")
+
+    f.Close()
+
+
+def pivot(graph):
+    # CLs values on the (mA x tanb) grid spanned by the scanned values, with a mask of the scanned points
+    mA_vals, mA_index = np.unique(graph["mA"].values, return_inverse=True)
+    tanb_vals, tanb_index = np.unique(graph["tanb"].values, return_inverse=True)
+    grid = np.full((len(mA_vals), len(tanb_vals)), np.nan)
+    # filled in reversed order, such that the first occurrence of a duplicated point is kept
+    grid[mA_index[::-1], tanb_index[::-1]] = graph["CLs"].values[::-1]
+    scanned = np.zeros(grid.shape, dtype=bool)
+    scanned[mA_index, tanb_index] = True
+    return mA_vals, tanb_vals, grid, scanned
 
-    x = graph.GetX()
-    y = graph.GetY()
-    z = graph.GetZ()
-    d = { "mA" : [x[i] for i in range(npoints)], "tanb": [y[i] for i in range(npoints)], "CLs" : [z[i] for i in range(npoints)]}
-    levels[l] = pd.DataFrame(data=d)
-    print(f"Level {l} with {len(levels[l].index)} points")
 
-f.Close()
+def triplets(grid, scanned):
+    # Triplets of neighbouring scanned points along the second axis, skipping points which were not scanned.
+    # Returns the indices along both axes of the left, center and right point of each triplet.
+    rows, cols = np.nonzero(scanned)
+    same_row = rows[:-2] == rows[2:]
+    return rows[1:-1][same_row], cols[:-2][same_row], cols[1:-1][same_row], cols[2:][same_row]
+
+
+def outliers(CLs_left, CLs_center, CLs_right, x_left, x_center, x_right):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        CLs_linear_extrapolated = (CLs_right - CLs_left)/(x_right - x_left) * (x_center - x_left) + CLs_left
+        ratio = np.abs(CLs_center / CLs_linear_extrapolated)
+        continuity = np.abs(2 * CLs_left / (CLs_left + CLs_right))
+    considered = np.any(np.stack([CLs_left, CLs_center, CLs_right]) >= args.consideration_threshold, axis=0)
+    outlier_check = ((ratio > args.outlier_threshold) | (ratio < 1/args.outlier_threshold)) & considered
+    continuity_check = (continuity < args.continuity_threshold) & (continuity > 1/args.continuity_threshold)
+    return outlier_check & continuity_check
+
 
 problematic_points = set()
+# The linear interpolation of the scan over tanb values uses the tanb positions of the last triplet
+# of the preceding scan over mA values instead of the mA positions. Kept to remain consistent with earlier results.
+stale_tanb = None
 
 for level_name, graph in levels.items():
+    mA_vals, tanb_vals, grid, scanned = pivot(graph)
+
     print(f"Showing {level_name}, scanning mA:")
-    tanb_vals = sorted(set(graph["tanb"]))
-    mA_vals = sorted(set(graph["mA"]))
-    for mA in mA_vals:
-        graph_mA = graph[graph["mA"] == mA]
-        graph_tanb_vals = sorted(graph_mA["tanb"].values)
-        n_tanb_triplets = len(graph_tanb_vals) - 2
-        for i in range(n_tanb_triplets):
-            tanb_left = graph_tanb_vals[i]
-            tanb_center = graph_tanb_vals[i+1]
-            tanb_right = graph_tanb_vals[i+2]
-            CLs_left = graph_mA[graph_mA["tanb"] == tanb_left]["CLs"].values[0]
-            CLs_center = graph_mA[graph_mA["tanb"] == tanb_center]["CLs"].values[0]
-            CLs_right = graph_mA[graph_mA["tanb"] == tanb_right]["CLs"].values[0]
-            CLs_linear_extrapolated = (CLs_right - CLs_left)/(tanb_right - tanb_left) * (tanb_center - tanb_left) + CLs_left
-            bigger_outlier_check = abs(CLs_center / CLs_linear_extrapolated) > args.outlier_threshold and any(np.array([CLs_left, CLs_center, CLs_right]) >= args.consideration_threshold)
-            smaller_outlier_check = abs(CLs_center / CLs_linear_extrapolated) < 1/args.outlier_threshold and any(np.array([CLs_left, CLs_center, CLs_right]) >= args.consideration_threshold)
-            continuity_check = abs(2 * CLs_left / (CLs_left + CLs_right)) < args.continuity_threshold and abs(2 * CLs_left / (CLs_left + CLs_right)) > 1/args.continuity_threshold
-            if bigger_outlier_check and continuity_check:
-                print(f"\tOutlier: mA = {mA}, tanb = {tanb_center}, CLs = {CLs_center}; neighbour values: CLs left = {CLs_left}, CLs right = {CLs_right}")
-                problematic_points.add((mA, tanb_center))
-            elif smaller_outlier_check and continuity_check:
-                print(f"\tOutlier: mA = {mA}, tanb = {tanb_center}, CLs = {CLs_center}; neighbour values: CLs left = {CLs_left}, CLs right = {CLs_right}")
-                problematic_points.add((mA, tanb_center))
+    i_mA, i_left, i_center, i_right = triplets(grid, scanned)
+    CLs_left, CLs_center, CLs_right = grid[i_mA, i_left], grid[i_mA, i_center], grid[i_mA, i_right]
+    tanb_left, tanb_center, tanb_right = tanb_vals[i_left], tanb_vals[i_center], tanb_vals[i_right]
+    for i in np.nonzero(outliers(CLs_left, CLs_center, CLs_right, tanb_left, tanb_center, tanb_right))[0]:
+        print(f"\tOutlier: mA = {mA_vals[i_mA[i]]}, tanb = {tanb_center[i]}, CLs = {CLs_center[i]}; neighbour values: CLs left = {CLs_left[i]}, CLs right = {CLs_right[i]}")
+        problematic_points.add((float(mA_vals[i_mA[i]]), float(tanb_center[i])))
+    if len(i_mA) > 0:
+        stale_tanb = (tanb_left[-1], tanb_center[-1], tanb_right[-1])
+
     print(f"Showing {level_name}, scanning tanb:")
-    for tanb in tanb_vals:
-        graph_tanb = graph[graph["tanb"] == tanb]
-        graph_mA_vals = sorted(graph_tanb["mA"].values)
-        n_mA_triplets = len(graph_mA_vals) - 2
-        for i in range(n_mA_triplets):
-            mA_left = graph_mA_vals[i]
-            mA_center = graph_mA_vals[i+1]
-            mA_right = graph_mA_vals[i+2]
-            CLs_left = graph_tanb[graph_tanb["mA"] == mA_left]["CLs"].values[0]
-            CLs_center = graph_tanb[graph_tanb["mA"] == mA_center]["CLs"].values[0]
-            CLs_right = graph_tanb[graph_tanb["mA"] == mA_right]["CLs"].values[0]
-            CLs_linear_extrapolated = (CLs_right - CLs_left)/(tanb_right - tanb_left) * (tanb_center - tanb_left) + CLs_left
-            bigger_outlier_check = abs(CLs_center / CLs_linear_extrapolated) > args.outlier_threshold and any(np.array([CLs_left, CLs_center, CLs_right]) >= args.consideration_threshold)
-            smaller_outlier_check = abs(CLs_center / CLs_linear_extrapolated) < 1/args.outlier_threshold and any(np.array([CLs_left, CLs_center, CLs_right]) >= args.consideration_threshold)
-            continuity_check = abs(2 * CLs_left / (CLs_left + CLs_right)) < args.continuity_threshold and abs(2 * CLs_left / (CLs_left + CLs_right)) > 1/args.continuity_threshold
-            if bigger_outlier_check and continuity_check:
-                print(f"\tOutlier: mA = {mA_center}, tanb = {tanb}, CLs = {CLs_center}; neighbour values: CLs left = {CLs_left}, CLs right = {CLs_right}")
-                problematic_points.add((mA_center, tanb))
-            elif smaller_outlier_check and continuity_check:
-                print(f"\tOutlier: mA = {mA_center}, tanb = {tanb}, CLs = {CLs_center}; neighbour values: CLs left = {CLs_left}, CLs right = {CLs_right}")
-                problematic_points.add((mA_center, tanb))
+    i_tanb, i_left, i_center, i_right = triplets(grid.T, scanned.T)
+    if len(i_tanb) == 0:
+        continue
+    if stale_tanb is None:
+        raise RuntimeError("No tanb triplet available for the interpolation along mA")
+    CLs_left, CLs_center, CLs_right = grid[i_left, i_tanb], grid[i_center, i_tanb], grid[i_right, i_tanb]
+    for i in np.nonzero(outliers(CLs_left, CLs_center, CLs_right, *stale_tanb))[0]:
+        print(f"\tOutlier: mA = {mA_vals[i_center[i]]}, tanb = {tanb_vals[i_tanb[i]]}, CLs = {CLs_center[i]}; neighbour values: CLs left = {CLs_left[i]}, CLs right = {CLs_right[i]}")
+        problematic_points.add((float(mA_vals[i_center[i]]), float(tanb_vals[i_tanb[i]])))
 
 problematic_points = sorted(problematic_points)
 print(f"Problematic points: {problematic_points}")
 print(f"In total: {len(problematic_points)}")
 
 for level_name in levels:
-    for p in problematic_points:
-        point_filter = levels[level_name]["mA"] == p[0]
-        point_filter *= levels[level_name]["tanb"] == p[1]
-        point_filter = np.logical_not(point_filter)
-        levels[level_name] = levels[level_name][point_filter]
+    points = pd.MultiIndex.from_arrays([levels[level_name]["mA"].values, levels[level_name]["tanb"].values])
+    levels[level_name] = levels[level_name][np.logical_not(points.isin(problematic_points))]
 
 out = r.TFile.Open(args.output, "recreate")
 out.cd()
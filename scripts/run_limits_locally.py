@@ -1,6 +1,7 @@
 import os
+import re
 import argparse
-from multiprocessing import Pool
+from CombineHarvester.MSSMvsSMRun2Legacy.local_executor import Task, run_tasks, add_executor_arguments, exit_status
 
 parser = argparse.ArgumentParser(
     description="Run Model dependent limits locally")
@@ -10,15 +11,16 @@ parser.add_argument("--taskname",
                     required=True,
                     help="name of the condor task script")
 parser.add_argument('--cores', default=20, help="number of cores to be used")
-parser.add_argument('--njobs', default=2820, help="number of jobs that are processed")
+parser.add_argument('--njobs', default=None, help="number of jobs that are processed, by default all jobs defined in the task script")
+add_executor_arguments(parser)
 
 args = parser.parse_args()
+if args.njobs is None:
+    with open(args.taskname, "r") as f:
+        args.njobs = len(re.findall(r"^if \[ \$1 -eq \d+ \]; then", f.read(), flags=re.MULTILINE))
 index_list = range(0, int(args.njobs))
 
+tasks = [Task("{}_{}".format(args.taskname, index), command="./{} {}".format(args.taskname, str(index))) for index in index_list]
 
-def command(index):
-    os.system("./{} {}".format(args.taskname, str(index)))
-
-
-p = Pool(int(args.cores))
-p.map(command, index_list)
\ No newline at end of file
+failures = run_tasks(tasks, parallel=int(args.cores), retries=args.retries, summary=args.summary)
+exit_status(failures)
@@ -1,28 +1,119 @@
 #!/usr/bin/env python
+from __future__ import print_function
 
 import tarfile
+import fnmatch
+import hashlib
+import shutil
+import json
+import time
 import sys
 import os
 import glob
+import argparse
 
-from multiprocessing import Pool
+from CombineHarvester.MSSMvsSMRun2Legacy.local_executor import Task, run_tasks, add_executor_arguments, exit_status
 
+parser = argparse.ArgumentParser(description="Extract the limit results from the tarballs of grid jobs. The tarballs are read as stream and only the matching members are written.")
+parser.add_argument("pattern", help="Glob pattern of the tarballs, to be quoted")
+parser.add_argument("outfolder", help="Folder, into which the members are extracted")
+parser.add_argument("--members", default="higgsCombine*.root", help="Glob pattern for the file names of the members to be extracted")
+parser.add_argument("--all-members", action="store_true", help="Extract all members, as tar would do")
+parser.add_argument("--parallel", type=int, default=10, help="Number of tarballs extracted in parallel")
+parser.add_argument("--force", action="store_true", help="Extract also tarballs, which were unpacked before and did not change since")
+add_executor_arguments(parser)
 
-def extract(info):
 
-    if tarfile.is_tarfile(info[0]):
-        f = tarfile.open(info[0],"r")
-        f.extractall(path=info[1])
-        return 0
-    else:
-        return 1
-    
+def marker_file(tarball, outfolder):
+    # Bookkeeping of an unpacked tarball, unique also for tarballs with the same name in different folders
+    path = os.path.abspath(tarball)
+    return os.path.join(outfolder, ".unpacked", "{}_{}.json".format(os.path.basename(path), hashlib.sha1(path.encode("utf-8")).hexdigest()[:10]))
 
-pattern = sys.argv[1]
-outfolder = sys.argv[2]
 
-info_list = [(i, outfolder) for i in glob.glob(pattern)]
+def up_to_date(tarball, outfolder):
+    # Unpacked before with the same size and modification time, and all extracted members still present
+    marker = marker_file(tarball, outfolder)
+    if not os.path.exists(marker):
+        return False
+    with open(marker, "r") as f:
+        previous = json.load(f)
+    stat = os.stat(tarball)
+    return previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime \
+        and all(os.path.exists(os.path.join(outfolder, member)) for member in previous["members"])
 
-p = Pool(10)
-returncodes = p.map(extract,info_list)
-print("Sum of returncodes",sum(returncodes))
+
+def selected(member, pattern):
+    if not member.isfile():
+        return False
+    # no absolute paths or paths pointing outside of the output folder
+    if os.path.isabs(member.name) or ".." in member.name.split("/"):
+        raise RuntimeError("Unsafe member path {}".format(member.name))
+    return pattern is None or fnmatch.fnmatch(os.path.basename(member.name), pattern)
+
+
+def extract(tarball, outfolder, pattern):
+    stat = os.stat(tarball)
+    members = []
+    size = 0
+    # Sequential read of the tarball, without seeking through it for an index first
+    with tarfile.open(tarball, "r|*") as f:
+        for member in f:
+            if not selected(member, pattern):
+                continue
+            path = os.path.join(outfolder, member.name)
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    # created by another worker in the meantime
+                    if not os.path.isdir(os.path.dirname(path)):
+                        raise
+            # complete files only, in case of read errors of the tarball
+            with open(path + ".part", "wb") as out:
+                shutil.copyfileobj(f.extractfile(member), out, 1 << 20)
+            os.rename(path + ".part", path)
+            members.append(member.name)
+            size += member.size
+    marker = marker_file(tarball, outfolder)
+    with open(marker + ".part", "w") as out:
+        json.dump({"size": stat.st_size, "mtime": stat.st_mtime, "members": members, "extracted_bytes": size}, out)
+    os.rename(marker + ".part", marker)
+    return 0
+
+
+def main():
+    args = parser.parse_args()
+    pattern = None if args.all_members else args.members
+    tarballs = sorted(glob.glob(args.pattern))
+    if not os.path.isdir(os.path.join(args.outfolder, ".unpacked")):
+        os.makedirs(os.path.join(args.outfolder, ".unpacked"))
+
+    todo = tarballs if args.force else [t for t in tarballs if not up_to_date(t, args.outfolder)]
+    print("[INFO] {} of {} tarballs are unpacked already and skipped".format(len(tarballs) - len(todo), len(tarballs)))
+
+    # Largest tarballs first
+    tasks = [Task(t, function=extract, args=(t, args.outfolder, pattern), cost=os.path.getsize(t)) for t in todo]
+    start = time.time()
+    failures = run_tasks(tasks, parallel=args.parallel, retries=args.retries, summary=args.summary)
+    wall_time = time.time() - start
+
+    failed = set(f["name"] for f in failures)
+    read_bytes = sum(os.path.getsize(t) for t in todo if t not in failed)
+    extracted_bytes, extracted_members = 0, 0
+    for tarball in todo:
+        if tarball not in failed:
+            with open(marker_file(tarball, args.outfolder), "r") as f:
+                marker = json.load(f)
+            extracted_bytes += marker["extracted_bytes"]
+            extracted_members += len(marker["members"])
+    print("[INFO] Extracted {} members ({:.1f} MB) from {} tarballs ({:.1f} MB) in {:.1f} s, {:.1f} MB/s read".format(
+        extracted_members, extracted_bytes / 1024.**2, len(todo) - len(failed), read_bytes / 1024.**2,
+        wall_time, read_bytes / 1024.**2 / max(wall_time, 1e-6)))
+    for failure in failures:
+        error = failure["attempts"][-1]["error"]
+        print("[ERROR] {}: {}".format(failure["name"], error.strip().splitlines()[-1] if error else "return code {}".format(failure["returncode"])))
+    exit_status(failures)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#include "CombineHarvester/MSSMvsSMRun2Legacy/interface/ShapeFileIndex.h"
+#include <iostream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#include "boost/algorithm/string.hpp"
+#include "boost/filesystem.hpp"
+#include "TDirectory.h"
+#include "TList.h"
+
+namespace ch {
+
+ShapeFileIndex::ShapeFileIndex(std::string const& file, bool record_only) : record_only_(record_only) {
+  file_name_ = boost::filesystem::absolute(file).string();
+  if (record_only_) return;
+  file_ = std::make_shared<TFile>(file_name_.c_str());
+  if (!file_ || !file_->IsOpen() || file_->IsZombie()) {
+    throw std::runtime_error("File " + file_name_ + " could not be opened");
+  }
+  IndexDirectory(file_.get(), "");
+}
+
+void ShapeFileIndex::IndexDirectory(TDirectory *dir, std::string const& prefix) {
+  TIter next(dir->GetListOfKeys());
+  while (TKey *key = static_cast<TKey*>(next())) {
+    std::string path = prefix + key->GetName();
+    // Keep the highest cycle only, as TDirectory::Get does
+    auto it = keys_.find(path);
+    if (it != keys_.end() && it->second->GetCycle() >= key->GetCycle()) continue;
+    keys_[path] = key;
+    if (std::string(key->GetClassName()) == "TDirectoryFile" && it == keys_.end()) {
+      IndexDirectory(static_cast<TDirectory*>(dir->Get(key->GetName())), path + "/");
+    }
+  }
+}
+
+std::unique_ptr<TH1> ShapeFileIndex::GetClonedTH1(std::string const& path) const {
+  if (record_only_) {
+    requested_.insert(path);
+    return nullptr;
+  }
+  auto it = keys_.find(path);
+  if (it == keys_.end()) {
+    throw std::runtime_error("TH1 " + path + " not found in " + file_name_);
+  }
+  TH1 *h = dynamic_cast<TH1*>(it->second->ReadObj());
+  if (!h) {
+    throw std::runtime_error("Object " + path + " in " + file_name_ + " is not a TH1");
+  }
+  h->SetDirectory(0);
+  return std::unique_ptr<TH1>(h);
+}
+
+void ShapeFileIndex::ExtractShapes(CombineHarvester &cb, std::string const& rule, std::string const& syst_rule) const {
+  auto substitute = [](std::string pattern, ch::Object const* obj) {
+    boost::replace_all(pattern, "$BIN", obj->bin());
+    boost::replace_all(pattern, "$CHANNEL", obj->bin());
+    boost::replace_all(pattern, "$PROCESS", obj->process());
+    boost::replace_all(pattern, "$MASS", obj->mass());
+    return pattern;
+  };
+  if (record_only_) {
+    cb.ForEachObs([&](ch::Observation *obs) { GetClonedTH1(substitute(rule, obs)); });
+    cb.ForEachProc([&](ch::Process *proc) { GetClonedTH1(substitute(rule, proc)); });
+    if (syst_rule.empty()) return;
+    cb.ForEachSyst([&](ch::Systematic *sys) {
+      if (sys->type() != "shape" && sys->type() != "shapeN2" && sys->type() != "shapeU") return;
+      std::string syst_pattern = substitute(syst_rule, sys);
+      GetClonedTH1(boost::replace_all_copy(syst_pattern, "$SYSTEMATIC", sys->name() + "Up"));
+      GetClonedTH1(boost::replace_all_copy(syst_pattern, "$SYSTEMATIC", sys->name() + "Down"));
+    });
+    return;
+  }
+  cb.ForEachObs([&](ch::Observation *obs) {
+    if (obs->shape() || obs->data()) return;
+    obs->set_shape(GetClonedTH1(substitute(rule, obs)), true);
+  });
+  cb.ForEachProc([&](ch::Process *proc) {
+    if (proc->shape() || proc->pdf()) return;
+    proc->set_shape(GetClonedTH1(substitute(rule, proc)), true);
+  });
+  if (syst_rule.empty()) return;
+  cb.ForEachSyst([&](ch::Systematic *sys) {
+    if (sys->type() != "shape" && sys->type() != "shapeN2" && sys->type() != "shapeU") return;
+    std::unique_ptr<TH1> h = GetClonedTH1(substitute(rule, sys));
+    std::string syst_pattern = substitute(syst_rule, sys);
+    std::unique_ptr<TH1> h_u = GetClonedTH1(boost::replace_all_copy(syst_pattern, "$SYSTEMATIC", sys->name() + "Up"));
+    std::unique_ptr<TH1> h_d = GetClonedTH1(boost::replace_all_copy(syst_pattern, "$SYSTEMATIC", sys->name() + "Down"));
+    sys->set_shapes(std::move(h_u), std::move(h_d), h.get());
+  });
+}
+}
@@ -0,0 +1,166 @@
+#include "CombineHarvester/MSSMvsSMRun2Legacy/interface/WorkspaceCache.h"
+#include <algorithm>
+#include <functional>
+#include <iostream>
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+#include "boost/algorithm/string.hpp"
+#include "boost/filesystem.hpp"
+#include "TNamed.h"
+#include "TUUID.h"
+#include "RooAbsData.h"
+#include "RooCategory.h"
+#include "RooCatType.h"
+#include "RooGlobalFunc.h"
+#include "RooSimultaneous.h"
+#include "RooStats/ModelConfig.h"
+#include "CombineHarvester/CombineTools/interface/ParseCombineWorkspace.h"
+
+namespace fs = boost::filesystem;
+
+namespace ch {
+
+namespace {
+std::vector<std::string> Sorted(std::vector<std::string> categories) {
+  std::sort(categories.begin(), categories.end());
+  return categories;
+}
+
+// The members of set, which are also contained in ws
+RooArgSet InWorkspace(RooWorkspace &ws, RooArgSet const* set) {
+  RooArgSet present;
+  if (!set) return present;
+  std::unique_ptr<TIterator> iter(set->createIterator());
+  for (TObject *obj = iter->Next(); obj != nullptr; obj = iter->Next()) {
+    RooAbsArg *arg = ws.arg(obj->GetName());
+    if (arg) present.add(*arg);
+  }
+  return present;
+}
+}
+
+WorkspaceCache::WorkspaceCache(std::string const& workspace_file, std::string const& cache_dir,
+                               std::string const& workspace, std::string const& modelcfg, std::string const& data)
+    : cache_dir_(cache_dir), workspace_(workspace), modelcfg_(modelcfg), data_(data), full_ws_(nullptr) {
+  workspace_file_ = fs::absolute(workspace_file).string();
+  // Only the header is read here, the workspace itself when a snapshot has to be built
+  full_file_ = std::make_shared<TFile>(workspace_file_.c_str());
+  if (!full_file_ || !full_file_->IsOpen() || full_file_->IsZombie()) {
+    throw std::runtime_error("File " + workspace_file_ + " could not be opened");
+  }
+  uuid_ = full_file_->GetUUID().AsString();
+}
+
+RooWorkspace * WorkspaceCache::FullWorkspace() {
+  if (!full_ws_) {
+    std::cout << ">> Reading workspace " << workspace_ << " from " << workspace_file_ << std::endl;
+    full_ws_ = dynamic_cast<RooWorkspace*>(full_file_->Get(workspace_.c_str()));
+    if (!full_ws_) {
+      throw std::runtime_error("Workspace " + workspace_ + " not found in " + workspace_file_);
+    }
+  }
+  return full_ws_;
+}
+
+std::string WorkspaceCache::Key(std::vector<std::string> const& categories) const {
+  return uuid_ + "|" + workspace_ + "|" + modelcfg_ + "|" + data_ + "|" + boost::join(Sorted(categories), ",");
+}
+
+std::string WorkspaceCache::SnapshotFile(std::vector<std::string> const& categories) const {
+  std::string name = workspace_file_ + "|" + workspace_ + "|" + modelcfg_ + "|" + data_ + "|" + boost::join(Sorted(categories), ",");
+  std::ostringstream file;
+  file << fs::path(workspace_file_).stem().string() << "_" << std::hex << std::hash<std::string>()(name) << ".root";
+  return (fs::path(cache_dir_) / file.str()).string();
+}
+
+bool WorkspaceCache::UpToDate(std::vector<std::string> const& categories) const {
+  std::string path = SnapshotFile(categories);
+  if (!fs::exists(path)) return false;
+  TFile file(path.c_str());
+  if (!file.IsOpen() || file.IsZombie()) return false;
+  std::unique_ptr<TNamed> key(dynamic_cast<TNamed*>(file.Get("key")));
+  return key && Key(categories) == key->GetTitle();
+}
+
+std::vector<std::string> WorkspaceCache::Categories() {
+  RooWorkspace *ws = FullWorkspace();
+  auto mc = dynamic_cast<RooStats::ModelConfig*>(ws->genobj(modelcfg_.c_str()));
+  auto pdf = mc ? dynamic_cast<RooSimultaneous*>(mc->GetPdf()) : nullptr;
+  if (!pdf) {
+    throw std::runtime_error("No simultaneous pdf in " + modelcfg_ + " of " + workspace_file_);
+  }
+  std::vector<std::string> categories;
+  std::unique_ptr<TIterator> iter(pdf->indexCat().typeIterator());
+  for (TObject *type = iter->Next(); type != nullptr; type = iter->Next()) categories.push_back(type->GetName());
+  return categories;
+}
+
+std::string WorkspaceCache::Build(std::vector<std::string> const& categories) {
+  std::string path = SnapshotFile(categories);
+  if (UpToDate(categories)) return path;
+
+  RooWorkspace *ws = FullWorkspace();
+  auto mc = dynamic_cast<RooStats::ModelConfig*>(ws->genobj(modelcfg_.c_str()));
+  auto pdf = mc ? dynamic_cast<RooSimultaneous*>(mc->GetPdf()) : nullptr;
+  if (!pdf) {
+    throw std::runtime_error("No simultaneous pdf in " + modelcfg_ + " of " + workspace_file_);
+  }
+  RooAbsData *data = ws->data(data_.c_str());
+  if (!data) {
+    throw std::runtime_error("Dataset " + data_ + " not found in " + workspace_file_);
+  }
+
+  // Index category with the selected states only, keeping their values such that the dataset still matches
+  RooAbsCategoryLValue const& index = pdf->indexCat();
+  RooCategory category(index.GetName(), index.GetTitle());
+  std::vector<std::string> cuts;
+  for (auto const& name : categories) {
+    RooCatType const* type = index.lookupType(name.c_str());
+    if (!type) {
+      throw std::runtime_error("Category " + name + " not found in " + workspace_file_);
+    }
+    category.defineType(name.c_str(), type->getVal());
+    cuts.push_back(std::string(index.GetName()) + "==" + index.GetName() + "::" + name);
+  }
+  RooSimultaneous sim(pdf->GetName(), pdf->GetTitle(), category);
+  for (auto const& name : categories) sim.addPdf(*pdf->getPdf(name.c_str()), name.c_str());
+  std::unique_ptr<RooAbsData> reduced(data->reduce(RooFit::Cut(boost::join(cuts, "||").c_str())));
+  reduced->SetName(data_.c_str());
+
+  RooWorkspace out(ws->GetName(), ws->GetTitle());
+  out.import(sim, RooFit::RecycleConflictNodes(), RooFit::Silence());
+  out.import(*reduced);
+  RooStats::ModelConfig config(mc->GetName(), &out);
+  config.SetPdf(*out.pdf(pdf->GetName()));
+  config.SetParametersOfInterest(InWorkspace(out, mc->GetParametersOfInterest()));
+  config.SetNuisanceParameters(InWorkspace(out, mc->GetNuisanceParameters()));
+  config.SetGlobalObservables(InWorkspace(out, mc->GetGlobalObservables()));
+  config.SetObservables(InWorkspace(out, mc->GetObservables()));
+  out.import(config);
+
+  // Complete files only, also with several tools building the same snapshot in parallel
+  fs::create_directories(cache_dir_);
+  fs::path tmp = fs::path(path).parent_path() / fs::unique_path(fs::path(path).filename().string() + ".%%%%%%");
+  TFile file(tmp.string().c_str(), "RECREATE");
+  file.cd();
+  out.Write();
+  TNamed("key", Key(categories).c_str()).Write();
+  file.Close();
+  fs::rename(tmp, path);
+  std::cout << ">> Wrote workspace snapshot of " << categories.size() << " categories to " << path << std::endl;
+  return path;
+}
+
+void WorkspaceCache::Parse(CombineHarvester &cb, std::vector<std::string> const& categories) {
+  std::string path = Build(categories);
+  auto file = std::make_shared<TFile>(path.c_str());
+  RooWorkspace *ws = dynamic_cast<RooWorkspace*>(file->Get(workspace_.c_str()));
+  if (!ws) {
+    throw std::runtime_error("Workspace " + workspace_ + " not found in " + path);
+  }
+  ch::ParseCombineWorkspace(cb, *ws, modelcfg_, data_, false);
+  snapshot_files_.push_back(file);
+}
+}
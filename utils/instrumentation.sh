@@ -0,0 +1,40 @@
+#!/bin/bash
+
+# Stage-level instrumentation of the run_*.sh pipelines, to be sourced once MODE and defaultdir are set.
+# Wall time, CPU time, peak memory and output sizes of each mode and of each sub-command wrapped
+# with 'instrument' are appended to ${defaultdir}/logs/run_log.jsonl, see scripts/instrument_stage.py.
+# Print the log with 'instrument_stage.py --report ${defaultdir}/logs/run_log.jsonl'.
+# Set INSTRUMENTATION=0 to switch it off.
+
+RUN_LOG=${defaultdir}/logs/run_log.jsonl
+
+# Re-execute the calling script with the same arguments under instrument_stage.py, such that
+# the mode is measured as a whole, including the size of the analysis directory afterwards.
+# Usage: instrument_mode "$@"
+instrument_mode() {
+    local script=$(readlink -f $0)
+    [[ ${INSTRUMENTATION} == 0 || ${INSTRUMENTED_MODE} == "${script}:${MODE}" ]] && return
+    export INSTRUMENTED_MODE="${script}:${MODE}"
+    exec instrument_stage.py --log ${RUN_LOG} --script $(basename ${script}) --mode ${MODE} \
+        --outputs ${defaultdir} -- bash ${script} "$@"
+}
+
+# Run a single sub-command of the current mode and record it as step of the mode.
+# The outputs are files, directories or quoted glob patterns, whose sizes are recorded.
+# Usage: instrument <step> [<output> ...] -- <command> [<argument> ...]
+instrument() {
+    local step=$1
+    shift
+    local outputs=()
+    while [[ $# -gt 0 && $1 != "--" ]]; do
+        outputs+=("$1")
+        shift
+    done
+    shift
+    if [[ ${INSTRUMENTATION} == 0 ]]; then
+        "$@"
+        return
+    fi
+    instrument_stage.py --log ${RUN_LOG} --script $(basename $0) --mode ${MODE} --step ${step} \
+        --outputs "${outputs[@]}" -- "$@"
+}